@@ -0,0 +1,304 @@
+"""
+autocompletado.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Índice de búsqueda aproximada de direcciones del callejero para autocompletar mientras se
+escribe, sin depender del formato exacto que exige callejero.busca_direccion:
+    - Búsqueda por prefijo: array ordenado con los nombres normalizados de las calles (ver
+      callejero.normaliza) y cada uno de sus finales de palabra ("AGUI" encuentra "ALBERTO
+      AGUILERA"), en el que se busca con bisect.
+    - Búsqueda aproximada: listas de las calles que contienen cada trigrama de su nombre; las
+      calles con más trigramas en común con el texto se ordenan por su similitud (Jaccard), de
+      forma que las erratas y las tildes que faltan no impiden encontrarlas.
+    - Número: los portales de cada calle se guardan ordenados, y si el número pedido no existe
+      se elige el más cercano del mismo lado de la calle (misma paridad).
+
+Cada consulta tarda del orden de decenas de microsegundos, así que puede atender cada
+pulsación de un campo de autocompletado (ver el servicio /autocompleta de servicio_gps.py).
+
+Uso:
+    indice = indice_autocompletado(callejero)
+    indice.busca("c alberto agilera 24")  # [{'direccion': 'CALLE DE ALBERTO AGUILERA, 24', ...}, ...]
+"""
+
+from typing import List, Dict, Tuple
+import bisect
+import re
+import weakref
+
+import numpy as np
+import pandas as pd
+
+import callejero as c
+import metricas
+
+LIMITE_RESULTADOS = 5
+MAX_CANDIDATOS = 500  # Entradas del array de prefijos que se revisan como mucho en cada consulta
+SIMILITUD_MINIMA = 0.2  # Similitud de trigramas por debajo de la cual no se sugiere una calle
+# Abreviaturas habituales de las clases de vía
+ABREVIATURAS = {'C': 'CALLE', 'C/': 'CALLE', 'CL': 'CALLE', 'CLL': 'CALLE', 'AV': 'AVENIDA', 'AVD': 'AVENIDA',
+                'AVDA': 'AVENIDA', 'PZA': 'PLAZA', 'PL': 'PLAZA', 'PS': 'PASEO', 'PO': 'PASEO', 'Pº': 'PASEO',
+                'CTRA': 'CARRETERA', 'GTA': 'GLORIETA', 'RDA': 'RONDA', 'TRV': 'TRAVESIA'}
+PARTICULAS = ('DE LA', 'DE LAS', 'DE LOS', 'DE EL', 'DEL', 'DE')
+
+# Índices ya construidos para cada DataFrame del callejero, junto a una referencia débil al DataFrame
+_indices = {}
+
+
+def trigramas(texto: str, final: bool = True) -> set:
+    """ Trigramas de un texto con dos espacios delante (y uno detrás si final es True), de forma
+    que el principio de las palabras cuenta más.
+
+    Args:
+        texto (str): texto normalizado
+        final (bool): si es False no se marca el final del texto (para textos que aún se escriben)
+    Returns:
+        set: trigramas del texto
+    Example:
+        trigramas("SOL") = {"  S", " SO", "SOL", "OL "}
+    """
+    relleno = f"  {texto} " if final else f"  {texto}"
+    return {relleno[i:i+3] for i in range(len(relleno) - 2)}
+
+
+class IndiceAutocompletado:
+    """ Índice de calles y portales del callejero para búsquedas por prefijo y aproximadas.
+
+    Las calles se numeran de 0 a calles-1 y sus portales se guardan en formato CSR: los de la
+    calle k están en las posiciones inicio[k]:inicio[k+1] de numeros y filas, ordenados por número.
+
+    Attributes:
+        clases, pares, nombres (List[str]): clase de vía, partícula y nombre originales de cada calle
+        normalizados (List[str]): nombre normalizado de cada calle
+        inicio (np.ndarray): posición en numeros del primer portal de cada calle (calles+1 valores)
+        numeros (np.ndarray): número de cada portal
+        filas (np.ndarray): posición de cada portal en el DataFrame del callejero
+        latitudes, longitudes (np.ndarray): coordenadas de cada portal
+        nodos (np.ndarray o None): vértice del grafo de cada portal, si el callejero tiene la columna NODO
+        claves (List[str]): finales de palabra de los nombres normalizados, ordenados
+        calles_claves (List[int]): calle de cada clave
+        primeras (List[bool]): si cada clave es el nombre completo (empieza en la primera palabra)
+        clases_normalizadas (set): clases de vía normalizadas que existen en el callejero
+    """
+
+    def __init__(self, callejero: pd.DataFrame):
+        columnas = [callejero[columna].fillna("").astype(str).to_numpy(dtype=object)
+                    for columna in ['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE']]
+        codigos, calles = pd.factorize(pd.MultiIndex.from_arrays(columnas))
+        numeros = callejero['NUMERO'].to_numpy(dtype=np.int64)
+        orden = np.lexsort((numeros, codigos))
+        self.clases = [clase for clase, _, _ in calles]
+        self.pares = [par for _, par, _ in calles]
+        self.nombres = [nombre for _, _, nombre in calles]
+        self.normalizados = [c.normaliza(nombre) for nombre in self.nombres]
+        self._clases_calles = [c.normaliza(clase) for clase in self.clases]
+        self._pares_calles = [c.normaliza(par) for par in self.pares]
+        self.clases_normalizadas = set(self._clases_calles)
+        self.inicio = np.searchsorted(codigos[orden], np.arange(len(calles) + 1))
+        self.numeros = numeros[orden]
+        self.filas = orden
+        self.latitudes = callejero['LATITUD'].to_numpy(dtype=np.float64)[orden]
+        self.longitudes = callejero['LONGITUD'].to_numpy(dtype=np.float64)[orden]
+        self.nodos = callejero['NODO'].to_numpy()[orden] if 'NODO' in callejero.columns else None
+
+        # Array ordenado de prefijos: cada nombre a partir de cada una de sus palabras
+        entradas = []
+        for calle, nombre in enumerate(self.normalizados):
+            palabras = nombre.split()
+            for i in range(len(palabras)):
+                entradas.append((' '.join(palabras[i:]), calle, i == 0))
+        entradas.sort()
+        self.claves = [clave for clave, _, _ in entradas]
+        self.calles_claves = [calle for _, calle, _ in entradas]
+        self.primeras = [primera for _, _, primera in entradas]
+
+        # Listas de calles de cada trigrama y número de trigramas de cada calle
+        listas = {}
+        for calle, nombre in enumerate(self.normalizados):
+            for trigrama in trigramas(nombre):
+                listas.setdefault(trigrama, []).append(calle)
+        self._trigramas = {trigrama: np.array(calles_trigrama, dtype=np.int32) for trigrama, calles_trigrama in listas.items()}
+        self._numero_trigramas = np.array([len(trigramas(nombre)) for nombre in self.normalizados], dtype=np.int32)
+
+    @property
+    def calles(self) -> int:
+        return len(self.nombres)
+
+    def interpreta(self, texto: str) -> Tuple[str, str, str, int]:
+        """ Separa un texto escrito por el usuario en clase de vía, partícula, nombre y número.
+
+        La clase solo se reconoce si es la primera palabra, hay más texto detrás y es una clase
+        del callejero o una abreviatura conocida. La partícula (de, del, de la...) es la que
+        sigue a la clase, y el número es el último número del texto, si lo hay.
+
+        Args:
+            texto (str): texto escrito, completo o a medias
+        Returns:
+            Tuple[str,str,str,int]: clase y partícula normalizadas (o ""), nombre normalizado y
+                número (o None)
+        Example:
+            interpreta("Av. de la Ilustración, 12") = ("AVENIDA", "DE LA", "ILUSTRACION", 12)
+        """
+        numero = None
+        encontrado = re.search(r"[\s,]+(\d+)\s*$", texto)
+        if encontrado is not None:
+            numero = int(encontrado.group(1))
+            texto = texto[:encontrado.start()]
+        palabras = c.normaliza(texto.replace(',', ' ').replace('.', ' ')).split()
+        clase = par = ""
+        if len(palabras) > 1:
+            primera = ABREVIATURAS.get(palabras[0], palabras[0])
+            if primera in self.clases_normalizadas:
+                clase = primera
+                palabras = palabras[1:]
+                for particula in PARTICULAS:
+                    partes = particula.split()
+                    if palabras[:len(partes)] == partes and len(palabras) > len(partes):
+                        par = particula
+                        palabras = palabras[len(partes):]
+                        break
+        return clase, par, ' '.join(palabras), numero
+
+    def _via(self, calle: int, clase: str, par: str) -> float:
+        """ Puntuación extra de una calle por coincidir con la clase y la partícula escritas. """
+        if not clase or self._clases_calles[calle] != clase:
+            return 0.0
+        return 0.5 + (0.25 if self._pares_calles[calle] == par else 0.0)
+
+    def _prefijo(self, nombre: str, clase: str, par: str) -> Dict[int, float]:
+        """ Puntuación de las calles con alguna palabra que empieza por nombre. """
+        puntuaciones = {}
+        posicion = bisect.bisect_left(self.claves, nombre)
+        final = min(len(self.claves), posicion + MAX_CANDIDATOS)
+        while posicion < final and self.claves[posicion].startswith(nombre):
+            calle = self.calles_claves[posicion]
+            # Coincidencias desde la primera palabra, nombres completos y clase pedida primero
+            puntuacion = 2.0 + (1.0 if self.primeras[posicion] else 0.0) \
+                         + (1.0 if self.claves[posicion] == nombre and self.primeras[posicion] else 0.0) \
+                         + self._via(calle, clase, par)
+            if puntuacion > puntuaciones.get(calle, 0.0):
+                puntuaciones[calle] = puntuacion
+            posicion += 1
+        return puntuaciones
+
+    def _aproximada(self, nombre: str, clase: str, par: str, limite: int) -> Dict[int, float]:
+        """ Puntuación (similitud de trigramas, menor que 2) de las calles parecidas a nombre. """
+        trigramas_nombre = trigramas(nombre, final=False)
+        listas = [self._trigramas[trigrama] for trigrama in trigramas_nombre if trigrama in self._trigramas]
+        if not listas:
+            return {}
+        comunes = np.bincount(np.concatenate(listas), minlength=self.calles)
+        candidatas = np.flatnonzero(comunes)
+        if len(candidatas) > 4 * limite:
+            candidatas = candidatas[np.argpartition(-comunes[candidatas], 4 * limite)[:4 * limite]]
+        # Similitud de Jaccard entre los trigramas del texto y los del comienzo de cada nombre
+        similitudes = comunes[candidatas] / (len(trigramas_nombre) + np.minimum(
+            self._numero_trigramas[candidatas], len(trigramas_nombre) + 2) - comunes[candidatas])
+        puntuaciones = {}
+        for calle, similitud in zip(candidatas.tolist(), similitudes.tolist()):
+            if similitud >= SIMILITUD_MINIMA:
+                puntuaciones[calle] = similitud + self._via(calle, clase, par)
+        return puntuaciones
+
+    def portal(self, calle: int, numero: int = None) -> int:
+        """ Posición (en numeros) del portal de una calle más cercano a un número.
+
+        Se prefiere el mismo lado de la calle (números de la misma paridad) si tiene portales y,
+        entre dos igual de cercanos, el menor. Sin número se devuelve el primer portal.
+
+        Args:
+            calle (int): número de la calle en el índice
+            numero (int, opcional): número pedido
+        Returns:
+            int: posición del portal
+        """
+        inicio, final = self.inicio[calle], self.inicio[calle + 1]
+        if numero is None:
+            return int(inicio)
+        numeros = self.numeros[inicio:final]
+        candidatos = np.flatnonzero(numeros % 2 == numero % 2)
+        if not len(candidatos):
+            candidatos = np.arange(len(numeros))
+        return int(inicio + candidatos[np.argmin(np.abs(numeros[candidatos] - numero))])
+
+    @metricas.instrumenta('autocompleta')
+    def busca(self, texto: str, limite: int = LIMITE_RESULTADOS) -> List[Dict[str, object]]:
+        """ Busca las direcciones que mejor encajan con un texto, completo o a medias.
+
+        Primero se buscan las calles con alguna palabra que empiece por el nombre escrito y, si
+        no hay bastantes, las de nombre parecido. Cada calle se sugiere con el portal más cercano
+        al número escrito.
+
+        Args:
+            texto (str): texto escrito por el usuario (por ejemplo "c alberto agilera 24")
+            limite (int): número máximo de resultados
+        Returns:
+            List[Dict[str,object]]: resultados de mejor a peor, con la dirección en el formato
+                de busca_direccion ('direccion'), sus partes ('via_clase', 'via_par',
+                'via_nombre' y 'numero'), el número pedido ('numero_pedido') y si existe
+                ('exacto'), 'latitud', 'longitud', la fila del callejero ('fila'), la
+                puntuación ('puntuacion') y, si el callejero lo tiene, el vértice ('nodo')
+        """
+        clase, par, nombre, numero = self.interpreta(texto)
+        if not nombre or limite <= 0:
+            return []
+        puntuaciones = self._prefijo(nombre, clase, par)
+        if len(puntuaciones) < limite:
+            for calle, puntuacion in self._aproximada(nombre, clase, par, limite).items():
+                puntuaciones.setdefault(calle, puntuacion)
+        # A igual puntuación, primero los nombres más cortos y las calles con más portales
+        mejores = sorted(puntuaciones, key=lambda calle: (-puntuaciones[calle], len(self.normalizados[calle]),
+                                                          self.inicio[calle] - self.inicio[calle + 1], calle))[:limite]
+        resultados = []
+        for calle in mejores:
+            k = self.portal(calle, numero)
+            numero_portal = int(self.numeros[k])
+            via = " ".join(parte for parte in (self.clases[calle], self.pares[calle], self.nombres[calle]) if parte)
+            resultado = {'direccion': f"{via}, {numero_portal}", 'via_clase': self.clases[calle],
+                         'via_par': self.pares[calle], 'via_nombre': self.nombres[calle], 'numero': numero_portal,
+                         'numero_pedido': numero, 'exacto': numero == numero_portal,
+                         'latitud': float(self.latitudes[k]), 'longitud': float(self.longitudes[k]),
+                         'fila': int(self.filas[k]), 'puntuacion': round(puntuaciones[calle], 3)}
+            if self.nodos is not None:
+                resultado['nodo'] = self.nodos[k].item()
+            resultados.append(resultado)
+        return resultados
+
+
+def indice_autocompletado(callejero: pd.DataFrame) -> IndiceAutocompletado:
+    """ Devuelve el índice de autocompletado de un callejero, construyéndolo la primera vez que
+    se pide para ese DataFrame (como callejero.indice_callejero).
+
+    El índice no se actualiza si el DataFrame se modifica después de construirlo.
+
+    Args:
+        callejero (DataFrame): DataFrame del callejero (salida de carga_callejero)
+    Returns:
+        IndiceAutocompletado: índice del callejero
+    """
+    clave = id(callejero)
+    entrada = _indices.get(clave)
+    if entrada is None or entrada[0]() is not callejero:
+        # Cuando el DataFrame deja de existir borramos su índice
+        referencia = weakref.ref(callejero, lambda _: _indices.pop(clave, None))
+        entrada = (referencia, IndiceAutocompletado(callejero))
+        _indices[clave] = entrada
+    return entrada[1]
+
+
+def sugerencias(texto: str, callejero: pd.DataFrame, limite: int = 3) -> List[str]:
+    """ Direcciones del callejero parecidas a un texto, en el formato de busca_direccion.
+
+    Args:
+        texto (str): texto escrito por el usuario
+        callejero (DataFrame): DataFrame del callejero
+        limite (int): número máximo de sugerencias
+    Returns:
+        List[str]: direcciones sugeridas, de mejor a peor
+    Example:
+        sugerencias("calle alberto agilera, 23", callejero) = ["CALLE DE ALBERTO AGUILERA, 23", ...]
+    """
+    return [resultado['direccion'] for resultado in indice_autocompletado(callejero).busca(texto, limite)]
@@ -0,0 +1,75 @@
+"""
+bench_a_estrella.py
+
+Compara, sobre pares origen/destino aleatorios del grafo de Madrid, el número de vértices
+fijados y el tiempo de cálculo de:
+    - dijkstra: árbol de caminos mínimos completo desde el origen (camino_minimo original)
+    - dijkstra con parada: Dijkstra que se detiene al fijar el destino
+    - A*: búsqueda guiada por la distancia en línea recta hasta el destino
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_a_estrella --pares 200 --semilla 0
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import callejero as c
+import gps
+from grafo_compilado import compila_grafo
+from grafo_pesado import dijkstra_compilado, camino_minimo_compilado, a_estrella
+
+
+def mide(funcion, *args) -> tuple:
+    """ Ejecuta funcion(*args, estadisticas) y devuelve (segundos, vértices fijados), o None si
+    no hay camino."""
+    estadisticas = {}
+    inicio = time.perf_counter()
+    try:
+        funcion(*args, estadisticas=estadisticas)
+    except ValueError:
+        return None
+    return time.perf_counter() - inicio, estadisticas['nodos_asentados']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pares', type=int, default=100, help='número de pares origen/destino')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los pares aleatorios')
+    args = parser.parse_args()
+
+    digrafo = c.procesa_grafo(c.carga_grafo())
+    pesos = list(gps.FACTORES_HEURISTICA)
+    grafo = compila_grafo(digrafo, pesos)
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas")
+
+    rnd = random.Random(args.semilla)
+    pares = [(rnd.randrange(grafo.n), rnd.randrange(grafo.n)) for _ in range(args.pares)]
+    for peso in pesos:
+        factor = gps.FACTORES_HEURISTICA[peso]
+        resultados = {'dijkstra': [], 'dijkstra con parada': [], 'A*': []}
+        for origen, destino in pares:
+            medidas = [mide(dijkstra_compilado, grafo, peso, origen, None),
+                       mide(camino_minimo_compilado, grafo, peso, origen, destino, False),
+                       mide(a_estrella, grafo, peso, origen, destino, factor)]
+            # Solo comparamos los pares que tienen camino
+            if medidas[1] is None:
+                continue
+            for nombre, medida in zip(resultados, medidas):
+                resultados[nombre].append(medida)
+
+        print(f"\n{peso.__name__} ({len(resultados['A*'])} pares con camino)")
+        print(f"{'algoritmo':<22}{'vértices fijados':>18}{'p50 (ms)':>12}{'media (ms)':>12}")
+        for nombre, medidas in resultados.items():
+            if not medidas:
+                continue
+            tiempos = np.array([t for t, _ in medidas]) * 1000
+            fijados = np.array([f for _, f in medidas])
+            print(f"{nombre:<22}{fijados.mean():>18.0f}{np.median(tiempos):>12.2f}{tiempos.mean():>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
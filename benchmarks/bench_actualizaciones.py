@@ -0,0 +1,175 @@
+"""
+bench_actualizaciones.py
+
+Mide el coste de actualizar en caliente los pesos de las aristas del grafo de Madrid (como lo
+haría un servicio de tráfico) mientras se siguen calculando rutas con una caché de rutas. Un
+hilo aplica lotes de actualizaciones al ritmo pedido (por defecto 10000 aristas por segundo,
+con una parte de cierres) con GrafoCompilado.actualiza_pesos, que invalida solo las entradas
+afectadas de la caché, y el hilo principal calcula rutas entre orígenes y destinos aleatorios,
+muchos de ellos repetidos. Se compara con las mismas consultas sin actualizaciones y al final
+se comprueba que las rutas de la caché coinciden con las de un Dijkstra con los pesos nuevos.
+
+Con --indices se mide además la latencia de las consultas con la jerarquía de contracción y con
+los hitos (preprocesados en ese directorio) con los pesos de partida, después de un lote de
+actualizaciones y con los pesos restablecidos: mientras los pesos no son aquellos con los que se
+preprocesaron, las consultas cuestan como el Dijkstra bidireccional y el A* con la distancia en
+línea recta.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_actualizaciones --ritmo 10000 --lote 500 --duracion 10
+    python -m benchmarks.bench_actualizaciones --indices preproceso
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+import callejero as c
+import gps
+from cache_rutas import CacheRutas
+from grafo_pesado import dijkstra_compilado, INFTY
+from hitos import camino_minimo_alt, hitos_modos
+from jerarquia_contraccion import camino_minimo_jerarquia, jerarquias_modos
+
+
+def trafico(grafo, modo: str, base: np.ndarray, args, parar: threading.Event, tiempos: list) -> None:
+    """ Aplica lotes de actualizaciones de pesos al ritmo pedido hasta que se active parar. """
+    rnd = np.random.default_rng(args.semilla)
+    intervalo = args.lote / args.ritmo
+    siguiente = time.perf_counter()
+    while not parar.is_set():
+        aristas = rnd.choice(grafo.m, args.lote, replace=False)
+        valores = base[aristas] * rnd.uniform(0.5, 2.0, args.lote)
+        valores[rnd.random(args.lote) < args.cierres] = np.inf
+        inicio = time.perf_counter()
+        grafo.actualiza_pesos(modo, aristas, valores)
+        tiempos.append(time.perf_counter() - inicio)
+        siguiente += intervalo
+        espera = siguiente - time.perf_counter()
+        if espera > 0:
+            parar.wait(espera)
+
+
+def consultas(cache: CacheRutas, modo: str, origenes: list, destinos: list, duracion: float, rnd: random.Random) -> list:
+    """ Calcula rutas aleatorias con la caché durante un tiempo y devuelve la latencia de cada una. """
+    latencias = []
+    fin = time.perf_counter() + duracion
+    while time.perf_counter() < fin:
+        origen, destino = rnd.choice(origenes), rnd.choice(destinos)
+        inicio = time.perf_counter()
+        try:
+            cache.camino_minimo_compilado(modo, origen, destino)
+        except ValueError:
+            pass
+        latencias.append(time.perf_counter() - inicio)
+    return latencias
+
+
+def mide_indices(grafo, modo: str, base: np.ndarray, args, rnd: random.Random) -> None:
+    """ Mide la latencia de las consultas con la jerarquía de contracción y con los hitos con los
+    pesos de partida, después de un lote de actualizaciones y con los pesos restablecidos. """
+    jerarquia = jerarquias_modos(grafo, [modo], args.indices)[modo]
+    indice = hitos_modos(grafo, [modo], args.indices)[modo]
+    nodos = grafo.nodos.tolist()
+    pares = [(rnd.choice(nodos), rnd.choice(nodos)) for _ in range(args.comprobaciones)]
+    consultas_indices = (lambda o, d: camino_minimo_jerarquia(jerarquia, o, d, grafo, modo),
+                         lambda o, d: camino_minimo_alt(indice, grafo, modo, o, d))
+    generador = np.random.default_rng(args.semilla)
+    print(f"{'pesos':>22}{'CH p50 (ms)':>13}{'ALT p50 (ms)':>14}")
+    for nombre in ('de partida', 'actualizados', 'restablecidos'):
+        if nombre == 'actualizados':
+            aristas = generador.choice(grafo.m, args.lote, replace=False)
+            grafo.actualiza_pesos(modo, aristas, base[aristas] * generador.uniform(0.5, 2.0, args.lote))
+        elif nombre == 'restablecidos':
+            grafo.restablece_pesos(modo)
+        medianas = []
+        for consulta in consultas_indices:
+            latencias = []
+            for origen, destino in pares:
+                inicio = time.perf_counter()
+                try:
+                    consulta(origen, destino)
+                except ValueError:
+                    pass
+                latencias.append(time.perf_counter() - inicio)
+            medianas.append(np.percentile(latencias, 50) * 1000)
+        print(f"{nombre:>22}{medianas[0]:>13.2f}{medianas[1]:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ritmo', type=int, default=10000, help='aristas actualizadas por segundo')
+    parser.add_argument('--lote', type=int, default=500, help='aristas actualizadas en cada lote')
+    parser.add_argument('--cierres', type=float, default=0.02, help='fracción de actualizaciones que cierran la arista')
+    parser.add_argument('--duracion', type=float, default=10, help='segundos de consultas en cada prueba')
+    parser.add_argument('--modo', default='peso_ruta_mas_rapida', help='nombre de la función de peso')
+    parser.add_argument('--origenes', type=int, default=50, help='orígenes distintos de las consultas')
+    parser.add_argument('--destinos', type=int, default=500, help='destinos distintos de las consultas')
+    parser.add_argument('--comprobaciones', type=int, default=200, help='rutas comprobadas al final con Dijkstra')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de las consultas y las actualizaciones')
+    parser.add_argument('--indices', help='directorio de las jerarquías y los hitos con los que medir también CH y ALT')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    modo = grafo.modo(args.modo)
+    base = np.array(grafo.pesos[modo])
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas; modo {modo}")
+    rnd = random.Random(args.semilla)
+    origenes = [rnd.randrange(grafo.n) for _ in range(args.origenes)]
+    destinos = [rnd.randrange(grafo.n) for _ in range(args.destinos)]
+
+    print(f"{'prueba':>22}{'consultas/s':>13}{'p50 (ms)':>10}{'p99 (ms)':>10}{'aciertos':>10}{'invalidadas':>13}")
+    resultados = {}
+    for nombre, actualiza in (('sin actualizaciones', False), ('con actualizaciones', True)):
+        cache = CacheRutas(grafo)
+        parar = threading.Event()
+        tiempos = []
+        hilo = None
+        if actualiza:
+            hilo = threading.Thread(target=trafico, args=(grafo, modo, base, args, parar, tiempos))
+            hilo.start()
+        inicio = time.perf_counter()
+        latencias = consultas(cache, modo, origenes, destinos, args.duracion, random.Random(args.semilla))
+        total = time.perf_counter() - inicio
+        parar.set()
+        if hilo is not None:
+            hilo.join()
+            total_trafico = time.perf_counter() - inicio
+        latencias = np.array(latencias) * 1000
+        e = cache.estadisticas
+        aciertos = (e['aciertos_caminos'] + e['aciertos_arboles']) / max(1, len(latencias))
+        print(f"{nombre:>22}{len(latencias) / total:>13.1f}{np.percentile(latencias, 50):>10.2f}"
+              f"{np.percentile(latencias, 99):>10.2f}{aciertos:>10.1%}{e['invalidaciones']:>13}")
+        resultados[nombre] = cache
+
+    tiempos = np.array(tiempos) * 1000
+    print(f"Actualizaciones: {len(tiempos) * args.lote} aristas en {len(tiempos)} lotes de {args.lote} "
+          f"({len(tiempos) * args.lote / total_trafico:.0f} aristas/s; pedido {args.ritmo}); "
+          f"lote p50 {np.percentile(tiempos, 50):.2f} ms, p99 {np.percentile(tiempos, 99):.2f} ms")
+
+    # Las rutas que da la caché después de las actualizaciones tienen que ser mínimas con los pesos nuevos
+    cache = resultados['con actualizaciones']
+    pesos = grafo.pesos[modo]
+    incorrectas = 0
+    for _ in range(args.comprobaciones):
+        origen, destino = rnd.choice(origenes), rnd.choice(destinos)
+        distancias, _ = dijkstra_compilado(grafo, modo, origen)
+        try:
+            camino = cache.camino_minimo_compilado(modo, origen, destino)
+            coste = pesos[grafo.aristas_camino(camino)].sum()
+        except ValueError:
+            coste = INFTY
+        if not np.isclose(coste, distancias[destino], rtol=1e-9):
+            incorrectas += 1
+    print(f"Comprobación: {incorrectas} de {args.comprobaciones} rutas de la caché no son mínimas con los pesos nuevos")
+    grafo.restablece_pesos(modo)
+
+    if args.indices:
+        mide_indices(grafo, modo, base, args, rnd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+bench_arbol_abarcador.py
+
+Mide el tiempo de calcular un Árbol Abarcador Mínimo de la red de calles de Madrid (como grafo
+no dirigido, con la longitud de las aristas como peso) con prim y kruskal de grafo_pesado, y lo
+compara con las implementaciones originales (Kruskal que une componentes concatenando tuplas y
+Prim sobre los diccionarios de networkx) y con networkx. Se comprueba además que todos los
+árboles tienen el mismo peso total.
+
+Las implementaciones originales son cuadráticas en el peor caso, así que solo se ejecutan con
+--originales.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_arbol_abarcador --originales
+"""
+
+import argparse
+import heapq
+import time
+
+import networkx as nx
+
+import callejero as c
+import gps
+from grafo_pesado import prim, kruskal, compilado, INFTY
+
+
+def prim_original(G, peso):
+    """ Prim de grafo_pesado antes de trabajar sobre el grafo compilado. """
+    padre = {}
+    coste_minimo = {}
+    Q = []
+    nodos_sin_visitar = set(G.nodes())
+    for v in G.nodes():
+        padre[v] = None
+        coste_minimo[v] = INFTY
+    nodo_inicial = list(G.nodes())[0]
+    coste_minimo[nodo_inicial] = 0
+    contador = 0
+    heapq.heappush(Q, (coste_minimo[nodo_inicial], contador, nodo_inicial))
+    while Q != []:
+        contador += 1
+        coste_minimo_v, _, v = heapq.heappop(Q)
+        if v in nodos_sin_visitar:
+            nodos_sin_visitar.remove(v)
+        for x in G.neighbors(v):
+            contador += 1
+            if x in nodos_sin_visitar:
+                peso_arista_v_x = peso(G, v, x)
+                if peso_arista_v_x < coste_minimo[x]:
+                    coste_minimo[x] = peso_arista_v_x
+                    padre[x] = v
+                    heapq.heappush(Q, (coste_minimo[x], contador, x))
+    return padre
+
+
+def kruskal_original(G, peso):
+    """ Kruskal de grafo_pesado antes de usar conjuntos disjuntos. """
+    aristas_arbol = []
+    L = []
+    for u, v in G.edges():
+        L.append((peso(G, u, v), u, v))
+    L.sort(key=lambda x: x[0])
+    componentes = {v: (v,) for v in G.nodes()}
+    for peso_arista, u, v in L:
+        if componentes[u] != componentes[v]:
+            aristas_arbol.append((u, v))
+            componente_unida = componentes[u] + componentes[v]
+            for nodo in componente_unida:
+                componentes[nodo] = componente_unida
+    return aristas_arbol
+
+
+def mide(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return time.perf_counter() - inicio, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--originales', action='store_true', help='medir también las implementaciones originales')
+    args = parser.parse_args()
+
+    G = nx.Graph(c.procesa_grafo(c.carga_grafo()))
+    peso = gps.peso_ruta_mas_corta
+    print(f"Grafo no dirigido: {G.number_of_nodes()} vértices, {G.number_of_edges()} aristas")
+
+    def peso_arbol(aristas):
+        return sum(peso(G, u, v) for u, v in aristas)
+
+    # La compilación (y el cálculo del array de pesos) se hace una vez por grafo y peso
+    tiempo_compilacion, _ = mide(compilado, G, peso)
+    resultados = []
+    tiempo, padre = mide(prim, G, peso)
+    resultados.append(("prim", tiempo, peso_arbol((v, p) for v, p in padre.items() if p is not None)))
+    tiempo, aristas = mide(kruskal, G, peso)
+    resultados.append(("kruskal", tiempo, peso_arbol(aristas)))
+    tiempo, aristas = mide(lambda: list(nx.minimum_spanning_edges(G, algorithm='kruskal', weight='length', data=False)))
+    resultados.append(("networkx kruskal", tiempo, peso_arbol(aristas)))
+    if args.originales:
+        tiempo, padre = mide(prim_original, G, peso)
+        resultados.append(("prim original", tiempo, peso_arbol((v, p) for v, p in padre.items() if p is not None)))
+        tiempo, aristas = mide(kruskal_original, G, peso)
+        resultados.append(("kruskal original", tiempo, peso_arbol(aristas)))
+
+    print(f"Compilación del grafo y de los pesos: {tiempo_compilacion:.2f} s")
+    print(f"{'algoritmo':<20}{'tiempo (s)':>12}{'peso del árbol':>18}")
+    for nombre, tiempo, total in resultados:
+        print(f"{nombre:<20}{tiempo:>12.3f}{total:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
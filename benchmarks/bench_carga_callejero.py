@@ -0,0 +1,77 @@
+"""
+bench_carga_callejero.py
+
+Compara el tiempo de carga del callejero de Madrid (direcciones.csv) con:
+    - el cargador anterior: conversión de coordenadas fila a fila con apply y un regex
+    - carga_callejero sin caché: conversión vectorizada con str.extract y numpy
+    - carga_callejero con caché: lectura del fichero Feather ya procesado
+y comprueba que las coordenadas obtenidas son idénticas.
+
+Uso (desde la raíz del repositorio, con direcciones.csv descargado):
+    python -m benchmarks.bench_carga_callejero --repeticiones 3
+"""
+
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import callejero as c
+
+
+def carga_callejero_fila_a_fila() -> pd.DataFrame:
+    "Cargador anterior, que convierte cada coordenada con un regex dentro de apply"
+    columnas_cargar = ['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE', 'NUMERO', 'LATITUD', 'LONGITUD']
+    direcciones = pd.read_csv(c.STREET_FILE_NAME, usecols=columnas_cargar, encoding='latin-1', sep=';')
+
+    def transformacion(valor):
+        patron = re.compile(r"(\d+)°(\d+)'([\d.]+)''\s*([NSEW])")
+        matches = re.match(patron, valor)
+        grado_corregido = int(matches.group(1)) + int(matches.group(2))/60 + float(matches.group(3))/3600
+        if matches.group(4) == 'W' or matches.group(4) == 'S':
+            grado_corregido = grado_corregido * -1
+        return grado_corregido
+    direcciones['LONGITUD'] = direcciones['LONGITUD'].apply(transformacion)
+    direcciones['LATITUD'] = direcciones['LATITUD'].apply(transformacion)
+    direcciones['VIA_PAR'] = direcciones['VIA_PAR'].fillna("")
+    return direcciones
+
+
+def mide(funcion, repeticiones: int) -> tuple:
+    "Devuelve el mejor tiempo de varias ejecuciones y el resultado de la última"
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=3, help='ejecuciones de cada cargador')
+    args = parser.parse_args()
+
+    t_anterior, anterior = mide(carga_callejero_fila_a_fila, args.repeticiones)
+    t_vectorizado, vectorizado = mide(lambda: c.carga_callejero(usar_cache=False), args.repeticiones)
+    # La primera carga con caché escribe el fichero Feather; medimos las siguientes
+    c.carga_callejero()
+    t_cache, cacheado = mide(c.carga_callejero, args.repeticiones)
+
+    for nombre, df in (('sin caché', vectorizado), ('con caché', cacheado)):
+        for columna in ['LATITUD', 'LONGITUD']:
+            if not np.array_equal(df[columna].to_numpy(), anterior[columna].to_numpy()):
+                raise AssertionError(f"La columna {columna} {nombre} no coincide con el cargador anterior")
+
+    print(f"{len(anterior)} direcciones")
+    print(f"{'cargador':<32}{'segundos':>10}{'aceleración':>14}")
+    for nombre, tiempo in (('anterior (apply fila a fila)', t_anterior),
+                           ('vectorizado sin caché', t_vectorizado),
+                           ('vectorizado con caché Feather', t_cache)):
+        print(f"{nombre:<32}{tiempo:>10.3f}{t_anterior / tiempo:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main()
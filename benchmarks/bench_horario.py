@@ -0,0 +1,87 @@
+"""
+bench_horario.py
+
+Compara, sobre pares origen/destino aleatorios del grafo de Madrid, el modo de ruta dependiente
+de la hora (perfiles_horarios.a_estrella_horaria) con el modo estático con semáforos
+(peso_ruta_mas_rapida_semaforos con A*): tiempo de cálculo, vértices fijados y duración del
+viaje a varias horas de salida. También muestra la memoria que ocupan los perfiles.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_horario --pares 200 --horas 03:00 08:00 18:30
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import callejero as c
+import gps
+from grafo_pesado import a_estrella
+from perfiles_horarios import perfiles_callejero, a_estrella_horaria, segundos_del_dia
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pares', type=int, default=100, help='número de pares origen/destino')
+    parser.add_argument('--horas', nargs='+', default=['03:00', '08:00', '13:00', '18:30'], help='horas de salida')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los pares aleatorios')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    perfiles = perfiles_callejero(grafo)
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas")
+    memoria = sum(a.nbytes for a in (perfiles.aristas, perfiles.cruces, perfiles.perfil_arista, perfiles.perfil_cruce))
+    print(f"Perfiles: {len(perfiles.aristas)} de aristas y {len(perfiles.cruces)} de cruces con "
+          f"{perfiles.aristas.shape[1]} muestras; {memoria / 1024:.0f} KiB en total")
+
+    rnd = random.Random(args.semilla)
+    pares = [(rnd.randrange(grafo.n), rnd.randrange(grafo.n)) for _ in range(args.pares)]
+    modo = gps.peso_ruta_mas_rapida_semaforos
+    factor = gps.FACTORES_HEURISTICA[modo]
+    # Las listas de Python de los pesos y los perfiles se construyen fuera de las medidas
+    grafo.listas(modo)
+    grafo.listas(perfiles.modo)
+    perfiles.listas()
+
+    filas = []
+    medidas = []
+    for origen, destino in pares:
+        estadisticas = {}
+        inicio = time.perf_counter()
+        try:
+            camino = a_estrella(grafo, modo, origen, destino, factor, estadisticas)
+        except ValueError:
+            continue
+        tiempo = time.perf_counter() - inicio
+        duracion = grafo.pesos[grafo.modo(modo)][grafo.aristas_camino(camino)].sum()
+        medidas.append((tiempo, estadisticas['nodos_asentados'], duracion))
+    filas.append(('estático (semáforos)', medidas))
+    for hora in args.horas:
+        salida = segundos_del_dia(hora)
+        medidas = []
+        for origen, destino in pares:
+            estadisticas = {}
+            inicio = time.perf_counter()
+            try:
+                _, llegada = a_estrella_horaria(grafo, perfiles, origen, destino, salida, estadisticas)
+            except ValueError:
+                continue
+            medidas.append((time.perf_counter() - inicio, estadisticas['nodos_asentados'], llegada - salida))
+        filas.append((f"horario, salida {hora}", medidas))
+
+    referencia = np.mean([t for t, _, _ in filas[0][1]])
+    print(f"{'modo':<26}{'pares':>7}{'vértices fijados':>18}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'media (ms)':>12}{'factor':>8}{'viaje medio (min)':>19}")
+    for nombre, medidas in filas:
+        tiempos = np.array([t for t, _, _ in medidas]) * 1000
+        fijados = np.array([f for _, f, _ in medidas])
+        viajes = np.array([v for _, _, v in medidas]) / 60
+        print(f"{nombre:<26}{len(medidas):>7}{fijados.mean():>18.0f}{np.percentile(tiempos, 50):>10.2f}"
+              f"{np.percentile(tiempos, 99):>10.2f}{tiempos.mean():>12.2f}{tiempos.mean() / 1000 / referencia:>7.2f}x"
+              f"{viajes.mean():>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+bench_isocronas.py
+
+Mide el cálculo de isocronas sobre el grafo de Madrid:
+    - el Dijkstra acotado al umbral frente al árbol de caminos mínimos completo desde el origen,
+    - la construcción de los polígonos de cada umbral con las dos formas (cóncava y rejilla),
+    - una isocrona multiorigen para toda una flota de almacenes frente a una por almacén.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_isocronas --umbrales 300 600 900 --almacenes 20
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import callejero as c
+import gps
+from grafo_pesado import dijkstra_compilado
+from isocronas import distancias_acotadas, poligono, FORMAS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--umbrales', type=float, nargs='+', default=[300, 600, 900],
+                        help='umbrales en las unidades del modo (segundos o metros)')
+    parser.add_argument('--modo', default='peso_ruta_mas_rapida', help='nombre de la función de peso')
+    parser.add_argument('--origenes', type=int, default=10, help='orígenes aleatorios de las isocronas simples')
+    parser.add_argument('--almacenes', type=int, default=20, help='orígenes de la isocrona multiorigen')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los orígenes aleatorios')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas; modo {args.modo}")
+    rnd = random.Random(args.semilla)
+    origenes = [rnd.randrange(grafo.n) for _ in range(args.origenes)]
+    grafo.listas(args.modo)
+
+    inicio = time.perf_counter()
+    for origen in origenes:
+        dijkstra_compilado(grafo, args.modo, origen)
+    completo = (time.perf_counter() - inicio) / len(origenes)
+    print(f"Árbol completo: {completo * 1000:.1f} ms por origen")
+
+    print(f"{'umbral':>8}{'vértices':>10}{'acotado (ms)':>14}{'aceleración':>13}"
+          + "".join(f"{forma + ' (ms)':>16}" for forma in FORMAS))
+    for umbral in sorted(args.umbrales):
+        tiempos, alcanzados, formas = [], [], {forma: [] for forma in FORMAS}
+        for origen in origenes:
+            inicio = time.perf_counter()
+            distancias, _ = distancias_acotadas(grafo, args.modo, [origen], umbral)
+            tiempos.append(time.perf_counter() - inicio)
+            alcanzados.append(np.count_nonzero(np.isfinite(distancias)))
+            for forma in FORMAS:
+                inicio = time.perf_counter()
+                poligono(grafo, args.modo, distancias, umbral, forma)
+                formas[forma].append(time.perf_counter() - inicio)
+        acotado = np.mean(tiempos)
+        print(f"{umbral:>8.0f}{np.mean(alcanzados):>10.0f}{acotado * 1000:>14.1f}{completo / acotado:>12.1f}x"
+              + "".join(f"{np.mean(formas[forma]) * 1000:>16.1f}" for forma in FORMAS))
+
+    almacenes = [rnd.randrange(grafo.n) for _ in range(args.almacenes)]
+    umbral = max(args.umbrales)
+    inicio = time.perf_counter()
+    distancias, fuente = distancias_acotadas(grafo, args.modo, almacenes, umbral)
+    multiorigen = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for almacen in almacenes:
+        distancias_acotadas(grafo, args.modo, [almacen], umbral)
+    por_almacen = time.perf_counter() - inicio
+    print(f"Flota de {len(almacenes)} almacenes, umbral {umbral:.0f}: multiorigen {multiorigen * 1000:.1f} ms, "
+          f"uno por almacén {por_almacen * 1000:.1f} ms ({por_almacen / multiorigen:.1f}x); "
+          f"{np.count_nonzero(np.isfinite(distancias))} vértices cubiertos, "
+          f"{len(np.unique(fuente[fuente >= 0]))} almacenes con zona propia")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+bench_mapa.py
+
+Compara el tiempo de dibujar rutas aleatorias del grafo de Madrid como PNG con:
+    - gps.dibujar: dibuja con networkx todas las aristas del grafo en cada ruta
+    - MapaBase: dibuja la red de calles una vez y en cada ruta solo la superpone
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_mapa --rutas 10
+"""
+
+import argparse
+import io
+import random
+import time
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+import callejero as c
+import gps
+from grafo_pesado import a_estrella
+from mapa import MapaBase
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rutas', type=int, default=10, help='número de rutas a dibujar')
+    parser.add_argument('--completas', type=int, default=2, help='rutas a dibujar con gps.dibujar (es lento)')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de las rutas aleatorias')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    digrafo = grafo.a_networkx()
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas")
+    rnd = random.Random(args.semilla)
+    caminos = []
+    while len(caminos) < args.rutas:
+        try:
+            caminos.append(a_estrella(grafo, 'peso_ruta_mas_rapida', rnd.randrange(grafo.n), rnd.randrange(grafo.n)))
+        except ValueError:
+            pass
+
+    tiempos_completos = []
+    for camino in caminos[:args.completas]:
+        inicio = time.perf_counter()
+        with warnings.catch_warnings():
+            # plt.show no hace nada con el backend Agg
+            warnings.simplefilter('ignore')
+            gps.dibujar(digrafo, grafo.camino_original(camino))
+        plt.savefig(io.BytesIO(), format='png')
+        plt.close('all')
+        tiempos_completos.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    mapa = MapaBase(grafo)
+    preparacion = time.perf_counter() - inicio
+    tiempos = {}
+    for formato in ('png', 'svg'):
+        tiempos[formato] = []
+        for camino in caminos:
+            inicio = time.perf_counter()
+            mapa.dibuja_ruta(camino, formato)
+            tiempos[formato].append(time.perf_counter() - inicio)
+
+    print(f"{'método':<28}{'p50 (ms)':>10}{'máx (ms)':>10}")
+    for nombre, valores in [("gps.dibujar", tiempos_completos), ("MapaBase png", tiempos['png']),
+                            ("MapaBase svg", tiempos['svg'])]:
+        if valores:
+            valores = np.array(valores) * 1000
+            print(f"{nombre:<28}{np.median(valores):>10.1f}{valores.max():>10.1f}")
+    print(f"Preparación del mapa base (una sola vez): {preparacion:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
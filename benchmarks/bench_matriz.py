@@ -0,0 +1,61 @@
+"""
+bench_matriz.py
+
+Mide el tiempo de cálculo de matrices de distancias entre vértices aleatorios del grafo de
+Madrid con matriz_distancias_compilado (un Dijkstra por origen que se detiene al fijar todos
+los destinos) y lo compara con el coste estimado de llamar a camino_minimo para cada par
+(medido sobre una muestra de pares y extrapolado).
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_matriz --tamanos 100 1000 --modo peso_ruta_mas_rapida
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import callejero as c
+import gps
+from grafo_pesado import matriz_distancias_compilado, dijkstra_compilado, reconstruye_camino
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[100, 1000],
+                        help='número de orígenes y de destinos de cada matriz')
+    parser.add_argument('--modo', default='peso_ruta_mas_rapida', help='nombre de la función de peso')
+    parser.add_argument('--muestra', type=int, default=20, help='pares usados para estimar camino_minimo por pares')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los vértices aleatorios')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas; modo {args.modo}")
+    rnd = random.Random(args.semilla)
+
+    # Coste de una llamada a camino_minimo tal y como era antes (árbol completo y reconstrucción del camino)
+    inicio = time.perf_counter()
+    for _ in range(args.muestra):
+        origen, destino = rnd.randrange(grafo.n), rnd.randrange(grafo.n)
+        _, padre = dijkstra_compilado(grafo, args.modo, origen)
+        try:
+            reconstruye_camino(padre, origen, destino)
+        except ValueError:
+            pass
+    por_par = (time.perf_counter() - inicio) / args.muestra
+
+    print(f"{'tamaño':>10}{'matriz (s)':>14}{'por pares, estimado (s)':>26}{'aceleración':>14}")
+    for tamano in args.tamanos:
+        origenes = [rnd.randrange(grafo.n) for _ in range(tamano)]
+        destinos = [rnd.randrange(grafo.n) for _ in range(tamano)]
+        inicio = time.perf_counter()
+        matriz = matriz_distancias_compilado(grafo, args.modo, origenes, destinos)
+        tiempo = time.perf_counter() - inicio
+        estimado = por_par * tamano * tamano
+        print(f"{f'{tamano}x{tamano}':>10}{tiempo:>14.2f}{estimado:>26.1f}{estimado / tiempo:>13.0f}x"
+              f"   ({np.isfinite(matriz).mean():.1%} pares con camino)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+bench_memoria.py
+
+Mide la memoria que ocupa el grafo de calles de Madrid en cada representación:
+    - networkx: DiGraph de callejero.procesa_grafo, con todos los atributos de OpenStreetMap
+    - compilado: GrafoCompilado leído entero en memoria (arrays de coordenadas, adyacencia CSR,
+      pesos de los tres modos, longitud, velocidad e identificador del nombre de cada arista,
+      tabla de nombres sin repetir e índice de vértices)
+    - compilado proyectado: el mismo grafo proyectado en memoria desde la caché, cuyos arrays
+      no ocupan memoria propia del proceso (las páginas se comparten entre procesos)
+
+La memoria se mide con tracemalloc como la memoria que sigue reservada tras construir cada
+representación.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_memoria
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+import callejero as c
+import grafo_compilado
+import gps
+
+
+def memoria(funcion):
+    """ Ejecuta funcion() y devuelve su resultado y los bytes que siguen reservados después. """
+    gc.collect()
+    tracemalloc.start()
+    resultado = funcion()
+    gc.collect()
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, actual
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    # Nos aseguramos de que la caché del grafo compilado existe antes de medir
+    directorio = c.carga_grafo_compilado(gps.compila_callejero).directorio
+
+    digrafo, bytes_networkx = memoria(lambda: c.procesa_grafo(c.carga_grafo()))
+    print(f"Grafo: {digrafo.number_of_nodes()} vértices, {digrafo.number_of_edges()} aristas")
+    del digrafo
+    grafo, bytes_compilado = memoria(lambda: grafo_compilado.carga_grafo_compilado(directorio, mmap=False))
+    desglose = {'adyacencia y coordenadas': sum(a.nbytes for a in (grafo.nodos, grafo.indptr, grafo.indices, grafo.x, grafo.y)),
+                'pesos de los modos': sum(a.nbytes for a in grafo.pesos.values()),
+                'datos de vértices': sum(a.nbytes for a in grafo.datos_nodos.values()),
+                'datos de aristas': sum(a.nbytes for a in grafo.datos_aristas.values())}
+    del grafo
+    _, bytes_proyectado = memoria(lambda: grafo_compilado.carga_grafo_compilado(directorio, mmap=True))
+
+    print(f"{'representación':<26}{'MB':>10}{'reducción':>12}")
+    for nombre, total in [("networkx", bytes_networkx), ("compilado", bytes_compilado),
+                          ("compilado proyectado", bytes_proyectado)]:
+        print(f"{nombre:<26}{total / 2**20:>10.1f}{bytes_networkx / total:>11.1f}x")
+    print("Desglose de los arrays del grafo compilado:")
+    for nombre, total in desglose.items():
+        print(f"    {nombre:<26}{total / 2**20:>8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
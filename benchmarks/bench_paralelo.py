@@ -0,0 +1,85 @@
+"""
+bench_paralelo.py
+
+Mide cómo escala el cálculo de un lote de rutas aleatorias sobre el grafo de Madrid con
+EnrutadorParalelo al aumentar el número de procesos, desde 1 hasta el número de núcleos.
+El tiempo de arranque del grupo de procesos (carga del grafo proyectado en memoria) se mide
+aparte del tiempo del lote. Al final se comprueba que, después de cerrar una arista de cada
+ruta con GrafoCompilado.cierra_aristas, las rutas de los procesos ya no pasan por ella.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_paralelo --pares 2000 --modo peso_ruta_mas_rapida
+"""
+
+import argparse
+import os
+import random
+import time
+
+import callejero as c
+import gps
+from enrutador_paralelo import EnrutadorParalelo
+
+
+def comprueba_cierres(grafo, modo: str, pares: list, procesos: int) -> None:
+    """ Cierra una arista de la ruta de cada par y comprueba que el grupo de procesos ya no la usa.
+
+    Raises:
+        AssertionError: Si alguna ruta calculada en los procesos pasa por una arista cerrada
+    """
+    with EnrutadorParalelo(grafo, procesos) as enrutador:
+        caminos = enrutador.caminos_minimos_compilado(modo, pares, bidireccional=True)
+        rutas = [(par, camino) for par, camino in zip(pares, caminos) if camino is not None and len(camino) > 2]
+        cerradas = [grafo.arista(camino[len(camino) // 2], camino[len(camino) // 2 + 1]) for _, camino in rutas]
+        grafo.cierra_aristas(cerradas)
+        try:
+            nuevos = enrutador.caminos_minimos_compilado(modo, [par for par, _ in rutas], bidireccional=True)
+        finally:
+            grafo.abre_aristas(cerradas)
+    cerradas = set(cerradas)
+    for camino in nuevos:
+        if camino is not None and cerradas.intersection(grafo.aristas_camino(camino).tolist()):
+            raise AssertionError("Los procesos han calculado una ruta por una arista cerrada")
+    print(f"Comprobación: ninguna de las {len(rutas)} rutas pasa por las aristas cerradas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pares', type=int, default=1000, help='número de rutas del lote')
+    parser.add_argument('--modo', default='peso_ruta_mas_rapida', help='nombre de la función de peso')
+    parser.add_argument('--procesos', type=int, nargs='+', default=None,
+                        help='números de procesos a probar (por defecto 1, 2, 4... hasta el número de núcleos)')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los pares aleatorios')
+    args = parser.parse_args()
+
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    print(f"Grafo: {grafo.n} vértices, {grafo.m} aristas; modo {args.modo}; {args.pares} rutas")
+    rnd = random.Random(args.semilla)
+    pares = [(rnd.randrange(grafo.n), rnd.randrange(grafo.n)) for _ in range(args.pares)]
+
+    procesos = args.procesos
+    if procesos is None:
+        nucleos = os.cpu_count() or 1
+        procesos = sorted({min(2 ** i, nucleos) for i in range(nucleos.bit_length() + 1)})
+
+    referencia = None
+    base = None
+    print(f"{'procesos':>10}{'arranque (s)':>14}{'lote (s)':>10}{'rutas/s':>10}{'aceleración':>14}")
+    for numero in procesos:
+        inicio = time.perf_counter()
+        with EnrutadorParalelo(grafo, numero) as enrutador:
+            arranque = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            caminos = enrutador.caminos_minimos_compilado(args.modo, pares, bidireccional=True)
+            tiempo = time.perf_counter() - inicio
+        # Todos los grupos tienen que dar los mismos resultados y en el mismo orden
+        if referencia is None:
+            referencia, base = caminos, tiempo
+        elif caminos != referencia:
+            raise AssertionError(f"Resultados distintos con {numero} procesos")
+        print(f"{numero:>10}{arranque:>14.2f}{tiempo:>10.2f}{len(pares) / tiempo:>10.0f}{base / tiempo:>13.2f}x")
+    comprueba_cierres(grafo, args.modo, pares[:200], max(procesos))
+
+
+if __name__ == "__main__":
+    main()
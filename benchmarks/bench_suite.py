@@ -0,0 +1,222 @@
+"""
+bench_suite.py
+
+Batería de medidas reproducible, sin conexión, de las operaciones principales de la práctica
+sobre datos sintéticos generados con una semilla (ver benchmarks/sintetico.py): una cuadrícula
+de calles con los atributos de OpenStreetMap y un callejero en el formato de direcciones.csv.
+
+Casos medidos:
+    - carga_callejero (sin caché y con la caché Feather) del fichero de direcciones sintético
+    - busca_direccion de direcciones aleatorias del callejero
+    - autocompletado de esas direcciones pulsación a pulsación (autocompletado.IndiceAutocompletado)
+    - dijkstra (árbol completo, desde el grafo de networkx) y dijkstra_compilado
+    - camino_minimo (unidireccional y bidireccional) entre pares aleatorios
+    - prim y kruskal sobre el grafo no dirigido
+    - instrucciones de las rutas calculadas
+
+De cada caso se muestran los percentiles 50, 90 y 99 de la latencia, la media de vértices
+fijados (en las búsquedas), la memoria máxima reservada durante una operación (medida con
+tracemalloc en una ejecución aparte) y las operaciones por segundo. Con --salida se guardan
+los resultados en JSON, junto con el commit, los parámetros y el tamaño del grafo, y con
+--compara se muestra la variación de cada caso respecto a un JSON anterior.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_suite --filas 100 --columnas 100 --salida resultados.json
+    python -m benchmarks.bench_suite --filas 100 --columnas 100 --compara resultados.json
+"""
+
+from typing import Callable, Dict, List
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import callejero as c
+import gps
+from gps import MODOS
+from grafo_pesado import dijkstra, dijkstra_compilado, camino_minimo_compilado, prim, kruskal
+from autocompletado import IndiceAutocompletado
+from benchmarks.sintetico import grafo_sintetico, callejero_sintetico, direcciones_aleatorias
+
+VERSION_RESULTADOS = 1
+
+
+def mide(funcion: Callable[[object, Dict[str, int]], object], entradas: List[object]) -> Dict[str, float]:
+    """ Ejecuta funcion(entrada, estadisticas) con cada entrada y resume sus tiempos.
+
+    La primera entrada se ejecuta una vez antes de medir, para que las cachés y los índices
+    que se construyen en la primera llamada no cuenten. La memoria máxima se mide después, con
+    tracemalloc, en otra ejecución de la primera entrada.
+
+    Args:
+        funcion (función): operación medida; puede anotar 'nodos_asentados' en estadisticas
+        entradas (List[object]): entrada de cada ejecución
+    Returns:
+        Dict[str,float]: operaciones, percentiles 50, 90 y 99 y media en milisegundos,
+            operaciones por segundo, media de vértices fijados (o None) y bytes de memoria máxima
+    """
+    funcion(entradas[0], {})
+    tiempos = []
+    asentados = []
+    for entrada in entradas:
+        estadisticas = {}
+        inicio = time.perf_counter()
+        funcion(entrada, estadisticas)
+        tiempos.append(time.perf_counter() - inicio)
+        if 'nodos_asentados' in estadisticas:
+            asentados.append(estadisticas['nodos_asentados'])
+    gc.collect()
+    tracemalloc.start()
+    funcion(entradas[0], {})
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    milisegundos = np.array(tiempos) * 1000
+    return {'operaciones': len(tiempos),
+            'p50_ms': float(np.percentile(milisegundos, 50)),
+            'p90_ms': float(np.percentile(milisegundos, 90)),
+            'p99_ms': float(np.percentile(milisegundos, 99)),
+            'media_ms': float(milisegundos.mean()),
+            'por_segundo': len(tiempos) / sum(tiempos),
+            'nodos_asentados': float(np.mean(asentados)) if asentados else None,
+            'memoria_pico': pico}
+
+
+def commit_actual() -> str:
+    """ Commit del repositorio del que se ejecuta la batería (o None si no es un repositorio git). """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecuta(filas: int, columnas: int, semilla: int, consultas: int, repeticiones: int, modo: str) -> Dict[str, object]:
+    """ Genera los datos sintéticos en un directorio temporal y mide todos los casos.
+
+    Args:
+        filas (int), columnas (int): tamaño de la cuadrícula de calles
+        semilla (int): semilla de los datos y de las consultas
+        consultas (int): ejecuciones de las búsquedas y de las consultas de rutas
+        repeticiones (int): ejecuciones de las cargas y de los árboles abarcadores
+        modo (str): modo de ruta (una clave de gps.MODOS)
+    Returns:
+        Dict[str,object]: resultados de la batería, en el formato que se guarda en JSON
+    """
+    peso = MODOS[modo]
+    rnd = random.Random(semilla)
+    G = grafo_sintetico(filas, columnas, semilla)
+    digrafo = c.procesa_grafo(G)
+    grafo = gps.compila_callejero(digrafo)
+    no_dirigido = digrafo.to_undirected()
+    casos = {}
+    directorio_actual = os.getcwd()
+    with tempfile.TemporaryDirectory() as directorio:
+        # carga_callejero lee el fichero y escribe la caché con rutas relativas al directorio actual
+        os.chdir(directorio)
+        try:
+            callejero_sintetico(G, c.STREET_FILE_NAME, semilla)
+            casos['carga_callejero'] = mide(lambda _, e: c.carga_callejero(usar_cache=False), [None] * repeticiones)
+            casos['carga_callejero_cache'] = mide(lambda _, e: c.carga_callejero(), [None] * repeticiones)
+            callejero = c.carga_callejero()
+        finally:
+            os.chdir(directorio_actual)
+
+    direcciones = direcciones_aleatorias(callejero, consultas, semilla)
+    casos['busca_direccion'] = mide(lambda direccion, e: c.busca_direccion(direccion, callejero), direcciones)
+    autocompletado = IndiceAutocompletado(callejero)
+    pulsaciones = [direccion[:k].lower() for direccion in direcciones[:max(1, consultas // 10)]
+                   for k in range(1, len(direccion) + 1)]
+    casos['autocompleta'] = mide(lambda texto, e: autocompletado.busca(texto), pulsaciones)
+
+    nodos = grafo.nodos.tolist()
+    origenes = [rnd.randrange(grafo.n) for _ in range(max(1, consultas // 20))]
+    pares = [(rnd.randrange(grafo.n), rnd.randrange(grafo.n)) for _ in range(consultas)]
+    casos['dijkstra'] = mide(lambda origen, e: dijkstra(digrafo, peso, nodos[origen]), origenes)
+    casos['dijkstra_compilado'] = mide(lambda origen, e: dijkstra_compilado(grafo, peso, origen, estadisticas=e), origenes)
+
+    def ruta(par, estadisticas, bidireccional=False):
+        try:
+            return camino_minimo_compilado(grafo, peso, *par, bidireccional=bidireccional, estadisticas=estadisticas)
+        except ValueError:
+            return None
+    casos['camino_minimo'] = mide(ruta, pares)
+    casos['camino_minimo_bidireccional'] = mide(lambda par, e: ruta(par, e, True), pares)
+    caminos = [grafo.camino_original(camino) for camino in map(lambda par: ruta(par, {}), pares) if camino]
+
+    casos['prim'] = mide(lambda _, e: prim(no_dirigido, gps.peso_ruta_mas_corta), [None] * repeticiones)
+    casos['kruskal'] = mide(lambda _, e: kruskal(no_dirigido, gps.peso_ruta_mas_corta), [None] * repeticiones)
+    lineas = []
+    casos['instrucciones'] = mide(lambda camino, e: gps.instrucciones(grafo, camino, lineas.append), caminos)
+
+    return {'version': VERSION_RESULTADOS,
+            'commit': commit_actual(),
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'parametros': {'filas': filas, 'columnas': columnas, 'semilla': semilla, 'consultas': consultas,
+                           'repeticiones': repeticiones, 'modo': modo},
+            'grafo': {'vertices': grafo.n, 'aristas': grafo.m, 'direcciones': len(callejero)},
+            'casos': casos}
+
+
+def muestra(resultados: Dict[str, object], anteriores: Dict[str, object] = None) -> None:
+    """ Escribe la tabla de resultados y, si se dan, la variación de la mediana respecto a otros.
+
+    Args:
+        resultados (Dict[str,object]): resultados de ejecuta
+        anteriores (Dict[str,object], opcional): resultados anteriores con los que comparar
+    Returns: None
+    """
+    grafo = resultados['grafo']
+    print(f"Commit {resultados['commit']}; grafo de {grafo['vertices']} vértices y {grafo['aristas']} aristas, "
+          f"{grafo['direcciones']} direcciones; parámetros {resultados['parametros']}")
+    if anteriores is not None:
+        print(f"Comparado con el commit {anteriores['commit']} ({anteriores['fecha']})")
+        if anteriores['parametros'] != resultados['parametros']:
+            print(f"Aviso: los parámetros anteriores eran distintos: {anteriores['parametros']}")
+    print(f"{'caso':<30}{'ops':>6}{'p50 (ms)':>11}{'p90 (ms)':>11}{'p99 (ms)':>11}{'fijados':>10}"
+          f"{'memoria (KiB)':>15}{'ops/s':>11}" + (f"{'p50 antes':>11}{'cambio':>9}" if anteriores else ""))
+    for nombre, caso in resultados['casos'].items():
+        asentados = f"{caso['nodos_asentados']:.0f}" if caso['nodos_asentados'] is not None else "-"
+        linea = (f"{nombre:<30}{caso['operaciones']:>6}{caso['p50_ms']:>11.3f}{caso['p90_ms']:>11.3f}"
+                 f"{caso['p99_ms']:>11.3f}{asentados:>10}{caso['memoria_pico'] / 1024:>15.0f}{caso['por_segundo']:>11.1f}")
+        anterior = anteriores['casos'].get(nombre) if anteriores else None
+        if anterior is not None:
+            linea += f"{anterior['p50_ms']:>11.3f}{caso['p50_ms'] / anterior['p50_ms'] - 1:>+9.0%}"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=100, help='calles horizontales de la cuadrícula')
+    parser.add_argument('--columnas', type=int, default=100, help='calles verticales de la cuadrícula')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de los datos y de las consultas')
+    parser.add_argument('--consultas', type=int, default=200, help='búsquedas de direcciones y consultas de rutas')
+    parser.add_argument('--repeticiones', type=int, default=5, help='ejecuciones de las cargas y de prim y kruskal')
+    parser.add_argument('--modo', default='rapida', choices=sorted(MODOS), help='modo de las rutas')
+    parser.add_argument('--salida', help='fichero JSON en el que guardar los resultados')
+    parser.add_argument('--compara', help='fichero JSON con resultados anteriores con los que comparar')
+    args = parser.parse_args()
+
+    anteriores = None
+    if args.compara:
+        with open(args.compara, encoding='utf-8') as f:
+            anteriores = json.load(f)
+    resultados = ejecuta(args.filas, args.columnas, args.semilla, args.consultas, args.repeticiones, args.modo)
+    muestra(resultados, anteriores)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+carga_servicio.py
+
+Prueba de carga del servicio HTTP del GPS (servicio_gps.py), que tiene que estar ya en marcha.
+Se lanzan peticiones de rutas entre direcciones aleatorias del callejero desde varios clientes
+concurrentes, cada uno con su propia conexión persistente, y se informa de la latencia (p50,
+p99 y máxima), del rendimiento y de las respuestas con error.
+
+Uso (desde la raíz del repositorio):
+    python servicio_gps.py --puerto 8080 &
+    python -m benchmarks.carga_servicio --puerto 8080 --peticiones 1000 --concurrencia 16
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+import callejero as c
+
+
+async def cliente(host: str, puerto: int, cola: asyncio.Queue, latencias: list, estados: dict) -> None:
+    """ Envía las peticiones de la cola por una conexión persistente y anota la latencia de cada una. """
+    lector, escritor = await asyncio.open_connection(host, puerto)
+    try:
+        while not cola.empty():
+            ruta, parametros = cola.get_nowait()
+            cuerpo = json.dumps(parametros).encode('utf-8')
+            inicio = time.perf_counter()
+            escritor.write(f"POST {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(cuerpo)}\r\n\r\n".encode('latin-1') + cuerpo)
+            await escritor.drain()
+            estado = int((await lector.readline()).split()[1])
+            longitud = 0
+            while True:
+                linea = await lector.readline()
+                if linea in (b'\r\n', b''):
+                    break
+                clave, _, valor = linea.decode('latin-1').partition(':')
+                if clave.strip().lower() == 'content-length':
+                    longitud = int(valor)
+            await lector.readexactly(longitud)
+            latencias.append(time.perf_counter() - inicio)
+            estados[estado] = estados.get(estado, 0) + 1
+    finally:
+        escritor.close()
+
+
+async def prueba(args, direcciones: list) -> None:
+    rnd = random.Random(args.semilla)
+    cola = asyncio.Queue()
+    for _ in range(args.peticiones):
+        cola.put_nowait((f"/{args.ruta}", {'origen': rnd.choice(direcciones), 'destino': rnd.choice(direcciones),
+                                           'modo': rnd.choice(args.modos)}))
+    latencias, estados = [], {}
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente(args.host, args.puerto, cola, latencias, estados)
+                           for _ in range(args.concurrencia)))
+    total = time.perf_counter() - inicio
+
+    latencias = np.array(latencias) * 1000
+    print(f"{len(latencias)} peticiones a /{args.ruta} con {args.concurrencia} clientes en {total:.2f} s "
+          f"({len(latencias) / total:.1f} peticiones/s)")
+    print(f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'máx (ms)':>10}{'media (ms)':>12}")
+    print(f"{np.percentile(latencias, 50):>10.1f}{np.percentile(latencias, 99):>10.1f}"
+          f"{latencias.max():>10.1f}{latencias.mean():>12.1f}")
+    print("Respuestas: " + ", ".join(f"{estado}: {numero}" for estado, numero in sorted(estados.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='dirección del servicio')
+    parser.add_argument('--puerto', type=int, default=8080, help='puerto del servicio')
+    parser.add_argument('--peticiones', type=int, default=500, help='número total de peticiones')
+    parser.add_argument('--concurrencia', type=int, default=16, help='clientes simultáneos')
+    parser.add_argument('--ruta', default='ruta', choices=['ruta', 'instrucciones'], help='ruta del servicio a probar')
+    parser.add_argument('--modos', nargs='+', default=['corta', 'rapida', 'semaforos'], help='modos de ruta a sortear')
+    parser.add_argument('--semilla', type=int, default=0, help='semilla de las direcciones aleatorias')
+    args = parser.parse_args()
+
+    # Direcciones del callejero en el formato "Clase Partícula Nombre, número"
+    callejero = c.carga_callejero()
+    muestra = callejero.sample(min(len(callejero), 5000), random_state=args.semilla)
+    direcciones = [f"{clase} {par} {nombre}, {numero}".replace("  ", " ")
+                   for clase, par, nombre, numero in zip(muestra['VIA_CLASE'].astype(str), muestra['VIA_PAR'].astype(str),
+                                                         muestra['VIA_NOMBRE'].astype(str), muestra['NUMERO'])]
+    asyncio.run(prueba(args, direcciones))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+sintetico.py
+
+Generador reproducible (con semilla) de datos sintéticos con el mismo formato que los de Madrid,
+para poder medir sin conexión ni ficheros descargados:
+    - grafo_sintetico: cuadrícula de calles como nx.MultiDiGraph de OpenStreetMap, con
+      coordenadas x/y algo desplazadas, street_count en los vértices y length, maxspeed (como
+      número, lista o "vmin|vmax", o sin ella), highway, name, oneway y osmid en las aristas.
+      Hay avenidas principales y secundarias cada pocas calles, calles de sentido único y
+      tramos que faltan, como en una red real.
+    - callejero_sintetico: fichero de direcciones con los portales a ambos lados de cada calle,
+      separado por ';', en latin-1 y con las coordenadas en grados, minutos y segundos, como
+      direcciones.csv.
+
+Uso como librería (desde la raíz del repositorio):
+    from benchmarks.sintetico import grafo_sintetico, callejero_sintetico
+    G = grafo_sintetico(100, 100, semilla=0)
+    callejero_sintetico(G, 'direcciones.csv', semilla=0)
+"""
+
+from typing import Dict, List, Tuple
+import math
+import random
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+import callejero as c
+
+RADIO_TIERRA = 6371008.8  # Metros
+# Nombres de las calles, con tildes y eñes para comprobar la codificación latin-1
+NOMBRES = ['ALCALÁ', 'PEÑALARA', 'ÁLAMO', 'PIÑONERO', 'OLIVO', 'MÁLAGA', 'ROSALÍA', 'ÓPERA', 'JAÉN',
+           'CASTAÑO', 'NÚÑEZ', 'ESPAÑA', 'LEÓN', 'ÁVILA', 'CÁDIZ', 'ALMENDRO']
+CLASES = [('CALLE', 'DE'), ('CALLE', 'DEL'), ('PASEO', 'DE'), ('CALLE', ''), ('PLAZA', 'DE LA'), ('AVENIDA', 'DE')]
+# Tipos de vía de las calles de cada nivel de la cuadrícula y velocidades con que se anotan
+VIA_PRINCIPAL = 'primary'
+VIA_SECUNDARIA = 'secondary'
+VIAS_LOCALES = ['residential', 'residential', 'residential', 'living_street', 'unclassified', 'tertiary']
+VELOCIDADES = ['30', '50', '20|40', ['50', '30'], '70']
+
+
+def nombres_calles(numero: int, semilla: int = 0) -> List[Tuple[str, str, str]]:
+    """ Genera nombres distintos para las calles de la cuadrícula.
+
+    Args:
+        numero (int): número de calles
+        semilla (int): semilla del generador
+    Returns:
+        List[Tuple[str,str,str]]: (VIA_CLASE, VIA_PAR, VIA_NOMBRE) de cada calle
+    """
+    rnd = random.Random(semilla)
+    return [rnd.choice(CLASES) + (f"{NOMBRES[k % len(NOMBRES)]} {k // len(NOMBRES) + 1}",) for k in range(numero)]
+
+
+def nombre_osm(clase: str, par: str, nombre: str) -> str:
+    """ Nombre de una calle como aparece en OpenStreetMap (por ejemplo "Calle de Alcalá 1"). """
+    return " ".join(parte for parte in (clase.capitalize(), par.lower(), nombre.title()) if parte)
+
+
+def distancia(y1: float, x1: float, y2: float, x2: float) -> float:
+    """ Distancia haversine en metros entre dos puntos en grados. """
+    la1, lo1, la2, lo2 = map(math.radians, (y1, x1, y2, x2))
+    h = math.sin((la2 - la1) / 2)**2 + math.cos(la1) * math.cos(la2) * math.sin((lo2 - lo1) / 2)**2
+    return 2 * RADIO_TIERRA * math.asin(math.sqrt(h))
+
+
+def grafo_sintetico(filas: int = 100, columnas: int = 100, semilla: int = 0, separacion: float = 100.0,
+                    sentido_unico: float = 0.3, huecos: float = 0.05, latitud: float = 40.40, longitud: float = -3.70) -> nx.MultiDiGraph:
+    """ Genera una cuadrícula de calles con los atributos de un grafo de OpenStreetMap.
+
+    Cada fila y cada columna de la cuadrícula es una calle. Una de cada diez es una avenida
+    principal y una de cada cinco una secundaria, ambas de doble sentido; de las demás, una
+    fracción sentido_unico tiene un solo sentido (alterno en calles consecutivas). Una fracción
+    huecos de los tramos no existe.
+
+    Args:
+        filas (int): número de calles horizontales
+        columnas (int): número de calles verticales
+        semilla (int): semilla del generador
+        separacion (float): metros entre calles paralelas
+        sentido_unico (float): fracción de calles locales de sentido único
+        huecos (float): fracción de tramos que faltan
+        latitud (float): latitud de la esquina suroeste
+        longitud (float): longitud de la esquina suroeste
+    Returns:
+        nx.MultiDiGraph: grafo con filas*columnas vértices, en el formato de carga_grafo
+    """
+    rnd = random.Random(semilla)
+    paso_y = math.degrees(separacion / RADIO_TIERRA)
+    paso_x = paso_y / math.cos(math.radians(latitud))
+    # Las calles y la semilla se guardan en el grafo para nombrar las direcciones del callejero
+    G = nx.MultiDiGraph(crs='epsg:4326', calles=filas + columnas, semilla=semilla)
+    def vertice(i, j):
+        return 100000000 + i * columnas + j
+    for i in range(filas):
+        for j in range(columnas):
+            G.add_node(vertice(i, j), y=latitud + (i + rnd.uniform(-0.15, 0.15)) * paso_y,
+                       x=longitud + (j + rnd.uniform(-0.15, 0.15)) * paso_x)
+
+    calles = nombres_calles(filas + columnas, semilla)
+    osmid = 200000000
+    # Calles horizontales (k < filas) y verticales (k >= filas), con sus tramos en orden
+    for k in range(filas + columnas):
+        linea = k if k < filas else k - filas
+        if linea % 10 == 0:
+            via, doble = VIA_PRINCIPAL, True
+        elif linea % 5 == 0:
+            via, doble = VIA_SECUNDARIA, True
+        else:
+            via, doble = rnd.choice(VIAS_LOCALES), rnd.random() >= sentido_unico
+        velocidad = rnd.choice(VELOCIDADES) if rnd.random() < 0.4 else None
+        nombre = nombre_osm(*calles[k])
+        tramos = [(vertice(linea, j), vertice(linea, j+1)) for j in range(columnas - 1)] if k < filas else \
+                 [(vertice(i, linea), vertice(i+1, linea)) for i in range(filas - 1)]
+        if not doble and linea % 2:
+            tramos = [(v, u) for u, v in tramos]
+        for u, v in tramos:
+            if rnd.random() < huecos:
+                continue
+            osmid += 1
+            longitud_tramo = round(distancia(G.nodes[u]['y'], G.nodes[u]['x'], G.nodes[v]['y'], G.nodes[v]['x'])
+                                   * rnd.uniform(1.0, 1.1), 3)
+            datos = {'osmid': osmid, 'highway': via, 'name': nombre, 'oneway': not doble, 'length': longitud_tramo}
+            if velocidad is not None:
+                datos['maxspeed'] = velocidad
+            G.add_edge(u, v, key=0, reversed=False, **datos)
+            if doble:
+                G.add_edge(v, u, key=0, reversed=True, **datos)
+
+    for v in G.nodes:
+        G.nodes[v]['street_count'] = len(set(G.successors(v)) | set(G.predecessors(v)))
+    return G
+
+
+def grados_minutos_segundos(valores: np.ndarray, positivo: str, negativo: str) -> List[str]:
+    """ Escribe coordenadas en grados como en direcciones.csv (por ejemplo 40°25'47.93'' N). """
+    resultado = []
+    for valor in valores.tolist():
+        segundos = round(abs(valor) * 3600, 2)
+        grados, resto = divmod(segundos, 3600)
+        minutos, segundos = divmod(resto, 60)
+        resultado.append(f"{int(grados)}°{int(minutos)}'{segundos:.2f}'' {positivo if valor >= 0 else negativo}")
+    return resultado
+
+
+def callejero_sintetico(G: nx.MultiDiGraph, fichero: str = c.STREET_FILE_NAME, semilla: int = 0, portales: int = 2) -> pd.DataFrame:
+    """ Escribe un fichero de direcciones, con el formato de direcciones.csv, con los portales de
+    las calles de un grafo de grafo_sintetico.
+
+    En cada tramo de cada calle hay portales números impares a un lado y pares al otro,
+    numerados de forma creciente a lo largo de la calle, a unos metros del eje de la calle.
+
+    Args:
+        G (nx.MultiDiGraph): grafo de grafo_sintetico
+        fichero (str): ruta del fichero que se escribe
+        semilla (int): semilla del generador
+        portales (int): portales de cada lado de cada tramo
+    Returns:
+        pd.DataFrame: direcciones escritas, con las coordenadas en grados (como carga_callejero)
+    """
+    rnd = np.random.default_rng(semilla)
+    # Tramos de cada calle, sin repetir los dos sentidos, en el orden en que se crearon
+    tramos: Dict[str, List[Tuple[object, object]]] = {}
+    vistos = set()
+    for u, v, nombre in G.edges(data='name'):
+        if (v, u) not in vistos:
+            vistos.add((u, v))
+            tramos.setdefault(nombre, []).append((u, v) if u < v else (v, u))
+    calles = {nombre_osm(*calle): calle for calle in nombres_calles(G.graph['calles'], G.graph['semilla'])}
+
+    filas = []
+    for nombre, aristas in tramos.items():
+        clase, par, via = calles[nombre]
+        aristas.sort()
+        numero = {1: 1, 0: 2}
+        for u, v in aristas:
+            y1, x1, y2, x2 = G.nodes[u]['y'], G.nodes[u]['x'], G.nodes[v]['y'], G.nodes[v]['x']
+            # Desplazamiento perpendicular de unos 8 metros a cada lado de la calle
+            normal_y, normal_x = -(x2 - x1), y2 - y1
+            escala = 8 / max(distancia(y1, x1, y1 + normal_y, x1 + normal_x), 1e-9)
+            for lado, signo in ((1, 1), (0, -1)):
+                for t in (np.arange(portales) + rnd.uniform(0.2, 0.8, portales)) / portales:
+                    filas.append((clase, par, via, numero[lado], y1 + t * (y2 - y1) + signo * escala * normal_y,
+                                  x1 + t * (x2 - x1) + signo * escala * normal_x))
+                    numero[lado] += 2
+    direcciones = pd.DataFrame(filas, columns=['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE', 'NUMERO', 'LATITUD', 'LONGITUD'])
+    csv = direcciones.assign(LATITUD=grados_minutos_segundos(direcciones['LATITUD'].to_numpy(), 'N', 'S'),
+                             LONGITUD=grados_minutos_segundos(direcciones['LONGITUD'].to_numpy(), 'E', 'W'))
+    csv.insert(0, 'COD_VIA', pd.factorize(csv['VIA_NOMBRE'])[0])
+    csv.to_csv(fichero, sep=';', encoding='latin-1', index=False)
+    return direcciones
+
+
+def direcciones_aleatorias(direcciones: pd.DataFrame, numero: int, semilla: int = 0) -> List[str]:
+    """ Elige direcciones del callejero al azar y las escribe como las teclearía un usuario.
+
+    Args:
+        direcciones (pd.DataFrame): callejero
+        numero (int): número de direcciones
+        semilla (int): semilla del generador
+    Returns:
+        List[str]: direcciones "VIA_CLASE VIA_PAR VIA_NOMBRE, NUMERO"
+    """
+    rnd = random.Random(semilla)
+    filas = direcciones.iloc[[rnd.randrange(len(direcciones)) for _ in range(numero)]]
+    return [" ".join(parte for parte in (clase, par, via) if parte) + f", {numero}"
+            for clase, par, via, numero in zip(filas['VIA_CLASE'], filas['VIA_PAR'], filas['VIA_NOMBRE'], filas['NUMERO'])]
@@ -0,0 +1,354 @@
+"""
+cache_rutas.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Caché acotada en memoria de caminos mínimos y de árboles de caminos mínimos sobre un grafo
+compilado. Los caminos se guardan por (origen, destino, modo) y los árboles (el array de padres
+del algoritmo de Dijkstra) por (origen, modo): cuando un origen se repite a menudo (un almacén,
+un destino muy popular...) se calcula su árbol completo una vez y cualquier destino desde ese
+origen se resuelve después sin ninguna búsqueda. Cuando se supera la memoria asignada se
+descartan las entradas usadas hace más tiempo (LRU).
+
+Si cambian los pesos de algunas aristas del grafo (GrafoCompilado.actualiza_pesos) solo se
+descartan las entradas a las que les puede afectar el cambio.
+"""
+
+from typing import List, Dict, Tuple, Callable, Union, Iterable
+from collections import OrderedDict
+import threading
+import numpy as np
+
+from grafo_compilado import GrafoCompilado, distancia_haversine
+from grafo_pesado import INFTY, dijkstra_compilado, a_estrella, reconstruye_camino
+import metricas
+
+MEMORIA_CAMINOS = 16 * 2**20  # Bytes como máximo para los caminos guardados
+MEMORIA_ARBOLES = 64 * 2**20  # Bytes como máximo para los árboles guardados
+UMBRAL_ARBOL = 3  # Consultas desde un mismo origen a partir de las que se calcula su árbol completo
+LIMITE_ORIGENES = 10000  # Orígenes recientes de los que se cuentan las consultas
+COSTE_ENTRADA = 120  # Bytes aproximados de cada entrada aparte de sus arrays (clave, nodo del diccionario...)
+TOLERANCIA = 1e-6  # Margen relativo en las comparaciones de pesos al invalidar (las distancias de los árboles son float32)
+BLOQUE_COMPROBACION = 2**20  # Pares (camino, arista) que se comprueban a la vez al invalidar caminos
+
+
+def _tamano(entrada: Tuple[np.ndarray, ...]) -> int:
+    """ Bytes que ocupa en la caché una entrada (tupla de arrays). """
+    return sum(parte.nbytes for parte in entrada) + COSTE_ENTRADA
+
+
+class CacheRutas:
+    """ Caché LRU de caminos y árboles de caminos mínimos de un grafo compilado.
+
+    Cada camino se guarda como un array de posiciones int32 junto con su peso, y cada árbol
+    como un array de padres int32 junto con las distancias float32 desde su origen, de forma
+    que su tamaño en memoria se conoce exactamente.
+
+    Al actualizar los pesos de unas aristas se descartan solo:
+        - los caminos que pasan por una arista cuyo peso sube (o que se cierra),
+        - los caminos cuyo peso podría mejorar pasando por una arista cuyo peso baja, según la
+          cota del peso en línea recta hasta su origen y desde su destino,
+        - los árboles que usan una arista cuyo peso sube y aquellos en los que una arista que
+          baja acorta la distancia hasta su destino.
+    Un modo se invalida entero si su array de pesos en el grafo se sustituye por otro, y todo
+    si se cambia de grafo.
+
+    Attributes:
+        grafo (GrafoCompilado): grafo sobre el que se calculan los caminos
+        memoria_caminos (int): bytes como máximo para los caminos
+        memoria_arboles (int): bytes como máximo para los árboles
+        umbral_arbol (int): consultas desde un origen a partir de las que se guarda su árbol
+        estadisticas (Dict[str,int]): contadores de aciertos ('aciertos_caminos',
+            'aciertos_arboles'), fallos ('fallos'), árboles calculados ('arboles'), entradas
+            descartadas por falta de memoria ('descartes') y por cambios de pesos ('invalidaciones')
+    """
+
+    def __init__(self, grafo: GrafoCompilado, memoria_caminos: int = MEMORIA_CAMINOS,
+                 memoria_arboles: int = MEMORIA_ARBOLES, umbral_arbol: int = UMBRAL_ARBOL):
+        self.memoria_caminos = memoria_caminos
+        self.memoria_arboles = memoria_arboles
+        self.umbral_arbol = umbral_arbol
+        self.estadisticas = {'aciertos_caminos': 0, 'aciertos_arboles': 0, 'fallos': 0, 'arboles': 0, 'descartes': 0,
+                             'invalidaciones': 0}
+        self._cerrojo = threading.Lock()
+        self.grafo = None
+        self.cambia_grafo(grafo)
+
+    def cambia_grafo(self, grafo: GrafoCompilado) -> None:
+        """ Asocia la caché a otro grafo (o al mismo, modificado) y descarta todo su contenido.
+
+        Args:
+            grafo (GrafoCompilado): grafo nuevo
+        Returns: None
+        """
+        with self._cerrojo:
+            if grafo is not self.grafo:
+                grafo.suscribe(self._pesos_actualizados)
+            self.grafo = grafo
+            self._caminos = OrderedDict()
+            self._arboles = OrderedDict()
+            self._consultas = OrderedDict()
+            self._bytes_caminos = 0
+            self._bytes_arboles = 0
+            # Array de pesos de cada modo con el que se calcularon sus entradas
+            self._pesos = {}
+
+    def invalida(self, peso: Union[str, Callable] = None) -> None:
+        """ Descarta las entradas de un modo de ruta, o todas si no se indica ninguno.
+
+        Args:
+            peso (str o función, opcional): modo de ruta
+        Returns: None
+        """
+        if peso is None:
+            self.cambia_grafo(self.grafo)
+            return
+        with self._cerrojo:
+            self._invalida_modo(self.grafo.modo(peso))
+
+    def _invalida_modo(self, modo: object) -> None:
+        """ Descarta las entradas de un modo (con el cerrojo ya adquirido). """
+        for clave in [clave for clave in self._caminos if clave[2] == modo]:
+            self._bytes_caminos -= _tamano(self._caminos.pop(clave))
+        for clave in [clave for clave in self._arboles if clave[1] == modo]:
+            self._bytes_arboles -= _tamano(self._arboles.pop(clave))
+        for clave in [clave for clave in self._consultas if clave[1] == modo]:
+            del self._consultas[clave]
+        self._pesos.pop(modo, None)
+
+    def _comprueba_modo(self, modo: object) -> None:
+        """ Invalida el modo si su array de pesos ha cambiado desde que se guardaron sus entradas. """
+        pesos = self.grafo.pesos[modo]
+        if self._pesos.get(modo) is not pesos:
+            self._invalida_modo(modo)
+            self._pesos[modo] = pesos
+
+    def _guarda(self, tabla: OrderedDict, clave: tuple, valor: Tuple[np.ndarray, ...], caminos: bool) -> None:
+        """ Guarda una entrada y descarta las más antiguas hasta volver a la memoria asignada. """
+        if clave in tabla:
+            return
+        tabla[clave] = valor
+        if caminos:
+            self._bytes_caminos += _tamano(valor)
+            while self._bytes_caminos > self.memoria_caminos and tabla:
+                self._bytes_caminos -= _tamano(tabla.popitem(last=False)[1])
+                self.estadisticas['descartes'] += 1
+        else:
+            self._bytes_arboles += _tamano(valor)
+            while self._bytes_arboles > self.memoria_arboles and tabla:
+                self._bytes_arboles -= _tamano(tabla.popitem(last=False)[1])
+                self.estadisticas['descartes'] += 1
+
+    def _pesos_actualizados(self, grafo: GrafoCompilado, modo: object, aristas: np.ndarray,
+                            anteriores: np.ndarray, nuevos: np.ndarray) -> None:
+        """ Descarta las entradas afectadas por un cambio de pesos del grafo (se llama desde
+        GrafoCompilado.actualiza_pesos).
+
+        Args:
+            grafo (GrafoCompilado): grafo en el que han cambiado los pesos
+            modo (object): modo de ruta
+            aristas (np.ndarray): posiciones de las aristas actualizadas
+            anteriores (np.ndarray): pesos anteriores de las aristas
+            nuevos (np.ndarray): pesos nuevos de las aristas
+        Returns: None
+        """
+        if grafo is not self.grafo:
+            return
+        cambian = nuevos != anteriores
+        aristas, anteriores, nuevos = aristas[cambian], anteriores[cambian], nuevos[cambian]
+        origenes = np.searchsorted(grafo.indptr, aristas, side='right') - 1
+        destinos = grafo.indices[aristas].astype(np.int64)
+        suben = nuevos > anteriores
+        # Una arista cerrada no da ningún camino mejor
+        bajan = (nuevos < anteriores) & np.isfinite(nuevos)
+        with self._cerrojo:
+            if modo not in self._pesos:
+                # No hay ninguna entrada de este modo
+                return
+            # El array de pesos se sustituye por una copia en la primera actualización
+            self._pesos[modo] = grafo.pesos[modo]
+            if not len(aristas):
+                return
+            descartes = 0
+
+            u_sube, v_sube = origenes[suben], destinos[suben]
+            u_baja, v_baja, w_baja = origenes[bajan], destinos[bajan], nuevos[bajan]
+            for clave in [clave for clave in self._arboles if clave[1] == modo]:
+                padre, distancias = self._arboles[clave]
+                if (padre[v_sube] == u_sube).any() or (
+                        distancias[u_baja] + w_baja < distancias[v_baja] * (1 + TOLERANCIA)).any():
+                    self._bytes_arboles -= _tamano(self._arboles.pop(clave))
+                    descartes += 1
+
+            claves = [clave for clave in self._caminos if clave[2] == modo]
+            if claves:
+                afectados = np.zeros(len(claves), dtype=bool)
+                caminos = [self._caminos[clave][0] for clave in claves]
+                if len(u_sube):
+                    # Caminos que contienen alguno de los pares de vértices consecutivos u->v que suben
+                    longitudes = np.array([len(camino) for camino in caminos])
+                    vertices = np.concatenate(caminos).astype(np.int64)
+                    if len(vertices) > 1:
+                        pertenencia = np.repeat(np.arange(len(claves)), longitudes)
+                        pares = vertices[:-1] * grafo.n + vertices[1:]
+                        usan = np.isin(pares, u_sube * grafo.n + v_sube) & (pertenencia[:-1] == pertenencia[1:])
+                        afectados[pertenencia[:-1][usan]] = True
+                if len(u_baja):
+                    # Cota inferior del peso de un camino que pase por la arista u->v que baja:
+                    # peso en línea recta hasta u, peso nuevo de la arista y peso en línea recta desde v
+                    cota = grafo.cota_peso_distancia(modo)
+                    origen = np.array([clave[0] for clave in claves])
+                    destino = np.array([clave[1] for clave in claves])
+                    costes = np.array([float(self._caminos[clave][1]) for clave in claves])
+                    bloque = max(1, BLOQUE_COMPROBACION // len(u_baja))
+                    for i in range(0, len(claves), bloque):
+                        o, d = origen[i:i+bloque, None], destino[i:i+bloque, None]
+                        hasta_u = distancia_haversine(grafo.y[o], grafo.x[o], grafo.y[u_baja], grafo.x[u_baja])
+                        desde_v = distancia_haversine(grafo.y[v_baja], grafo.x[v_baja], grafo.y[d], grafo.x[d])
+                        # Sin coordenadas la cota es 0
+                        cotas = cota * np.nan_to_num(hasta_u + desde_v) + w_baja
+                        afectados[i:i+bloque] |= (cotas * (1 - TOLERANCIA) < costes[i:i+bloque, None]).any(axis=1)
+                for j in np.flatnonzero(afectados).tolist():
+                    self._bytes_caminos -= _tamano(self._caminos.pop(claves[j]))
+                    descartes += 1
+            self.estadisticas['invalidaciones'] += descartes
+
+    def arbol(self, peso: Union[str, Callable], origen: int) -> np.ndarray:
+        """ Devuelve el array de padres del árbol de caminos mínimos desde una posición del grafo,
+        calculándolo y guardándolo si no estaba en la caché.
+
+        Args:
+            peso (str o función): modo de ruta
+            origen (int): posición del vértice de origen
+        Returns:
+            np.ndarray: padre de cada vértice en el árbol (int32, -1 si no tiene)
+        """
+        modo = self.grafo.modo(peso)
+        with self._cerrojo:
+            self._comprueba_modo(modo)
+            entrada = self._arboles.get((origen, modo))
+            if entrada is not None:
+                self._arboles.move_to_end((origen, modo))
+                return entrada[0]
+            version = self.grafo.versiones.get(modo, 0)
+        distancias, padre = dijkstra_compilado(self.grafo, modo, origen)
+        distancias[distancias >= INFTY] = np.inf
+        padre = padre.astype(np.int32)
+        with self._cerrojo:
+            self.estadisticas['arboles'] += 1
+            # Si los pesos han cambiado durante el cálculo el árbol puede no ser válido y no se guarda
+            if self.grafo.versiones.get(modo, 0) == version:
+                self._guarda(self._arboles, (origen, modo), (padre, distancias.astype(np.float32)), caminos=False)
+        return padre
+
+    def camino_minimo_compilado(self, peso: Union[str, Callable], origen: int, destino: int) -> List[int]:
+        """ Devuelve el camino mínimo entre dos posiciones del grafo, desde la caché si es posible.
+
+        Se busca primero el camino y después el árbol del origen. Si no está ninguno de los dos,
+        se calcula el árbol completo si el origen ya se ha consultado umbral_arbol veces y, si no,
+        solo el camino con A*.
+
+        Args:
+            peso (str o función): modo de ruta
+            origen (int): posición del vértice de origen
+            destino (int): posición del vértice de destino
+        Returns:
+            List[int]: posiciones de los vértices del camino, de origen a destino
+        Raises:
+            ValueError: Si no se puede llegar desde el origen hasta el destino
+        """
+        modo = self.grafo.modo(peso)
+        clave = (origen, destino, modo)
+        with self._cerrojo:
+            self._comprueba_modo(modo)
+            version = self.grafo.versiones.get(modo, 0)
+            camino = self._caminos.get(clave)
+            if camino is not None:
+                camino = camino[0]
+                self._caminos.move_to_end(clave)
+                resultado = 'aciertos_caminos'
+            else:
+                padre = self._arboles.get((origen, modo))
+                if padre is not None:
+                    padre = padre[0]
+                    self._arboles.move_to_end((origen, modo))
+                    resultado = 'aciertos_arboles'
+                else:
+                    resultado = 'fallos'
+                    consultas = self._consultas.pop((origen, modo), 0) + 1
+                    self._consultas[(origen, modo)] = consultas
+                    if len(self._consultas) > LIMITE_ORIGENES:
+                        self._consultas.popitem(last=False)
+            self.estadisticas[resultado] += 1
+        metricas.cuenta('cache_' + resultado)
+        if camino is not None:
+            # Un array vacío indica que no hay camino
+            if not len(camino):
+                raise ValueError(f"No hay camino posible que vaya de {origen} hasta {destino}.")
+            return camino.tolist()
+        # Solo se calcula el árbol si cabe en la memoria asignada a los árboles
+        if padre is None and consultas >= self.umbral_arbol and 8 * self.grafo.n + COSTE_ENTRADA <= self.memoria_arboles:
+            padre = self.arbol(modo, origen)
+        if padre is not None:
+            return reconstruye_camino(padre, origen, destino)
+        try:
+            camino = a_estrella(self.grafo, modo, origen, destino)
+        except ValueError:
+            entrada = (np.empty(0, dtype=np.int32), np.float64(np.inf))
+            camino = None
+        else:
+            coste = self.grafo.pesos[modo][self.grafo.aristas_camino(camino)].sum()
+            entrada = (np.array(camino, dtype=np.int32), np.float64(coste))
+        with self._cerrojo:
+            # Si los pesos han cambiado durante el cálculo el camino puede no ser válido y no se guarda
+            if self.grafo.versiones.get(modo, 0) == version:
+                self._guarda(self._caminos, clave, entrada, caminos=True)
+        if camino is None:
+            raise ValueError(f"No hay camino posible que vaya de {origen} hasta {destino}.")
+        return camino
+
+    def camino_minimo(self, peso: Union[str, Callable], origen: object, destino: object) -> List[object]:
+        """ Devuelve el camino mínimo entre dos vértices del grafo original, desde la caché si es posible.
+
+        Args:
+            peso (str o función): modo de ruta
+            origen (object): vértice de origen
+            destino (object): vértice de destino
+        Returns:
+            List[object]: lista con los vértices del camino más corto, de origen a destino.
+        Raises:
+            ValueError: Si no se puede llegar desde el origen hasta el destino
+        """
+        indice = self.grafo.indice
+        if origen not in indice or destino not in indice:
+            raise ValueError(
+                f"No hay camino posible que vaya de {origen} hasta {destino}.")
+        try:
+            camino = self.camino_minimo_compilado(peso, indice[origen], indice[destino])
+        except ValueError:
+            raise ValueError(
+                f"No hay camino posible que vaya de {origen} hasta {destino}.")
+        return self.grafo.camino_original(camino)
+
+    def precalcula(self, peso: Union[str, Callable], origenes: Iterable[object]) -> None:
+        """ Calcula y guarda los árboles de unos orígenes conocidos de antemano (almacenes, por ejemplo).
+
+        Args:
+            peso (str o función): modo de ruta
+            origenes (Iterable[object]): vértices del grafo original
+        Returns: None
+        """
+        for origen in origenes:
+            self.arbol(peso, self.grafo.indice[origen])
+
+    def memoria(self) -> Dict[str, int]:
+        """ Devuelve el número de entradas y los bytes ocupados por los caminos y los árboles.
+
+        Returns:
+            Dict[str,int]: 'caminos', 'bytes_caminos', 'arboles' y 'bytes_arboles'
+        """
+        with self._cerrojo:
+            return {'caminos': len(self._caminos), 'bytes_caminos': self._bytes_caminos,
+                    'arboles': len(self._arboles), 'bytes_arboles': self._bytes_arboles}
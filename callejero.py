@@ -20,13 +20,34 @@ import networkx as nx
 import pandas as pd
 import re
 import os
-from typing import Tuple
+import hashlib
+import unicodedata
+import weakref
+import numpy as np
+from typing import Tuple, Callable, Dict, List, Union
 from osmnx import convert
+import grafo_compilado
+from grafo_compilado import GrafoCompilado
+import metricas
+
+# pyarrow es opcional: permite extraer las coordenadas con un regex vectorizado y guardar la caché del callejero
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
 
 STREET_FILE_NAME="direcciones.csv"
+# Directorio con el callejero ya procesado, en formato Feather, una versión por huella del csv
+STREET_CACHE_DIR = STREET_FILE_NAME + ".cache"
 
 PLACE_NAME = "Madrid, Spain"
 MAP_FILE_NAME="madrid.graphml"
+# Directorio con las versiones compiladas del grafo, una por cada huella del fichero MAP_FILE_NAME
+GRAPH_CACHE_DIR = MAP_FILE_NAME + ".cache"
+# Versión del contenido de la caché del grafo compilado. Hay que aumentarla cada vez que cambian
+# los arrays que guarda la función de compilación (gps.compila_callejero) o sus pesos
+FORMATO_CACHE = 2
 
 MAX_SPEEDS={'living_street': '20',
  'residential': '30',
@@ -57,56 +78,219 @@ class AdressNotFoundError(Exception):
 ############## Parte 2 ##############
 
 
-def carga_callejero() -> pd.DataFrame:
+def convierte_coordenadas(valores: pd.Series) -> np.ndarray:
+    """ Función que convierte una columna de coordenadas en grados, minutos y segundos
+    (por ejemplo 40°25'47.93'' N) a grados en formato float, todas a la vez.
+
+    Las partes de cada coordenada se extraen con un único regex sobre toda la columna (con el
+    motor de pyarrow si está instalado, que es mucho más rápido que str.extract) y la conversión
+    a grados se hace con numpy, con las mismas operaciones que la conversión fila a fila.
+
+    Args:
+        valores (Series): coordenadas en formato grados°minutos'segundos'' orientación
+    Returns:
+        np.ndarray: coordenadas en grados, negativas al oeste y al sur
+    Raises:
+        ValueError: Si alguna coordenada no tiene el formato esperado
+    Example:
+        convierte_coordenadas(pd.Series(["40°25'47.93'' N", "3°42'40.53'' W"])) = [40.42998055555555, -3.7112583333333333]
+    """
+    patron = r"^(?P<grados>\d+)°(?P<minutos>\d+)'(?P<segundos>[\d.]+)''\s*(?P<orientacion>[NSEW])"
+    if pc is not None:
+        partes = pc.extract_regex(pa.array(valores.astype(str).to_numpy(dtype=object)), patron)
+        partes = pd.DataFrame({nombre: partes.field(nombre).to_numpy(zero_copy_only=False)
+                               for nombre in ['grados', 'minutos', 'segundos', 'orientacion']})
+    else:
+        partes = valores.astype(str).str.extract(patron)
+    if partes.isna().any(axis=None):
+        fila = np.flatnonzero(partes.isna().any(axis=1).to_numpy())[0]
+        raise ValueError(f"Coordenada con formato no reconocido: {valores.iloc[fila]}")
+    grados = partes['grados'].to_numpy().astype(np.int64)
+    minutos = partes['minutos'].to_numpy().astype(np.int64)
+    segundos = partes['segundos'].to_numpy().astype(np.float64)
+    grado_corregido = grados + minutos/60 + segundos/3600
+    signo = np.where(np.isin(partes['orientacion'].to_numpy(), ['W', 'S']), -1, 1)
+    return grado_corregido * signo
+
+
+@metricas.instrumenta()
+def carga_callejero(usar_cache: bool = True) -> pd.DataFrame:
     """ Función que carga el callejero de Madrid, lo procesa y devuelve
     un DataFrame con los datos procesados
+
+    El DataFrame procesado se guarda en formato Feather (columnar y binario, con las columnas
+    de texto como categorías) en STREET_CACHE_DIR, con la huella del csv como nombre. Las
+    siguientes cargas leen ese fichero directamente mientras el csv no cambie. Si pyarrow no
+    está instalado se procesa siempre el csv.
     
-    Args: None
+    Args:
+        usar_cache (bool): si es False se procesa el csv sin leer ni escribir la caché
     Returns:
-        Dict[object,object]: Devuelve un diccionario que indica, para cada vértice del
-            grafo, qué vértice es su padre en el árbol abarcador mínimo.
+        DataFrame: columnas VIA_CLASE, VIA_PAR, VIA_NOMBRE, NUMERO, LATITUD y LONGITUD,
+            con las coordenadas en grados
     Raises:
         FileNotFoundError si el fichero csv con las direcciones no existe
     """
+    if usar_cache:
+        cache = os.path.join(STREET_CACHE_DIR, f"{huella_fichero(STREET_FILE_NAME)}.feather")
+        if os.path.exists(cache):
+            try:
+                return pd.read_feather(cache)
+            except ImportError:
+                usar_cache = False
+
     columnas_cargar =  ['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE', 'NUMERO', 'LATITUD','LONGITUD']
     # Cargamos el df teniendo en cuenta solo las columnas que buscamos y empleando encoding = 'latin1' para que recoja bien los datos
     try:
         direcciones = pd.read_csv(STREET_FILE_NAME,usecols=columnas_cargar,encoding='latin-1',sep = ';')
     except FileNotFoundError as error:
         raise error
-    # Creamos una función que empleando regex cambie las coordenadas y las transforme a formato float
-    def transformacion(valor):
-        patron = re.compile(r"(\d+)°(\d+)'([\d.]+)''\s*([NSEW])")
-        matches = re.match(patron,valor)
-        grados = int(matches.group(1))
-        minutos = int(matches.group(2))
-        segundos = float(matches.group(3))
-        orientacion = matches.group(4)
-
-        grado_corregido = grados + minutos/60+ segundos/3600
-        if orientacion == 'W' or orientacion == 'S':
-            grado_corregido = grado_corregido * -1
-        return grado_corregido
     # Cambiamos las columnas del DataFrame
-    direcciones['LONGITUD'] = direcciones['LONGITUD'].apply(transformacion)
-    direcciones['LATITUD'] = direcciones['LATITUD'].apply(transformacion)
+    direcciones['LONGITUD'] = convierte_coordenadas(direcciones['LONGITUD'])
+    direcciones['LATITUD'] = convierte_coordenadas(direcciones['LATITUD'])
     
     # Para la función busca dirección los nan del VIA_PAR dan problema, asi que los hemos cambiado por "" en este apartado
     direcciones['VIA_PAR'] = direcciones['VIA_PAR'].fillna("")
+    # Hay pocos valores distintos de cada columna de texto, así que las guardamos como categorías
+    for columna in ['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE']:
+        direcciones[columna] = direcciones[columna].astype('category')
+
+    if usar_cache:
+        try:
+            os.makedirs(STREET_CACHE_DIR, exist_ok=True)
+            temporal = f"{cache}.{os.getpid()}.tmp"
+            direcciones.to_feather(temporal)
+            os.replace(temporal, cache)
+        except ImportError:
+            pass
     return direcciones
 
 
 
 
+# Clave de una dirección en el índice del callejero: (VIA_CLASE, VIA_PAR, VIA_NOMBRE, NUMERO) normalizados
+ClaveDireccion = Tuple[str, str, str, int]
+# Datos de una dirección en el índice: (LATITUD, LONGITUD, posición de la fila en el DataFrame)
+DatosDireccion = Tuple[float, float, int]
+
+# Índices ya construidos para cada DataFrame del callejero, junto a una referencia débil al DataFrame
+_indices_callejero = {}
+
+
+def normaliza(texto: str) -> str:
+    """ Normaliza un texto para comparar nombres de calles: lo pasa a mayúsculas, quita las
+    tildes y diéresis (conservando la Ñ) y deja un único espacio entre palabras.
+
+    Args:
+        texto (str): texto a normalizar
+    Returns:
+        str: texto normalizado
+    Example:
+        normaliza("  Calle de  Alcalá ") = "CALLE DE ALCALA"
+        normaliza("Peñalara") = "PEÑALARA"
+    """
+    # Separamos cada letra de su tilde (NFD), quitamos las tildes y volvemos a juntar la virgulilla de la Ñ (NFC)
+    descompuesto = unicodedata.normalize('NFD', texto.upper())
+    sin_tildes = ''.join(letra for letra in descompuesto
+                         if not unicodedata.combining(letra) or letra == '\u0303')
+    return ' '.join(unicodedata.normalize('NFC', sin_tildes).split())
+
+
+def interpreta_direccion(direccion: str) -> ClaveDireccion:
+    """ Separa una dirección, dada en el formato
+        calle, numero
+    en la clase de vía, la partícula, el nombre de la vía y el número, normalizados.
+
+    Args:
+        direccion (str): Nombre completo de la calle con número, en formato "Calle, num"
+    Returns:
+        Tuple[str,str,str,int]: (VIA_CLASE, VIA_PAR, VIA_NOMBRE, NUMERO)
+    Raises:
+        AdressNotFoundError: Si la dirección no tiene el formato esperado
+    Example:
+        interpreta_direccion("Calle de Alberto Aguilera, 23") = ("CALLE", "DE", "ALBERTO AGUILERA", 23)
+    """
+    # Mediante un regex distingo entre los diferentes elemntos de la direccion
+    patron = r"([a-zA-ZáéíóúÁÉÍÓÚñÑ]+)\s+((?:de\s+(?:la|las|el|los)|del|de)?)?\s*([a-zA-ZáéíóúÁÉÍÓÚñÑ\s\-[0-9]+?)\s*,+\s*(\d+)"
+    # Las partículas del patrón están en minúsculas, así que buscamos sobre la dirección en minúsculas
+    matches = re.search(patron, direccion.lower())
+    if matches is None:
+        raise AdressNotFoundError(direccion)
+    # El primer grupo es un str de cualquier duración hasta llegar al primer espacio, por lo que la clase es el grupo en mayúscula
+    via_clase = normaliza(matches.group(1))
+    # El segundo grupo son las preposiciones de las calles y sus posibles combinaciones, quedando vacio si no hay
+    via_par = normaliza(matches.group(2) or "")
+    # El tercer grupo es un str de cualquier duracion espacios incluídos hasta llegar a la coma
+    via_nombre = normaliza(matches.group(3))
+    # El cuarto grupo es el numero
+    numero = int(matches.group(4))
+    return (via_clase, via_par, via_nombre, numero)
+
+
+def indexa_callejero(callejero: pd.DataFrame) -> Dict[ClaveDireccion, DatosDireccion]:
+    """ Construye un índice (tabla hash) de las direcciones del callejero, que permite buscar una
+    dirección en tiempo constante en lugar de recorrer todo el DataFrame.
+
+    Los nombres se normalizan con normaliza, por lo que las búsquedas no distinguen mayúsculas,
+    minúsculas ni tildes. Si una dirección aparece varias veces se queda la primera.
+
+    Args:
+        callejero (DataFrame): DataFrame con la información de las calles (salida de carga_callejero)
+    Returns:
+        Dict[Tuple[str,str,str,int],Tuple[float,float,int]]: (latitud, longitud, fila) de cada
+            dirección, siendo fila su posición en el DataFrame
+    """
+    # Normalizamos cada nombre distinto una sola vez
+    columnas = []
+    for columna in ['VIA_CLASE', 'VIA_PAR', 'VIA_NOMBRE']:
+        valores = callejero[columna].fillna("").astype(str)
+        unicos = valores.unique()
+        normalizados = dict(zip(unicos, (normaliza(valor) for valor in unicos)))
+        columnas.append(valores.map(normalizados).tolist())
+    numeros = callejero['NUMERO'].astype(np.int64).tolist()
+    datos = zip(callejero['LATITUD'].tolist(), callejero['LONGITUD'].tolist(), range(len(callejero)))
+    indice = {}
+    for clave, dato in zip(zip(*columnas, numeros), datos):
+        indice.setdefault(clave, dato)
+    return indice
+
+
+def indice_callejero(callejero: Union[pd.DataFrame, Dict[ClaveDireccion, DatosDireccion]]) -> Dict[ClaveDireccion, DatosDireccion]:
+    """ Devuelve el índice de direcciones de un callejero, construyéndolo la primera vez que se
+    pide para ese DataFrame. Si se le pasa directamente un índice, lo devuelve tal cual.
+
+    El índice no se actualiza si el DataFrame se modifica después de construirlo.
+
+    Args:
+        callejero (DataFrame o dict): DataFrame del callejero o índice ya construido
+    Returns:
+        Dict[Tuple[str,str,str,int],Tuple[float,float,int]]: índice de direcciones
+    """
+    if isinstance(callejero, dict):
+        return callejero
+    clave = id(callejero)
+    entrada = _indices_callejero.get(clave)
+    if entrada is None or entrada[0]() is not callejero:
+        # Cuando el DataFrame deja de existir borramos su índice
+        referencia = weakref.ref(callejero, lambda _: _indices_callejero.pop(clave, None))
+        entrada = (referencia, indexa_callejero(callejero))
+        _indices_callejero[clave] = entrada
+    return entrada[1]
+
+
+@metricas.instrumenta()
 def busca_direccion(direccion:str, callejero:pd.DataFrame) -> Tuple[float,float]:
     """ Función que busca una dirección, dada en el formato
         calle, numero
     en el DataFrame callejero de Madrid y devuelve el par (latitud, longitud) en grados de la
     hubicación geográfica de dicha dirección
+
+    La búsqueda se hace sobre el índice de indice_callejero, que se construye la primera vez,
+    y no distingue mayúsculas, minúsculas ni tildes.
     
     Args:
         direccion (str): Nombre completo de la calle con número, en formato "Calle, num"
-        callejero (DataFrame): DataFrame con la información de las calles
+        callejero (DataFrame): DataFrame con la información de las calles (o su índice de indexa_callejero)
     Returns:
         Tuple[float,float]: Par de float (latitud,longitud) de la dirección buscada, expresados en grados
     Raises:
@@ -115,32 +299,82 @@ def busca_direccion(direccion:str, callejero:pd.DataFrame) -> Tuple[float,float]
         busca_direccion("Calle de Alberto Aguilera, 23", data)=(40.42998055555555,3.7112583333333333)
         busca_direccion("Calle de Alberto Aguilera, 25", data)=(40.43013055555555,3.7126916666666667)
     """
-    # Mediante un regex distingo entre los diferentes elemntos de la direccion
-    patron = r"([a-zA-ZáéíóúÁÉÍÓÚñÑ]+)\s+((?:de\s+(?:la|las|el|los)|del|de)?)?\s*([a-zA-ZáéíóúÁÉÍÓÚñÑ\s\-[0-9]+?)\s*,+\s*(\d+)"
-    matches = re.search(patron, direccion)
-    # El primer grupo es un str de cualquier duración hasta llegar al primer espacio, por lo que la clase es el grupo en mayúscula
-    via_clase = matches.group(1).upper()
-    # El segundo grupo son las preposiciones de las calles y sus posibles combinaciones, quedando vacio si no hay
-    if matches.group(2):
-        via_par = matches.group(2).upper()
-    else:
-        via_par = ""
-    # El tercer grupo es un str de cualquier duracion espacios incluídos hasta llegar a la coma
-    via_nombre = matches.group(3).upper()
-    # El cuarto grupo es el numero
-    numero = int(matches.group(4))
-    print(via_clase,via_par,via_nombre,numero)
-    lista_df = callejero[(callejero['VIA_CLASE']== via_clase) & (callejero['VIA_PAR']== via_par) & \
-                            (callejero['VIA_NOMBRE']== via_nombre) & (callejero['NUMERO']== numero)  
-                            ]
-    if not lista_df.empty:
-        return (lista_df.iloc[0]['LATITUD'],lista_df.iloc[0]['LONGITUD'])
+    indice = indice_callejero(callejero)
+    clave = interpreta_direccion(direccion)
+    if clave in indice:
+        return indice[clave][:2]
     else:
-        raise AdressNotFoundError
+        raise AdressNotFoundError(direccion)
+
+
+@metricas.instrumenta()
+def busca_direcciones(direcciones: List[str], callejero: pd.DataFrame, ignorar_errores: bool = False) -> np.ndarray:
+    """ Busca muchas direcciones a la vez en el callejero.
+
+    Args:
+        direcciones (List[str]): direcciones en formato "Calle, num"
+        callejero (DataFrame): DataFrame con la información de las calles (o su índice de indexa_callejero)
+        ignorar_errores (bool): si es True las direcciones que no existen dan una fila de NaN en
+            lugar de lanzar una excepción
+    Returns:
+        np.ndarray: array (len(direcciones) x 2) con la latitud y la longitud de cada dirección
+    Raises:
+        AdressNotFoundError: Si alguna dirección no existe y ignorar_errores es False
+    """
+    indice = indice_callejero(callejero)
+    coordenadas = np.full((len(direcciones), 2), np.nan)
+    for i, direccion in enumerate(direcciones):
+        try:
+            coordenadas[i] = indice[interpreta_direccion(direccion)][:2]
+        except (AdressNotFoundError, KeyError):
+            if not ignorar_errores:
+                raise AdressNotFoundError(direccion)
+    return coordenadas
     
 
 
 
+@metricas.instrumenta()
+def asigna_nodos(callejero: pd.DataFrame, grafo: GrafoCompilado) -> pd.DataFrame:
+    """ Añade al callejero la columna NODO con el vértice del grafo más cercano a cada dirección,
+    de forma que para llegar a una dirección basta con consultar la tabla.
+
+    Args:
+        callejero (DataFrame): DataFrame con la información de las calles
+        grafo (GrafoCompilado): grafo de calles compilado
+    Returns:
+        DataFrame: el mismo DataFrame con la columna NODO añadida
+    """
+    posiciones = grafo.nodos_mas_cercanos(callejero['LATITUD'].to_numpy(), callejero['LONGITUD'].to_numpy())
+    callejero['NODO'] = np.asarray(grafo.nodos)[posiciones]
+    return callejero
+
+
+@metricas.instrumenta()
+def busca_nodo(direccion: str, callejero: pd.DataFrame) -> object:
+    """ Función que busca una dirección, dada en el formato
+        calle, numero
+    y devuelve el vértice del grafo más cercano, precalculado con asigna_nodos.
+
+    Args:
+        direccion (str): Nombre completo de la calle con número, en formato "Calle, num"
+        callejero (DataFrame): DataFrame con la información de las calles y la columna NODO
+    Returns:
+        object: vértice del grafo más cercano a la dirección
+    Raises:
+        AdressNotFoundError: Si la dirección no existe en la base de datos
+        KeyError: Si el callejero no tiene la columna NODO
+    """
+    if 'NODO' not in callejero.columns:
+        raise KeyError("El callejero no tiene la columna NODO; hay que calcularla con asigna_nodos.")
+    indice = indice_callejero(callejero)
+    clave = interpreta_direccion(direccion)
+    if clave not in indice:
+        raise AdressNotFoundError(direccion)
+    nodo = callejero['NODO'].iat[indice[clave][2]]
+    return nodo.item() if isinstance(nodo, np.generic) else nodo
+
+
 ############## Parte 4 ##############
 
 
@@ -152,13 +386,13 @@ def carga_grafo() -> nx.MultiDiGraph:
     Raises:
         ServiceNotAvailableError: Si no es posible recuperar el grafo de OpenStreetMap.
     """
-    fichero = 'madrid_graphml'
+    fichero = MAP_FILE_NAME
     # Si el fichero existe cargamos el grafo desde el fichero
     if os.path.exists(fichero):
         grafo = ox.load_graphml(fichero)
     else:
         try:
-            grafo = ox.graph_from_place("Madrid, Spain", network_type="drive")
+            grafo = ox.graph_from_place(PLACE_NAME, network_type="drive")
             ox.save_graphml(grafo, fichero)
         except:
             raise ServiceNotAvailableError
@@ -176,4 +410,45 @@ def procesa_grafo(multidigrafo:nx.MultiDiGraph) -> nx.DiGraph:
     grafo_dirigido = convert.to_digraph(multidigrafo)
     bucles = list(nx.selfloop_edges(grafo_dirigido))
     grafo_dirigido.remove_edges_from(bucles) 
-    return grafo_dirigido
\ No newline at end of file
+    return grafo_dirigido
+
+
+def huella_fichero(fichero: str) -> str:
+    """ Calcula la huella (hash SHA-1) del contenido de un fichero.
+    Args:
+        fichero (str): ruta del fichero
+    Returns:
+        str: huella en hexadecimal
+    Raises:
+        FileNotFoundError si el fichero no existe
+    """
+    huella = hashlib.sha1()
+    with open(fichero, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+
+@metricas.instrumenta()
+def carga_grafo_compilado(compila: Callable[[nx.DiGraph], GrafoCompilado]) -> GrafoCompilado:
+    """ Función que recupera el grafo de calles de Madrid ya procesado y compilado, desde una caché
+    binaria proyectada en memoria si el fichero del grafo no ha cambiado desde la última vez.
+
+    La caché se guarda en GRAPH_CACHE_DIR, en un subdirectorio cuyo nombre es la huella del fichero
+    MAP_FILE_NAME y la versión FORMATO_CACHE. Si no existe, se carga el grafo con carga_grafo, se
+    procesa con procesa_grafo, se compila con la función dada y se guarda.
+    Args:
+        compila (función): función que recibe el grafo procesado y devuelve su versión compilada
+            (por ejemplo gps.compila_callejero)
+    Returns:
+        GrafoCompilado: grafo de calles compilado
+    Raises:
+        ServiceNotAvailableError: Si no es posible recuperar el grafo de OpenStreetMap.
+    """
+    # Si hay que descargar el grafo se conserva, para no leer después el fichero recién guardado
+    G = carga_grafo() if not os.path.exists(MAP_FILE_NAME) else None
+    directorio = os.path.join(GRAPH_CACHE_DIR, f"{huella_fichero(MAP_FILE_NAME)}.v{FORMATO_CACHE}")
+    if not os.path.exists(os.path.join(directorio, 'meta.json')):
+        grafo = compila(procesa_grafo(G if G is not None else carga_grafo()))
+        grafo.guarda(directorio)
+    return grafo_compilado.carga_grafo_compilado(directorio)
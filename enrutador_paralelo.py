@@ -0,0 +1,262 @@
+"""
+enrutador_paralelo.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Cálculo de lotes de rutas en paralelo con un grupo de procesos. El grafo compilado no se
+envía a los procesos: cada uno lo proyecta en memoria desde su directorio en disco (la caché
+de callejero.carga_grafo_compilado), de forma que todos comparten las mismas páginas del
+sistema operativo y a cada tarea solo se le pasan las posiciones de origen y destino.
+
+Los pesos de los modos de ruta se comparten aparte (PesosCompartidos), en ficheros temporales
+proyectados en memoria que el proceso principal actualiza en el sitio con cada cambio de
+pesos del grafo (GrafoCompilado.actualiza_pesos, cierra_aristas...). Los procesos ven los pesos
+nuevos sin copiar nada y, antes de cada bloque, solo rehacen sus listas de Python de los modos
+cuya versión ha cambiado.
+"""
+
+from typing import List, Tuple, Callable, Union, Optional
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import grafo_compilado
+from grafo_compilado import GrafoCompilado
+from grafo_pesado import camino_minimo_compilado
+
+TAMANO_BLOQUE = 64  # Pares de origen y destino que se envían juntos a un proceso
+
+# Grafo del proceso, que se carga una vez al arrancarlo, y función que lo pone al día con los pesos compartidos
+_grafo_proceso = None
+_al_dia = None
+
+
+class PesosCompartidos:
+    """ Copia de los pesos de los modos con nombre de un grafo compilado en ficheros .npy
+    proyectados en memoria, que los procesos de un grupo proyectan a su vez (ver conecta_pesos).
+
+    Se suscribe a las actualizaciones de pesos del grafo (GrafoCompilado.suscribe) y las escribe
+    en el sitio, de forma que los procesos las ven sin copiar el grafo ni arrancar de nuevo, y
+    después aumenta la versión del modo, con la que los procesos saben que tienen que rehacer
+    lo que calcularon con los pesos anteriores.
+
+    Attributes:
+        directorio (str): directorio temporal de los ficheros
+        modos (List[str]): modos compartidos
+        pesos (Dict[str,np.ndarray]): array proyectado de cada modo
+        versiones (np.ndarray): número de actualizaciones de cada modo, también proyectado
+    """
+
+    def __init__(self, grafo: GrafoCompilado):
+        self.directorio = tempfile.mkdtemp(prefix="pesos_compartidos_")
+        self.modos = [modo for modo in grafo.pesos if isinstance(modo, str)]
+        self.pesos = {}
+        for i, modo in enumerate(self.modos):
+            array = np.lib.format.open_memmap(os.path.join(self.directorio, f"peso_{i}.npy"), mode='w+',
+                                              dtype=np.float64, shape=(grafo.m,))
+            array[:] = grafo.pesos[modo]
+            self.pesos[modo] = array
+        self.versiones = np.lib.format.open_memmap(os.path.join(self.directorio, "versiones.npy"), mode='w+',
+                                                   dtype=np.int64, shape=(len(self.modos),))
+        self.versiones[:] = 0
+        grafo.suscribe(self._actualiza)
+
+    def _actualiza(self, grafo: GrafoCompilado, modo: object, aristas: np.ndarray, anteriores: np.ndarray, valores: np.ndarray) -> None:
+        """ Copia una actualización de pesos del grafo (observador de GrafoCompilado.suscribe). """
+        if modo in self.pesos:
+            self.pesos[modo][aristas] = valores
+            # La versión se cambia cuando los pesos ya están escritos, como en GrafoCompilado.actualiza_pesos
+            self.versiones[self.modos.index(modo)] += 1
+
+    def cierra(self) -> None:
+        """ Borra los ficheros de los pesos compartidos.
+
+        Returns: None
+        """
+        self.pesos = {}
+        self.versiones = None
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def conecta_pesos(grafo: GrafoCompilado, directorio: str, modos: List[str]) -> Callable[[object], bool]:
+    """ Sustituye en un proceso del grupo los pesos de los modos de grafo por los arrays que
+    comparte PesosCompartidos desde directorio.
+
+    Args:
+        grafo (GrafoCompilado): grafo del proceso
+        directorio (str): directorio de los pesos compartidos (PesosCompartidos.directorio)
+        modos (List[str]): modos compartidos (PesosCompartidos.modos)
+    Returns:
+        función: función que hay que llamar con el modo antes de cada búsqueda. Si el modo se ha
+            actualizado desde la llamada anterior, descarta lo que el grafo calculó con los pesos
+            anteriores (GrafoCompilado.refresca_pesos) y devuelve True; si no, devuelve False.
+    """
+    versiones = np.load(os.path.join(directorio, "versiones.npy"), mmap_mode='r')
+    posiciones = {modo: i for i, modo in enumerate(modos)}
+    vistas = {}
+    for modo, i in posiciones.items():
+        grafo.pesos[modo] = np.load(os.path.join(directorio, f"peso_{i}.npy"), mmap_mode='r')
+        grafo.refresca_pesos(modo)
+        vistas[modo] = -1
+
+    def al_dia(modo: object) -> bool:
+        if modo not in posiciones:
+            return False
+        # La versión se lee antes de usar los pesos: si cambia mientras tanto, se rehará en la siguiente llamada
+        version = int(versiones[posiciones[modo]])
+        if version == vistas[modo]:
+            return False
+        vistas[modo] = version
+        grafo.refresca_pesos(modo)
+        return True
+    return al_dia
+
+
+def _inicia_proceso(directorio: str, directorio_pesos: str, modos: List[str]) -> None:
+    """ Carga el grafo compilado en un proceso del grupo, proyectado en memoria, con los pesos compartidos.
+
+    Args:
+        directorio (str): directorio en el que está guardado el grafo
+        directorio_pesos (str): directorio de los pesos compartidos
+        modos (List[str]): modos compartidos
+    Returns: None
+    """
+    global _grafo_proceso, _al_dia
+    _grafo_proceso = grafo_compilado.carga_grafo_compilado(directorio, mmap=True)
+    _al_dia = conecta_pesos(_grafo_proceso, directorio_pesos, modos)
+
+
+def _resuelve_bloque(tarea: Tuple[str, bool, List[Tuple[int, int]]]) -> List[Optional[List[int]]]:
+    """ Calcula en un proceso del grupo los caminos mínimos de un bloque de pares.
+
+    Args:
+        tarea: modo de ruta, si se usa Dijkstra bidireccional y lista de pares (origen, destino)
+            como posiciones en el grafo
+    Returns:
+        List[Optional[List[int]]]: camino de cada par (posiciones), o None si no hay camino
+    """
+    modo, bidireccional, pares = tarea
+    _al_dia(modo)
+    caminos = []
+    for origen, destino in pares:
+        try:
+            caminos.append(camino_minimo_compilado(_grafo_proceso, modo, origen, destino, bidireccional))
+        except ValueError:
+            caminos.append(None)
+    return caminos
+
+
+class EnrutadorParalelo:
+    """ Grupo de procesos que comparten un grafo compilado proyectado en memoria y calculan
+    caminos mínimos en paralelo. Se usa como gestor de contexto para cerrar los procesos al
+    terminar:
+
+        with EnrutadorParalelo(grafo, procesos=4) as enrutador:
+            caminos = enrutador.caminos_minimos('peso_ruta_mas_rapida', pares)
+
+    Attributes:
+        grafo (GrafoCompilado): grafo compilado en el proceso principal
+        procesos (int): número de procesos del grupo
+        pesos (PesosCompartidos): pesos de los modos, que los procesos ven actualizados
+    """
+
+    def __init__(self, grafo: GrafoCompilado, procesos: int = None):
+        self.grafo = grafo
+        self.procesos = procesos or os.cpu_count() or 1
+        self._temporal = None
+        directorio = grafo.directorio
+        if directorio is None:
+            # Un grafo que no viene de disco se guarda en un directorio temporal para poder proyectarlo
+            self._temporal = tempfile.mkdtemp(prefix="grafo_compilado_")
+            directorio = os.path.join(self._temporal, "grafo")
+            grafo.guarda(directorio)
+        self.pesos = PesosCompartidos(grafo)
+        self._pool = multiprocessing.get_context().Pool(self.procesos, _inicia_proceso,
+                                                        (directorio, self.pesos.directorio, self.pesos.modos))
+
+    def caminos_minimos_compilado(self, peso: Union[str, Callable], pares: List[Tuple[int, int]], bidireccional: bool = False) -> List[Optional[List[int]]]:
+        """ Calcula los caminos mínimos de una lista de pares (origen, destino) dados como
+        posiciones en el grafo compilado. Los resultados se devuelven en el mismo orden que los pares.
+
+        Args:
+            peso (str o función): modo de ruta, que tiene que estar guardado en el grafo
+            pares (List[Tuple[int,int]]): posiciones de origen y destino de cada ruta
+            bidireccional (bool): si es True se usa el algoritmo de Dijkstra bidireccional
+        Returns:
+            List[Optional[List[int]]]: camino de cada par, o None si no hay camino
+        """
+        modo = self.grafo.modo(peso)
+        if not isinstance(modo, str):
+            raise KeyError(f"El modo de ruta {modo} no tiene nombre y no se puede compartir con los procesos.")
+        pares = [(int(origen), int(destino)) for origen, destino in pares]
+        # Bloques pequeños para repartir bien la carga sin pagar una comunicación por ruta
+        tamano = max(1, min(TAMANO_BLOQUE, len(pares) // (4 * self.procesos)))
+        tareas = [(modo, bidireccional, pares[i:i+tamano]) for i in range(0, len(pares), tamano)]
+        caminos = []
+        for bloque in self._pool.imap(_resuelve_bloque, tareas):
+            caminos.extend(bloque)
+        return caminos
+
+    def caminos_minimos(self, peso: Union[str, Callable], pares: List[Tuple[object, object]], bidireccional: bool = False) -> List[Optional[List[object]]]:
+        """ Calcula los caminos mínimos de una lista de pares (origen, destino) de vértices del
+        grafo original, en el mismo orden que los pares.
+
+        Args:
+            peso (str o función): modo de ruta, que tiene que estar guardado en el grafo
+            pares (List[Tuple[object,object]]): vértices de origen y destino de cada ruta
+            bidireccional (bool): si es True se usa el algoritmo de Dijkstra bidireccional
+        Returns:
+            List[Optional[List[object]]]: lista de vértices del camino de cada par, o None si no hay camino
+        Raises:
+            ValueError: Si algún origen o destino no es un vértice del grafo
+        """
+        indice = self.grafo.indice
+        for origen, destino in pares:
+            if origen not in indice or destino not in indice:
+                raise ValueError(f"No hay camino posible que vaya de {origen} hasta {destino}.")
+        caminos = self.caminos_minimos_compilado(peso, [(indice[origen], indice[destino]) for origen, destino in pares],
+                                                 bidireccional)
+        return [self.grafo.camino_original(camino) if camino is not None else None for camino in caminos]
+
+    def cierra(self) -> None:
+        """ Termina los procesos del grupo y borra los pesos compartidos y el directorio
+        temporal del grafo, si lo hay.
+
+        Returns: None
+        """
+        self._pool.close()
+        self._pool.join()
+        self.pesos.cierra()
+        if self._temporal is not None:
+            shutil.rmtree(self._temporal, ignore_errors=True)
+            self._temporal = None
+
+    def __enter__(self) -> 'EnrutadorParalelo':
+        return self
+
+    def __exit__(self, *excepcion) -> None:
+        self.cierra()
+
+
+def caminos_minimos_paralelo(grafo: GrafoCompilado, peso: Union[str, Callable], pares: List[Tuple[object, object]], procesos: int = None, bidireccional: bool = False) -> List[Optional[List[object]]]:
+    """ Calcula en paralelo los caminos mínimos de una lista de pares (origen, destino) de
+    vértices del grafo original, creando y cerrando un grupo de procesos para el lote.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta, que tiene que estar guardado en el grafo
+        pares (List[Tuple[object,object]]): vértices de origen y destino de cada ruta
+        procesos (int): número de procesos (por defecto, uno por núcleo)
+        bidireccional (bool): si es True se usa el algoritmo de Dijkstra bidireccional
+    Returns:
+        List[Optional[List[object]]]: lista de vértices del camino de cada par, o None si no hay camino
+    Raises:
+        ValueError: Si algún origen o destino no es un vértice del grafo
+    """
+    with EnrutadorParalelo(grafo, procesos) as enrutador:
+        return enrutador.caminos_minimos(peso, pares, bidireccional)
@@ -8,18 +8,27 @@ from typing import Tuple
 from osmnx import convert
 import callejero as c
 from typing import List, Tuple, Dict, Callable, Union
-from grafo_pesado import camino_minimo
+from grafo_pesado import camino_minimo_a_estrella
+from grafo_compilado import GrafoCompilado, compila_grafo, pesos_aristas
+from mapa import MapaBase
 import numpy as np
+import weakref
+import metricas
+import autocompletado
+
+# Mapa de calles ya dibujado de cada grafo compilado, para no volver a dibujarlo en cada ruta
+_mapas = weakref.WeakKeyDictionary()
 
 
 # Devuelve una tupla de str en caso de que sean vacios
-def elegir_direcciones(df: pd.DataFrame, digrafo: nx.DiGraph) -> Union[Tuple[int, int], Tuple[str, str]]:
+def elegir_direcciones(df: pd.DataFrame, digrafo: Union[nx.DiGraph, GrafoCompilado]) -> Union[Tuple[int, int], Tuple[str, str]]:
     """
     Solicita al usuario las direcciones de origen y destino
 
     Args:
-        df (pd.DataFrame): DataFrame con los datos de las calles.
-        digrafo (nx.DiGraph): Grafo que representa la red de calles.
+        df (pd.DataFrame): DataFrame con los datos de las calles. Si tiene la columna NODO
+            (ver callejero.asigna_nodos) los vértices se leen directamente de la tabla.
+        digrafo (nx.DiGraph o GrafoCompilado): Grafo que representa la red de calles.
 
     Returns:
         Union[Tuple[int, int], Tuple[str, str]]: Tupla con los nodos del grafo correspondientes al origen y destino, 
@@ -40,6 +49,10 @@ def elegir_direcciones(df: pd.DataFrame, digrafo: nx.DiGraph) -> Union[Tuple[int
                 encontrado_destino = True
             # Si no salta un error, el origen es válido y podemos abandonar el bucle
             encontrado_origen = True
+        except c.AdressNotFoundError:
+            # Solo aquí se sabe que origen es el texto que se acaba de introducir
+            print("La direccion introducida no es válida, inténtalo otra vez")
+            sugiere_direcciones(origen, df)
         except:
             print("La direccion introducida no es válida, inténtalo otra vez")
 
@@ -51,21 +64,53 @@ def elegir_direcciones(df: pd.DataFrame, digrafo: nx.DiGraph) -> Union[Tuple[int
             if destino != "":
                 coords_destino = c.busca_direccion(destino, df)
             encontrado_destino = True
+        except c.AdressNotFoundError:
+            # Solo aquí se sabe que destino es el texto que se acaba de introducir
+            print("La direccion introducida no es válida, inténtalo otra vez")
+            sugiere_direcciones(destino, df)
         except:
             print("La direccion introducida no es válida, inténtalo otra vez")
 
     # Si alguno de los dos es vacío devolvemos una tupla con dos strings vacíos para que el main no se tenga que ejecutar todo
     if origen == "" or destino == "":
         return ("", "")
+    # Si el callejero ya tiene el vértice más cercano a cada dirección lo leemos de la tabla
+    elif 'NODO' in df.columns:
+        return (c.busca_nodo(origen, df), c.busca_nodo(destino, df))
+    # Con el grafo compilado buscamos ambos vértices a la vez en su árbol k-d, que se construye una sola vez
+    elif isinstance(digrafo, GrafoCompilado):
+        posiciones = digrafo.nodos_mas_cercanos([coords_origen[0], coords_destino[0]],
+                                                [coords_origen[1], coords_destino[1]])
+        nodo_origen_id, nodo_destino_id = digrafo.camino_original(posiciones)
+        return (nodo_origen_id, nodo_destino_id)
     # Si no, a través de la función de osmnx de nearest_nodes, encontramos el vértice del digrafo más cercano a nuestras coordenadas
     else:
-        nodo_origen_id = ox.nearest_nodes(
-            digrafo, X=coords_origen[1], Y=coords_origen[0])
-        nodo_destino_id = ox.nearest_nodes(
-            digrafo, X=coords_destino[1], Y=coords_destino[0])
+        with metricas.etapa('nearest_nodes'):
+            nodo_origen_id = ox.nearest_nodes(
+                digrafo, X=coords_origen[1], Y=coords_origen[0])
+            nodo_destino_id = ox.nearest_nodes(
+                digrafo, X=coords_destino[1], Y=coords_destino[0])
         # Devolvemos una tupla con los identificadores de cada vertice dentro de digrafo.nodes
         return (nodo_origen_id, nodo_destino_id)
 
+
+def sugiere_direcciones(direccion: str, df: pd.DataFrame) -> None:
+    """
+    Muestra las direcciones del callejero más parecidas a una dirección que no se ha encontrado,
+    para que el usuario pueda copiar la correcta en el siguiente intento.
+
+    Args:
+        direccion (str): dirección introducida por el usuario
+        df (pd.DataFrame): DataFrame con los datos de las calles
+
+    Returns:
+        None
+    """
+    parecidas = autocompletado.sugerencias(direccion, df)
+    if parecidas:
+        print("Quizá quisiste decir: " + " | ".join(parecidas))
+
+
 # Creamos aquí las distintas funciones de peso
 
 
@@ -86,36 +131,16 @@ def peso_ruta_mas_corta(digrafo: nx.DiGraph, origen=int, destino=int) -> float:
     return longitud_arista
 
 
-def peso_ruta_mas_rapida(digrafo: nx.DiGraph, origen=object, destino=object) -> float:
+def velocidad_arista(dict_datos_arista: dict) -> float:
     """
-    Calcula el peso de la ruta más rápida, considerando la velocidad máxima de la arista.
+    Calcula la velocidad máxima (en km/h) de una arista a partir de sus datos.
 
     Args:
-        digrafo (nx.DiGraph): grafo
-        origen (object): Nodo origen.
-        destino (object): Nodo destino.
+        dict_datos_arista (dict): diccionario de datos de la arista
 
     Returns:
-        float: Tiempo que tarda en desplazarse desde origen a destion
+        float: velocidad máxima de la arista en km/h
     """
-    MAX_SPEEDS = {'living_street': '20',
-                  'residential': '30',
-                  'primary_link': '40',
-                  'unclassified': '40',
-                  'secondary_link': '40',
-                  'trunk_link': '40',
-                  'secondary': '50',
-                  'tertiary': '50',
-                  'primary': '50',
-                  'trunk': '50',
-                  'tertiary_link': '50',
-                  'busway': '50',
-                  'motorway_link': '70',
-                  'motorway': '100'}
-
-    # Nos quedamos con el diccionario de datos asociado a la arista formada por los dos vértices dados
-    dict_datos_arista = digrafo.edges[(origen, destino)]
-
     # Distinguimos tres casos, si la arista tiene su propia velocidad máxima, si solo conocemos el tipo de vía, o si no sabemos nada
     if 'maxspeed' in dict_datos_arista:
         # según hemos observado, existen tres formas en las que puede aparecer la velocidad, entonces las diferenciamos
@@ -139,13 +164,31 @@ def peso_ruta_mas_rapida(digrafo: nx.DiGraph, origen=object, destino=object) ->
             # si no nos quedamos con el único tipo de via que aparece
             tipo_via = dict_datos_arista['highway']
         # si el tipo de via esta en el diccionario, nos quedamos con esa velocidad, sino la establecemos por defecto
-        if tipo_via in MAX_SPEEDS:
-            velocidad = float(MAX_SPEEDS[tipo_via])
+        if tipo_via in c.MAX_SPEEDS:
+            velocidad = float(c.MAX_SPEEDS[tipo_via])
         else:
             velocidad = 50
     else:
         # Si no hay información establecemos l velocidad por defecto en 50
         velocidad = 50
+    return velocidad
+
+
+def peso_ruta_mas_rapida(digrafo: nx.DiGraph, origen=object, destino=object) -> float:
+    """
+    Calcula el peso de la ruta más rápida, considerando la velocidad máxima de la arista.
+
+    Args:
+        digrafo (nx.DiGraph): grafo
+        origen (object): Nodo origen.
+        destino (object): Nodo destino.
+
+    Returns:
+        float: Tiempo que tarda en desplazarse desde origen a destion
+    """
+    # Nos quedamos con el diccionario de datos asociado a la arista formada por los dos vértices dados
+    dict_datos_arista = digrafo.edges[(origen, destino)]
+    velocidad = velocidad_arista(dict_datos_arista)
     # Pasamos la velocidad a m/s
     velocidad_m_s = velocidad / 3.6
     # En este caso el peso de la arista vendrá dado por el tiempo que se tarda en recorrer
@@ -181,6 +224,151 @@ def peso_ruta_mas_rapida_semaforos(digrafo: nx.DiGraph, origen=object, destino=o
     return tiempo
 
 
+def velocidades_aristas(digrafo: nx.DiGraph, grafo: GrafoCompilado) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula la longitud y la velocidad máxima de todas las aristas de un grafo compilado.
+
+    Las velocidades se calculan con velocidad_arista una única vez por cada combinación distinta
+    de maxspeed y highway (hay muy pocas).
+
+    Args:
+        digrafo (nx.DiGraph): grafo con los datos de las calles
+        grafo (GrafoCompilado): grafo compilado a partir de digrafo
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: longitud en metros y velocidad en km/h de cada arista, en el orden de grafo.indices
+    """
+    nodos = grafo.nodos.tolist()
+    indptr = grafo.indptr.tolist()
+    indices = grafo.indices.tolist()
+    # Recorremos las aristas en el mismo orden que el grafo compilado, guardando solo los datos que influyen en la velocidad
+    longitudes = np.empty(grafo.m, dtype=np.float64)
+    codigos = np.empty(grafo.m, dtype=np.int64)
+    # Código de cada combinación distinta de maxspeed y highway, y datos de una arista que la tiene
+    codigo_clave = {}
+    datos_clave = []
+    for u in range(grafo.n):
+        adyacencia = digrafo.adj[nodos[u]]
+        for k in range(indptr[u], indptr[u+1]):
+            dict_datos_arista = adyacencia[nodos[indices[k]]]
+            longitudes[k] = dict_datos_arista['length']
+            clave = (repr(dict_datos_arista.get('maxspeed')) if 'maxspeed' in dict_datos_arista else None,
+                     repr(dict_datos_arista.get('highway')) if 'highway' in dict_datos_arista else None)
+            if clave not in codigo_clave:
+                codigo_clave[clave] = len(datos_clave)
+                datos_clave.append(dict_datos_arista)
+            codigos[k] = codigo_clave[clave]
+    velocidades = np.array([velocidad_arista(datos) for datos in datos_clave], dtype=np.float64)[codigos]
+    return longitudes, velocidades
+
+
+def precalcula_pesos(digrafo: nx.DiGraph, grafo: GrafoCompilado, validar: bool = False, aristas: Tuple[np.ndarray, np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Calcula de una sola vez los pesos de todas las aristas en los tres modos de ruta, sin llamar
+    a las funciones de peso para cada arista.
+
+    Las velocidades se calculan con velocidades_aristas, y los tiempos y el retraso de los semáforos con
+    operaciones de numpy sobre todas las aristas a la vez, repitiendo exactamente las mismas
+    operaciones que peso_ruta_mas_rapida y peso_ruta_mas_rapida_semaforos.
+
+    Args:
+        digrafo (nx.DiGraph): grafo con los datos de las calles
+        grafo (GrafoCompilado): grafo compilado a partir de digrafo
+        validar (bool): si es True se comprueba que los pesos coinciden exactamente con los de
+            las funciones de peso
+        aristas (Tuple[np.ndarray, np.ndarray], opcional): longitudes y velocidades de las aristas
+            si ya se han calculado con velocidades_aristas
+
+    Returns:
+        Dict[str, np.ndarray]: array de pesos de cada modo, con el nombre de su función de peso como clave
+
+    Raises:
+        ValueError: Si validar es True y algún peso no coincide con el de su función
+    """
+    nodos = grafo.nodos.tolist()
+    indices = grafo.indices.tolist()
+    longitudes, velocidades = aristas if aristas is not None else velocidades_aristas(digrafo, grafo)
+    tiempos = longitudes / (velocidades / 3.6)
+    cruces = np.array([digrafo.nodes[v]['street_count'] > 2 for v in nodos], dtype=bool)
+    tiempos_semaforos = tiempos.copy()
+    tiempos_semaforos[cruces[grafo.indices]] += 0.8*30
+    pesos = {peso_ruta_mas_corta.__name__: longitudes,
+             peso_ruta_mas_rapida.__name__: tiempos,
+             peso_ruta_mas_rapida_semaforos.__name__: tiempos_semaforos}
+
+    if validar:
+        for funcion in (peso_ruta_mas_corta, peso_ruta_mas_rapida, peso_ruta_mas_rapida_semaforos):
+            esperados = pesos_aristas(digrafo, grafo, funcion)
+            distintos = np.flatnonzero(esperados != pesos[funcion.__name__])
+            if len(distintos):
+                k = distintos[0]
+                u, v = nodos[int(np.searchsorted(grafo.indptr, k, side='right')) - 1], nodos[indices[k]]
+                raise ValueError(
+                    f"{funcion.__name__}: {len(distintos)} pesos distintos, por ejemplo en la arista ({u}, {v}): "
+                    f"{pesos[funcion.__name__][k]} en lugar de {esperados[k]}")
+    return pesos
+
+
+def compila_callejero(digrafo: nx.DiGraph, validar: bool = False) -> GrafoCompilado:
+    """
+    Compila el grafo de calles con los pesos de los tres modos de ruta precalculados.
+
+    Args:
+        digrafo (nx.DiGraph): grafo de calles (salida de callejero.procesa_grafo)
+        validar (bool): si es True se comprueba que los pesos precalculados coinciden con las funciones de peso
+
+    Returns:
+        GrafoCompilado: grafo compilado
+    """
+    grafo = compila_grafo(digrafo)
+    longitudes, velocidades = velocidades_aristas(digrafo, grafo)
+    grafo.pesos.update(precalcula_pesos(digrafo, grafo, validar, (longitudes, velocidades)))
+    grafo.funciones.update({funcion.__name__: funcion for funcion in
+                            (peso_ruta_mas_corta, peso_ruta_mas_rapida, peso_ruta_mas_rapida_semaforos)})
+    # Guardamos también los datos que necesitan las instrucciones: la longitud, la velocidad y el
+    # nombre de cada arista (como posición en una tabla de nombres en la que cada nombre aparece
+    # una sola vez) y el número de calles de cada vértice
+    nodos = grafo.nodos.tolist()
+    # Las velocidades son enteras y pequeñas, así que normalmente caben en un byte
+    if np.all((velocidades == np.round(velocidades)) & (velocidades >= 0) & (velocidades < 256)):
+        grafo.datos_aristas['velocidad'] = velocidades.astype(np.uint8)
+    else:
+        grafo.datos_aristas['velocidad'] = velocidades.astype(np.float32)
+    grafo.datos_nodos['street_count'] = np.array(
+        [digrafo.nodes[v]['street_count'] for v in nodos], dtype=np.int16)
+    grafo.datos_aristas['length'] = grafo.pesos[peso_ruta_mas_corta.__name__]
+    posicion_nombre = {}
+    nombres = np.full(grafo.m, -1, dtype=np.int32)
+    indptr, indices = grafo.indptr.tolist(), grafo.indices.tolist()
+    for u in range(grafo.n):
+        adyacencia = digrafo.adj[nodos[u]]
+        for k in range(indptr[u], indptr[u+1]):
+            dic_arista = adyacencia[nodos[indices[k]]]
+            if 'name' in dic_arista:
+                # Las aristas con varios nombres tienen una lista, que guardamos tal y como se imprime
+                nombre = str(dic_arista['name'])
+                nombres[k] = posicion_nombre.setdefault(nombre, len(posicion_nombre))
+    grafo.datos_aristas['name'] = nombres
+    grafo.nombres = list(posicion_nombre)
+    return grafo
+
+
+# Peso mínimo por metro recorrido en cada modo, que A* usa para acotar lo que falta hasta el destino:
+# en la ruta más corta es la propia distancia en línea recta y en las más rápidas el tiempo que se
+# tardaría en recorrerla a la velocidad más alta de MAX_SPEEDS
+VELOCIDAD_MAXIMA = max(float(velocidad) for velocidad in c.MAX_SPEEDS.values())
+FACTORES_HEURISTICA = {peso_ruta_mas_corta: 1.0,
+                       peso_ruta_mas_rapida: 3.6 / VELOCIDAD_MAXIMA,
+                       peso_ruta_mas_rapida_semaforos: 3.6 / VELOCIDAD_MAXIMA}
+
+# Funciones de peso de cada modo de ruta, por su nombre corto y por el nombre de la función
+# (los modos que aceptan servicio_gps.py y rutas_lote.py)
+MODOS = {'corta': peso_ruta_mas_corta,
+         'rapida': peso_ruta_mas_rapida,
+         'semaforos': peso_ruta_mas_rapida_semaforos}
+MODOS.update({funcion.__name__: funcion for funcion in list(MODOS.values())})
+
+
 def elegir_modo_calculo_ruta() -> Callable[[nx.DiGraph, object, object], float]:
     """
     Presenta un menú al usuario para elegir el modo de cálculo de la ruta.
@@ -212,13 +400,74 @@ def elegir_modo_calculo_ruta() -> Callable[[nx.DiGraph, object, object], float]:
     return funcion
 
 
-def determinar_giro(digrafo: nx.DiGraph, inicio: int, intermedio: int, final: int) -> str:
+def angulos_giro(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Calcula de una vez el ángulo de giro en cada vértice intermedio de un camino.
+
+    Cada vértice se pasa a coordenadas cartesianas sobre la esfera unidad; el ángulo en el vértice i
+    es el que forman los vectores de los tramos (i-1, i) e (i, i+1), positivo si el giro es a la
+    izquierda y negativo si es a la derecha.
+
+    Args:
+        latitudes (np.ndarray): latitud de cada vértice del camino, en grados
+        longitudes (np.ndarray): longitud de cada vértice del camino, en grados
+
+    Returns:
+        np.ndarray: ángulo en grados en cada uno de los len(camino)-2 vértices intermedios
+                    (0 si alguno de los tramos tiene longitud nula)
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    puntos = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+    # Vectores de cada tramo, normalizados
+    tramos = np.diff(puntos, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tramos = tramos / np.linalg.norm(tramos, axis=1)[:, None]
+        v1, v2 = tramos[:-1], tramos[1:]
+        angulo = np.arccos(np.clip(np.einsum('ij,ij->i', v1, v2), -1.0, 1.0))
+        signo = np.sign(v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0])
+        return np.nan_to_num(np.degrees(angulo) * signo)
+
+
+def clasifica_giros(angulos: np.ndarray) -> np.ndarray:
+    """
+    Traduce ángulos de giro a instrucciones ("izquierda", "derecha" o "recto").
+
+    Args:
+        angulos (np.ndarray): ángulos en grados (ver angulos_giro)
+
+    Returns:
+        np.ndarray: instrucción de giro de cada ángulo
+    """
+    angulos = np.asarray(angulos)
+    return np.where(angulos > 5, "izquierda", np.where(angulos < -5, "derecha", "recto"))
+
+
+def coordenadas_camino(digrafo: Union[nx.DiGraph, GrafoCompilado], camino: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Devuelve la latitud y la longitud de los vértices de un camino.
+
+    Args:
+        digrafo (nx.DiGraph o GrafoCompilado): grafo con las coordenadas x, y de los vértices
+        camino (list): Lista de nodos del recorrido
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: latitudes y longitudes de los vértices, en grados
+    """
+    if isinstance(digrafo, GrafoCompilado):
+        posiciones = [digrafo.indice[v] for v in camino]
+        return digrafo.y[posiciones], digrafo.x[posiciones]
+    return (np.array([digrafo.nodes[v]['y'] for v in camino], dtype=np.float64),
+            np.array([digrafo.nodes[v]['x'] for v in camino], dtype=np.float64))
+
+
+def determinar_giro(digrafo: Union[nx.DiGraph, GrafoCompilado], inicio: int, intermedio: int, final: int) -> str:
     """
     Determina si se debe girar a la izquierda, derecha o seguir recto
     al pasar del nodo 'inicio' al 'final' a través del 'intermedio'.
 
     Args:
-        digrafo (nx.DiGraph): grafo
+        digrafo (nx.DiGraph o GrafoCompilado): grafo
         inicio (int): nodo de inicio.
         intermedio (int): nodo intermedio (donde se evalúa el giro)
         final (int): ndo final
@@ -226,116 +475,144 @@ def determinar_giro(digrafo: nx.DiGraph, inicio: int, intermedio: int, final: in
     Returns:
         str: Instrucción de giro ("izquierda", "derecha" o "recto")
     """
-    # Obtenemos la scoordenadas
-    lat0, lon0 = digrafo.nodes[inicio]['y'], digrafo.nodes[inicio]['x']
-    lat1, lon1 = digrafo.nodes[intermedio]['y'], digrafo.nodes[intermedio]['x']
-    lat2, lon2 = digrafo.nodes[final]['y'], digrafo.nodes[final]['x']
-
-    # conversion a radianes
-    lat0_rad, lon0_rad = np.radians(lat0), np.radians(lon0)
-    lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
-    lat2_rad, lon2_rad = np.radians(lat2), np.radians(lon2)
-
-    # Calcular coordenadas cartesianas de todos los nodos
-    # Coordenadas del nodo de inicio
-    x0 = np.cos(lat0_rad) * np.cos(lon0_rad)
-    y0 = np.cos(lat0_rad) * np.sin(lon0_rad)
-    z0 = np.sin(lat0_rad)
-    coord0 = np.array([x0, y0, z0])
-
-    # Coordenadas del nodo intermedio
-    x1 = np.cos(lat1_rad) * np.cos(lon1_rad)
-    y1 = np.cos(lat1_rad) * np.sin(lon1_rad)
-    z1 = np.sin(lat1_rad)
-    coord1 = np.array([x1, y1, z1])
-
-    # Coordenadas del nodo final
-    x2 = np.cos(lat2_rad) * np.cos(lon2_rad)
-    y2 = np.cos(lat2_rad) * np.sin(lon2_rad)
-    z2 = np.sin(lat2_rad)
-    coord2 = np.array([x2, y2, z2])
-
-    # Calcular los vectores entre los puntos
-    v1 = coord1 - coord0
-    v2 = coord2 - coord1
-
-    v1_norm = v1 / np.linalg.norm(v1)
-    v2_norm = v2 / np.linalg.norm(v2)
-
-    angulo = np.arccos(np.dot(v1_norm, v2_norm))
-    signo = np.sign(np.cross(v1_norm, v2_norm)[2])
-
-    angle_degrees = np.degrees(angulo) * signo
-    # Determinar la dirección del giro
-    if angle_degrees > 5:
-        return "izquierda"
-    elif angle_degrees < -5:
-        return "derecha"
+    angulo = angulos_giro(*coordenadas_camino(digrafo, (inicio, intermedio, final)))
+    return str(clasifica_giros(angulo)[0])
+
+
+@metricas.instrumenta()
+def pasos_ruta(digrafo: Union[nx.DiGraph, GrafoCompilado], camino: list, peso: Callable[[nx.DiGraph, object, object], float] = peso_ruta_mas_rapida) -> List[Dict[str, object]]:
+    """
+    Genera las instrucciones de un camino como una lista de pasos, agrupando las aristas consecutivas
+    de la misma calle. Los giros de todo el camino se calculan de una vez con angulos_giro.
+
+    Cada paso es un diccionario con:
+        'maniobra': "salida" en el primer paso, "llegada" en el último y el giro
+                    ("izquierda", "derecha" o "recto") al entrar en cada calle en los demás
+        'calle': nombre de la calle del tramo (el de la calle anterior si la arista no tiene nombre)
+        'distancia': metros recorridos por esa calle
+        'tiempo': segundos acumulados desde el origen hasta el final del tramo, según la función peso
+        'vertice': posición en el camino del vértice en el que empieza el tramo
+
+    Con un GrafoCompilado (ver compila_callejero) los datos se leen de sus arrays: longitud y nombre
+    de cada arista y pesos precalculados del modo, sin necesidad del grafo de networkx.
+
+    Args:
+        digrafo (nx.DiGraph o GrafoCompilado): Grafo que contiene las aristas y nodos
+        camino (list): Lista de nodos del recorrido
+        peso (función): función de peso con la que se calcula el tiempo de cada arista
+                        (por defecto, la de la ruta más rápida)
+
+    Returns:
+        List[Dict[str, object]]: pasos del recorrido, de la salida a la llegada
+    """
+    if len(camino) < 2:
+        return [{'maniobra': "llegada", 'calle': "", 'distancia': 0.0, 'tiempo': 0.0, 'vertice': 0}]
+    if isinstance(digrafo, GrafoCompilado):
+        aristas = digrafo.aristas_camino(digrafo.indice[v] for v in camino)
+        longitudes = np.asarray(digrafo.datos_aristas['length'])[aristas]
+        tiempos = np.cumsum(np.asarray(digrafo.pesos[digrafo.modo(peso)])[aristas])
+        nombres_aristas = [digrafo.nombres[i] if i >= 0 else None
+                           for i in np.asarray(digrafo.datos_aristas['name'])[aristas].tolist()]
     else:
-        return "recto"
+        datos_aristas = [digrafo.edges[(u, v)] for u, v in zip(camino[:-1], camino[1:])]
+        longitudes = np.array([datos['length'] for datos in datos_aristas], dtype=np.float64)
+        tiempos = np.cumsum([peso(digrafo, u, v) for u, v in zip(camino[:-1], camino[1:])])
+        nombres_aristas = [datos.get('name') for datos in datos_aristas]
+    # Las aristas sin nombre se consideran de la misma calle que la anterior
+    nombres = []
+    nombre = ""
+    for nombre_arista in nombres_aristas:
+        if nombre_arista is not None:
+            nombre = nombre_arista
+        nombres.append(nombre)
+    # Aristas en las que empieza una calle nueva
+    inicios = [0] + [k for k in range(1, len(nombres)) if nombres[k] != nombres[k-1]]
+    finales = inicios[1:] + [len(nombres)]
+    distancias = np.add.reduceat(longitudes, inicios)
+    giros = clasifica_giros(angulos_giro(*coordenadas_camino(digrafo, camino)))
+    pasos = []
+    for inicio, final, distancia in zip(inicios, finales, distancias.tolist()):
+        # El giro al entrar en la arista k se produce en el vértice k del camino (ángulo k-1)
+        maniobra = "salida" if inicio == 0 else str(giros[inicio - 1])
+        pasos.append({'maniobra': maniobra, 'calle': nombres[inicio], 'distancia': distancia,
+                      'tiempo': float(tiempos[final - 1]), 'vertice': inicio})
+    pasos.append({'maniobra': "llegada", 'calle': nombres[-1], 'distancia': 0.0,
+                  'tiempo': float(tiempos[-1]), 'vertice': len(camino) - 1})
+    return pasos
+
+
+def formatea_pasos(pasos: List[Dict[str, object]]) -> List[str]:
+    """
+    Convierte los pasos de pasos_ruta en las líneas de texto de las instrucciones.
 
+    Args:
+        pasos (List[Dict[str, object]]): pasos del recorrido
 
-def instrucciones(digrafo: nx.DiGraph, camino: list):
+    Returns:
+        List[str]: líneas de las instrucciones
+    """
+    lineas = []
+    tramos = [paso for paso in pasos if paso['maniobra'] != "llegada"]
+    for k, paso in enumerate(tramos):
+        if k > 0:
+            anterior = tramos[k-1]
+            lineas.append(f"Continúa recto por {anterior['calle']} durante {anterior['distancia']} metros")
+            if paso['maniobra'] != 'recto':
+                lineas.append(f"Gira a la {paso['maniobra']} en direccion {paso['calle']}")
+            else:
+                lineas.append(f"Continúa recto hacia {paso['calle']}")
+    if tramos:
+        lineas.append(f"Continúa recto por {tramos[-1]['calle']} durante {tramos[-1]['distancia']} metros")
+    lineas.append("Ha llegado a su destino")
+    return lineas
+
+
+@metricas.instrumenta()
+def instrucciones(digrafo: Union[nx.DiGraph, GrafoCompilado], camino: list, escribe: Callable[[str], None] = print):
     """
     Genera instrucciones paso a paso para recorrer un camino en el grafo
 
     Args:
-        digrafo (nx.DiGraph): Grafo que contiene las aristas y nodos
+        digrafo (nx.DiGraph o GrafoCompilado): Grafo que contiene las aristas y nodos
         camino (list): Lista de nodos  del recorrido
+        escribe (función): función que recibe cada línea de las instrucciones (por defecto, print)
 
     Returns:
         None
     """
-    nombre_anterior = ""
-    distancia_anterior = 0
-    for j in range(len(camino)-1):
-        # Obtenemos los vértices de cada arista a partir de nuestro camino
-        inicio_paso = camino[j]
-        fin_paso = camino[j+1]
-        # Accedemos al diccionario asociado a cada arista
-        dic_arista = digrafo.edges[(inicio_paso, fin_paso)]
-        # Aquí también distinguimos entre tres casos, cuando la arista en vez de un nombre es una lista de nombres, cuando aperece normal o cuando no tiene
-        if 'name' in dic_arista:
-            nombre = dic_arista['name']
-        # Caso en el que no aparece nombre en la arista, en este caso definimos el nombre igual que el nombre anterior
-        else:
-            nombre = nombre_anterior
-        # Obtenemos la longitud de la arista del diccionario y la sumamos a la distncia anterior que es 0 si se ha cambiado de calle y se acumula si no
-        distancia = dic_arista['length']
-        distancia_anterior += distancia
-        # Tenemos en cuenta la primera iteración del bucle
-        if nombre_anterior == "":
-            nombre_anterior = nombre
-        # Si hemos cambiado
-        elif nombre_anterior != nombre:
-            print(
-                f"Continúa recto por {nombre_anterior} durante {distancia_anterior} metros")
-            nombre_anterior = nombre
-            distancia_anterior = 0
-            # Determinamos el giro con la función que hemos creado antes
-            # Para ello no tenemos en cuenta la última arista, ya que no habrá que girar
-            if j + 2 < len(camino):
-                direccion_giro = determinar_giro(
-                    digrafo, camino[j-1], camino[j], camino[j+1])
-                if direccion_giro != 'recto':
-                    print(f"Gira a la {direccion_giro} en direccion {nombre}")
-                else:
-                    print(f"Continúa recto hacia {nombre}")
-    print(f"Continúa recto por {nombre} durante {distancia} metros")
-    print("Ha llegado a su destino")
-
-
-def dibujar(digrafo: nx.DiGraph, camino: List[int]) -> None:
+    for linea in formatea_pasos(pasos_ruta(digrafo, camino)):
+        escribe(linea)
+
+
+@metricas.instrumenta()
+def dibujar(digrafo: Union[nx.DiGraph, GrafoCompilado], camino: List[int]) -> None:
     """
     Dibuja el grafo resaltando el camino proporcionado.
 
+    Con un GrafoCompilado la red de calles no se vuelve a dibujar: se usa la imagen ya dibujada
+    de mapa.MapaBase y solo se dibuja encima el camino.
+
     Args:
-        digrafo (nx.DiGraph): El grafo a dibujar.
+        digrafo (nx.DiGraph o GrafoCompilado): El grafo a dibujar.
         camino (List[int]): Lista de nodos que representan el camino a resaltar.
 
     Returns:
         None
     """
+    if isinstance(digrafo, GrafoCompilado):
+        if digrafo not in _mapas:
+            _mapas[digrafo] = MapaBase(digrafo)
+        mapa = _mapas[digrafo]
+        latitudes, longitudes = coordenadas_camino(digrafo, camino)
+        plt.figure(figsize=(8, 8))
+        plt.imshow(mapa.fondo, extent=mapa.limites, aspect='auto')
+        plt.plot(longitudes, latitudes, color='black', linewidth=2.5)
+        plt.scatter(longitudes[[0, -1]], latitudes[[0, -1]], color='darkblue', s=40, zorder=3,
+                    label='Origen y Destino')
+        plt.legend()
+        plt.axis('off')
+        plt.show()
+        return
 
     pos = {node: (data['x'], data['y'])
            for node, data in digrafo.nodes(data=True)}
@@ -381,15 +658,17 @@ def dibujar(digrafo: nx.DiGraph, camino: List[int]) -> None:
 
 if __name__ == "__main__":
     # 1
-    df = c.carga_callejero()
-    multidigrafo = c.carga_grafo()
-    digrafo = c.procesa_grafo(multidigrafo)
+    # Cargamos el grafo ya procesado y con los pesos de cada modo precalculados desde la caché
+    # binaria (la primera vez se construye a partir del grafo de OpenStreetMap)
+    grafo = c.carga_grafo_compilado(compila_callejero)
+    # Asignamos a cada dirección del callejero su vértice más cercano del grafo
+    df = c.asigna_nodos(c.carga_callejero(), grafo)
 
     # 7
     origen_o_destino_vacios = False
     while not origen_o_destino_vacios:
         # 2
-        tupla_direcciones = elegir_direcciones(df, digrafo)
+        tupla_direcciones = elegir_direcciones(df, grafo)
         origen = tupla_direcciones[0]
         destino = tupla_direcciones[1]
 
@@ -399,16 +678,21 @@ if __name__ == "__main__":
             # 3
             funcion_peso = elegir_modo_calculo_ruta()
 
-            # 4
-            print("Calculando la ruta...")
-            lista_camino = camino_minimo(
-                digrafo, funcion_peso, origen, destino)
+            # Con GPS_METRICAS=1 se registra una línea con los tiempos de cada etapa de la ruta
+            with metricas.peticion('ruta', origen=origen, destino=destino, modo=funcion_peso.__name__):
+                # 4
+                print("Calculando la ruta...")
+                lista_camino = camino_minimo_a_estrella(
+                    grafo, funcion_peso, origen, destino, FACTORES_HEURISTICA[funcion_peso])
 
-            # 5
-            instrucciones(digrafo, lista_camino)
+                # 5
+                instrucciones(grafo, lista_camino)
 
-            # 6
-            print("Dibujando la gráfica...")
-            dibujar(digrafo, lista_camino)
+                # 6
+                print("Dibujando la gráfica...")
+                dibujar(grafo, lista_camino)
 
+    if metricas.activas():
+        print(metricas.instantanea())
+        print(metricas.perfil())
     print("Gracias por usar el GPS y ¡¡¡buen viaje!!!")
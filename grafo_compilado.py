@@ -0,0 +1,664 @@
+"""
+grafo_compilado.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Representación compacta ("compilada") de un grafo o digrafo de networkx para el cálculo
+de rutas. Los vértices se numeran con enteros 0..n-1, la adyacencia se guarda en formato
+CSR (indptr, indices) y cada modo de cálculo de ruta tiene su propio array de pesos, que se
+calcula una única vez en lugar de llamar a la función de peso en cada relajación.
+"""
+
+from typing import List, Dict, Callable, Union, Iterable, Tuple
+import hashlib
+import json
+import os
+import shutil
+import weakref
+import networkx as nx
+import numpy as np
+from scipy.spatial import cKDTree
+import metricas
+
+RADIO_TIERRA = 6371009  # Radio medio de la Tierra en metros (el mismo que usa osmnx para las longitudes)
+MAX_MODOS_FUNCION = 4  # Modos sin nombre (calculados a partir de una función de peso) que se conservan a la vez
+
+
+class GrafoCompilado:
+    """ Grafo dirigido en formato CSR con un array de pesos por cada modo de ruta.
+
+    Los sucesores del vértice i son indices[indptr[i]:indptr[i+1]] y el peso de la arista
+    k-ésima en el modo m es pesos[m][k]. El vértice i se corresponde con el vértice nodos[i]
+    del grafo original, e indice[nodo] devuelve la posición i de un vértice original.
+
+    Attributes:
+        nodos (np.ndarray): identificadores originales de los vértices.
+        indice (Dict[object,int]): posición de cada vértice original.
+        indptr (np.ndarray): array de n+1 posiciones de inicio de la adyacencia de cada vértice.
+        indices (np.ndarray): array de m sucesores.
+        x (np.ndarray): longitud de cada vértice (NaN si el grafo no tiene coordenadas).
+        y (np.ndarray): latitud de cada vértice (NaN si el grafo no tiene coordenadas).
+        pesos (Dict[object,np.ndarray]): array de m pesos para cada modo de ruta.
+        funciones (Dict[str,Callable]): función de peso con la que se calculó cada modo con nombre,
+            si se conoce (no se guarda en disco).
+        datos_nodos (Dict[str,np.ndarray]): otros atributos de los vértices (por ejemplo street_count).
+        datos_aristas (Dict[str,np.ndarray]): otros atributos de las aristas (por ejemplo el
+            nombre de la calle, como posición en la tabla nombres).
+        nombres (List[str]): tabla de cadenas a la que apuntan los atributos de tipo texto.
+    """
+
+    def __init__(self, nodos: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 x: np.ndarray, y: np.ndarray, pesos: Dict[object, np.ndarray] = None,
+                 indice: Dict[object, int] = None):
+        self.nodos = nodos
+        if indice is None:
+            indice = {nodo: i for i, nodo in enumerate(nodos.tolist())}
+        self.indice = indice
+        self.indptr = indptr
+        self.indices = indices
+        self.x = x
+        self.y = y
+        self.pesos = dict(pesos) if pesos else {}
+        self.funciones = {}
+        # Modos calculados a partir de funciones sin nombre registrado, del menos al más usado recientemente
+        self._modos_funcion = []
+        self.datos_nodos = {}
+        self.datos_aristas = {}
+        self.nombres = []
+        # Referencia al grafo de networkx de partida (si lo hay) para poder calcular pesos nuevos
+        self.grafo = None
+        # Directorio del que se cargó el grafo (si se cargó con carga_grafo_compilado)
+        self.directorio = None
+        # Copias en listas de Python de los arrays, que son mucho más rápidas de indexar en los bucles de los algoritmos
+        self._listas = {}
+        # Grafo inverso (mismas aristas en sentido contrario), que se construye la primera vez que se pide
+        self._inverso = None
+        # En un grafo inverso, posición en el grafo directo de cada una de sus aristas
+        self.aristas = None
+        # Para cada modo, cota inferior del cociente peso / distancia en línea recta de sus aristas
+        self._cotas = {}
+        # Árbol k-d sobre las coordenadas proyectadas de los vértices, para buscar el vértice más cercano
+        self._arbol = None
+        self._centro = None
+        # Para cada modo, número de actualizaciones de pesos y de actualizaciones en las que algún peso ha bajado
+        self.versiones = {}
+        self.reducciones = {}
+        # Pesos de cada modo antes de la primera actualización, para poder restablecerlos
+        self._pesos_base = {}
+        # Para cada modo, array de pesos y versión con los que se calculó su huella, y la huella
+        self._huellas = {}
+        # Funciones (métodos, guardados con referencias débiles) a las que se avisa de cada actualización
+        self._observadores = []
+        # Posición en el grafo inverso de cada arista de este grafo
+        self._posiciones_inverso = None
+
+    @property
+    def n(self) -> int:
+        "Número de vértices del grafo"
+        return len(self.indptr) - 1
+
+    @property
+    def m(self) -> int:
+        "Número de aristas del grafo"
+        return len(self.indices)
+
+    def origenes(self) -> np.ndarray:
+        """ Devuelve, para cada arista k, el vértice del que sale (el complementario de indices).
+
+        Returns:
+            np.ndarray: array de m posiciones con el origen de cada arista.
+        """
+        return np.repeat(np.arange(self.n, dtype=self.indices.dtype), np.diff(self.indptr))
+
+    def arista(self, u: int, v: int) -> int:
+        """ Devuelve la posición k de la arista u->v en los arrays de aristas.
+
+        Args:
+            u (int): posición del vértice origen
+            v (int): posición del vértice destino
+        Returns:
+            int: posición de la arista en indices y en los arrays de pesos
+        Raises:
+            KeyError: Si la arista no existe
+        """
+        inicio, fin = self.indptr[u], self.indptr[u+1]
+        posiciones = np.flatnonzero(self.indices[inicio:fin] == v)
+        if len(posiciones) == 0:
+            raise KeyError((u, v))
+        return int(inicio + posiciones[0])
+
+    def aristas_camino(self, camino: Iterable[int]) -> np.ndarray:
+        """ Devuelve la posición de cada arista de un camino dado con posiciones de vértices.
+
+        Args:
+            camino (Iterable[int]): posiciones de los vértices del camino
+        Returns:
+            np.ndarray: posición en indices de la arista entre cada par de vértices consecutivos
+        Raises:
+            KeyError: Si alguna de las aristas no existe
+        """
+        if 'adyacencia' not in self._listas:
+            self._listas['adyacencia'] = (self.indptr.tolist(), self.indices.tolist())
+        indptr, indices = self._listas['adyacencia']
+        camino = list(camino)
+        aristas = []
+        for u, v in zip(camino[:-1], camino[1:]):
+            for k in range(indptr[u], indptr[u+1]):
+                if indices[k] == v:
+                    aristas.append(k)
+                    break
+            else:
+                raise KeyError((u, v))
+        return np.array(aristas, dtype=np.int64)
+
+    def modo(self, peso: Union[str, Callable]) -> object:
+        """ Devuelve la clave de self.pesos asociada a un modo de ruta, calculando su array de
+        pesos si todavía no existe.
+
+        Un modo puede darse por su nombre o por la función de peso que lo define. Una función
+        usa el modo con su nombre (__name__) si ese modo se calculó con ella misma (ver
+        funciones) o si no se sabe con qué función se calculó (un grafo cargado de disco), de
+        forma que peso_ruta_mas_corta y "peso_ruta_mas_corta" hacen referencia al mismo array.
+
+        Los pesos de cualquier otra función (una lambda, por ejemplo) se calculan y se guardan
+        con la función como clave, pero solo se conservan los de las MAX_MODOS_FUNCION últimas
+        funciones usadas, para que las funciones creadas en cada llamada no llenen la memoria.
+
+        Args:
+            peso (str o función): nombre del modo o función de peso G,u,v -> float
+        Returns:
+            object: clave del modo en self.pesos
+        Raises:
+            KeyError: Si el modo no existe y no se puede calcular
+        """
+        if peso in self.pesos:
+            if peso in self._modos_funcion:
+                self._modos_funcion.remove(peso)
+                self._modos_funcion.append(peso)
+            return peso
+        if callable(peso):
+            nombre = getattr(peso, '__name__', None)
+            if isinstance(nombre, str) and nombre in self.pesos and self.funciones.get(nombre, peso) is peso:
+                return nombre
+            if self.grafo is None:
+                raise KeyError(f"No hay grafo de partida para calcular los pesos de {nombre}.")
+            self.pesos[peso] = pesos_aristas(self.grafo, self, peso)
+            self._modos_funcion.append(peso)
+            if len(self._modos_funcion) > MAX_MODOS_FUNCION:
+                self._olvida_modo(self._modos_funcion.pop(0))
+            return peso
+        raise KeyError(f"El modo de ruta {peso} no está compilado.")
+
+    def _olvida_modo(self, modo: object) -> None:
+        """ Borra un modo de ruta y todo lo que se ha calculado a partir de sus pesos. """
+        for datos in (self.pesos, self._listas, self._cotas, self.versiones, self.reducciones, self._pesos_base, self._huellas):
+            datos.pop(modo, None)
+        if self._inverso is not None:
+            self._inverso._olvida_modo(modo)
+
+    def huella_pesos(self, peso: Union[str, Callable]) -> str:
+        """ Calcula la huella (hash SHA-1) del array de pesos actual de un modo de ruta, para
+        saber si un preproceso (guardado en disco o no) se hizo con estos mismos pesos. La huella
+        se recuerda mientras no cambie la versión del modo (ver actualiza_pesos).
+
+        Args:
+            peso (str o función): modo de ruta
+        Returns:
+            str: huella en hexadecimal
+        """
+        modo = self.modo(peso)
+        pesos = self.pesos[modo]
+        version = self.versiones.get(modo, 0)
+        anterior = self._huellas.get(modo)
+        if anterior is None or anterior[0] is not pesos or anterior[1] != version:
+            huella = hashlib.sha1(np.ascontiguousarray(pesos, dtype=np.float64).tobytes()).hexdigest()
+            anterior = self._huellas[modo] = (pesos, version, huella)
+        return anterior[2]
+
+    def listas(self, peso: Union[str, Callable]) -> Tuple[List[int], List[int], List[float]]:
+        """ Devuelve la adyacencia y los pesos de un modo como listas de Python para los bucles
+        de los algoritmos.
+
+        Args:
+            peso (str o función): modo de ruta
+        Returns:
+            Tuple[List[int],List[int],List[float]]: indptr, indices y pesos del modo
+        """
+        modo = self.modo(peso)
+        if 'adyacencia' not in self._listas:
+            self._listas['adyacencia'] = (self.indptr.tolist(), self.indices.tolist())
+        if modo not in self._listas:
+            self._listas[modo] = self.pesos[modo].tolist()
+        indptr, indices = self._listas['adyacencia']
+        return indptr, indices, self._listas[modo]
+
+    def listas_coordenadas(self) -> Tuple[List[float], List[float], List[float]]:
+        """ Devuelve la latitud y la longitud de los vértices en radianes, y el coseno de la
+        latitud, como listas de Python para calcular distancias dentro de los algoritmos.
+
+        Returns:
+            Tuple[List[float],List[float],List[float]]: latitudes, longitudes y cosenos de las latitudes
+        """
+        if 'coordenadas' not in self._listas:
+            latitudes = np.radians(self.y)
+            self._listas['coordenadas'] = (latitudes.tolist(), np.radians(self.x).tolist(),
+                                           np.cos(latitudes).tolist())
+        return self._listas['coordenadas']
+
+    def _proyecta(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        # Proyección equirectangular (en metros) centrada en el grafo, suficiente a escala de una ciudad
+        latitud_0, longitud_0 = self._centro
+        este = np.radians(longitudes - longitud_0) * np.cos(np.radians(latitud_0)) * RADIO_TIERRA
+        norte = np.radians(latitudes - latitud_0) * RADIO_TIERRA
+        return np.column_stack([este, norte])
+
+    def arbol(self) -> cKDTree:
+        """ Devuelve el árbol k-d de los vértices del grafo en coordenadas proyectadas, que se
+        construye la primera vez que se pide.
+
+        Returns:
+            cKDTree: árbol k-d cuyos puntos son los vértices en el orden del grafo
+        """
+        if self._arbol is None:
+            self._centro = (float(np.nanmean(self.y)), float(np.nanmean(self.x)))
+            self._arbol = cKDTree(self._proyecta(np.asarray(self.y), np.asarray(self.x)))
+        return self._arbol
+
+    @metricas.instrumenta()
+    def nodos_mas_cercanos(self, latitudes, longitudes, candidatos: int = 4) -> np.ndarray:
+        """ Busca, para cada punto, el vértice del grafo más cercano.
+
+        El árbol k-d da los vértices más cercanos en la proyección plana y, entre esos candidatos,
+        se elige el más cercano según la distancia haversine, la misma que usa osmnx.nearest_nodes.
+
+        Args:
+            latitudes (float o array): latitudes de los puntos en grados
+            longitudes (float o array): longitudes de los puntos en grados
+            candidatos (int): vértices candidatos que se comparan con la distancia haversine
+        Returns:
+            np.ndarray: posición en el grafo del vértice más cercano a cada punto
+        Example:
+            grafo.camino_original(grafo.nodos_mas_cercanos([40.43, 40.45], [-3.71, -3.69]))
+            da los identificadores de los vértices más cercanos a esos dos puntos.
+        """
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        arbol = self.arbol()
+        candidatos = min(candidatos, self.n)
+        _, posiciones = arbol.query(self._proyecta(latitudes, longitudes), k=candidatos)
+        if candidatos == 1:
+            return posiciones.astype(np.int64)
+        distancias = distancia_haversine(latitudes[:, None], longitudes[:, None],
+                                         np.asarray(self.y)[posiciones], np.asarray(self.x)[posiciones])
+        return posiciones[np.arange(len(latitudes)), np.argmin(distancias, axis=1)].astype(np.int64)
+
+    def inverso(self) -> 'GrafoCompilado':
+        """ Devuelve el grafo inverso, con todas las aristas en sentido contrario y los mismos
+        pesos en cada modo. Se usa para buscar hacia atrás desde el destino.
+
+        Returns:
+            GrafoCompilado: grafo inverso. Su atributo aristas indica, para cada arista del
+                inverso, la posición de la arista original en este grafo.
+        """
+        if self._inverso is None:
+            # Ordenando las aristas por su destino obtenemos la adyacencia CSR del grafo inverso
+            orden = np.argsort(self.indices, kind='stable')
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(np.bincount(self.indices, minlength=self.n))
+            indices = self.origenes()[orden].astype(self.indices.dtype)
+            inverso = GrafoCompilado(self.nodos, indptr, indices, self.x, self.y, indice=self.indice)
+            inverso.aristas = orden
+            self._inverso = inverso
+        inverso = self._inverso
+        for modo, pesos in self.pesos.items():
+            if modo not in inverso.pesos:
+                inverso.pesos[modo] = pesos[inverso.aristas]
+        return inverso
+
+    def cota_peso_distancia(self, peso: Union[str, Callable]) -> float:
+        """ Calcula el mínimo, sobre todas las aristas, del cociente entre el peso de la arista
+        en un modo y la distancia en línea recta (haversine) entre sus extremos.
+
+        Multiplicar la distancia en línea recta entre dos vértices por este valor da una cota
+        inferior del peso de cualquier camino entre ellos.
+
+        Args:
+            peso (str o función): modo de ruta
+        Returns:
+            float: cota del cociente peso / metro
+        """
+        modo = self.modo(peso)
+        if modo not in self._cotas:
+            origenes = self.origenes()
+            distancias = distancia_haversine(self.y[origenes], self.x[origenes],
+                                             self.y[self.indices], self.x[self.indices])
+            validas = distancias > 0
+            if validas.any():
+                self._cotas[modo] = float(np.min(self.pesos[modo][validas] / distancias[validas]))
+            else:
+                self._cotas[modo] = 0.0
+        return self._cotas[modo]
+
+    def suscribe(self, observador: Callable[['GrafoCompilado', object, np.ndarray, np.ndarray, np.ndarray], None]) -> None:
+        """ Registra un método al que se llama después de cada actualización de pesos con el grafo,
+        el modo, las posiciones de las aristas actualizadas, sus pesos anteriores y sus pesos nuevos.
+
+        Se guarda una referencia débil, de forma que suscribirse no impide liberar el objeto
+        (una caché de rutas, por ejemplo) cuando deja de usarse.
+
+        Args:
+            observador (método): método ligado de un objeto
+        Returns: None
+        """
+        self._observadores.append(weakref.WeakMethod(observador))
+
+    def _pesos_escribibles(self, modo: object) -> np.ndarray:
+        """ Devuelve el array de pesos de un modo para modificarlo. La primera vez se guarda el
+        array de partida (que puede estar proyectado en memoria desde disco, y por tanto ser de
+        solo lectura, o compartirse con datos_aristas) y se sustituye por una copia. """
+        if modo not in self._pesos_base:
+            self._pesos_base[modo] = self.pesos[modo]
+            self.pesos[modo] = np.array(self.pesos[modo], dtype=np.float64)
+        return self.pesos[modo]
+
+    def actualiza_pesos(self, peso: Union[str, Callable], aristas: Iterable[int], valores: Union[float, Iterable[float]]) -> np.ndarray:
+        """ Cambia en el sitio el peso de un conjunto de aristas en un modo de ruta (por ejemplo
+        con el tiempo de recorrido medido en una calle con atasco). Un peso infinito (np.inf)
+        cierra la arista.
+
+        Además del array de pesos se actualizan sus listas de Python, el grafo inverso y la cota
+        del cociente peso / distancia, de forma que las búsquedas siguientes ya usan los pesos
+        nuevos, y se avisa a los observadores registrados con suscribe. La primera actualización
+        de un modo copia su array de pesos, y los pesos de partida se conservan para poder
+        restablecerlos con restablece_pesos.
+
+        Args:
+            peso (str o función): modo de ruta
+            aristas (Iterable[int]): posiciones de las aristas
+            valores (float o Iterable[float]): peso nuevo de cada arista, o uno común para todas
+        Returns:
+            np.ndarray: pesos que tenían las aristas antes de la actualización
+        Raises:
+            ValueError: Si algún peso es negativo o NaN
+            KeyError: Si el modo no está en el grafo
+        """
+        modo = self.modo(peso)
+        aristas = np.asarray(aristas, dtype=np.int64).ravel()
+        valores = np.broadcast_to(np.asarray(valores, dtype=np.float64), aristas.shape)
+        if not (valores >= 0).all():
+            raise ValueError("Los pesos de las aristas no pueden ser negativos ni NaN.")
+        pesos = self._pesos_escribibles(modo)
+        anteriores = pesos[aristas]
+        pesos[aristas] = valores
+        if modo in self._listas:
+            lista = self._listas[modo]
+            for k, w in zip(aristas.tolist(), valores.tolist()):
+                lista[k] = w
+        if self._inverso is not None and modo in self._inverso.pesos:
+            if self._posiciones_inverso is None:
+                self._posiciones_inverso = np.argsort(self._inverso.aristas)
+            self._inverso.actualiza_pesos(modo, self._posiciones_inverso[aristas], valores)
+        reducidas = valores < anteriores
+        if reducidas.any():
+            # Solo una bajada puede hacer que la cota deje de ser una cota inferior
+            if modo in self._cotas:
+                origenes = self.origenes()[aristas[reducidas]]
+                destinos = self.indices[aristas[reducidas]]
+                distancias = distancia_haversine(self.y[origenes], self.x[origenes], self.y[destinos], self.x[destinos])
+                validas = distancias > 0
+                if validas.any():
+                    self._cotas[modo] = min(self._cotas[modo],
+                                            float(np.min(valores[reducidas][validas] / distancias[validas])))
+            self.reducciones[modo] = self.reducciones.get(modo, 0) + 1
+        # La versión se cambia cuando los pesos ya están actualizados: quien haya empezado un cálculo
+        # con la versión anterior sabe que su resultado puede no ser válido
+        self.versiones[modo] = self.versiones.get(modo, 0) + 1
+        for referencia in list(self._observadores):
+            observador = referencia()
+            if observador is None:
+                self._observadores.remove(referencia)
+            else:
+                observador(self, modo, aristas, anteriores, np.array(valores))
+        return anteriores
+
+    def restablece_pesos(self, peso: Union[str, Callable], aristas: Iterable[int] = None) -> None:
+        """ Devuelve a un conjunto de aristas (o a todas) el peso que tenían antes de la primera
+        actualización de su modo de ruta.
+
+        Args:
+            peso (str o función): modo de ruta
+            aristas (Iterable[int], opcional): posiciones de las aristas; todas si no se dan
+        Returns: None
+        """
+        modo = self.modo(peso)
+        if modo not in self._pesos_base:
+            return
+        if aristas is None:
+            aristas = np.flatnonzero(self.pesos[modo] != self._pesos_base[modo])
+        aristas = np.asarray(aristas, dtype=np.int64).ravel()
+        self.actualiza_pesos(modo, aristas, self._pesos_base[modo][aristas])
+
+    def cierra_aristas(self, aristas: Iterable[int], modos: Iterable[Union[str, Callable]] = None) -> None:
+        """ Cierra al tráfico un conjunto de aristas (una calle cortada) en varios modos de ruta,
+        dándoles peso infinito.
+
+        Args:
+            aristas (Iterable[int]): posiciones de las aristas
+            modos (Iterable[str o función], opcional): modos de ruta; todos los del grafo si no se dan
+        Returns: None
+        """
+        for modo in (list(self.pesos) if modos is None else modos):
+            self.actualiza_pesos(modo, aristas, np.inf)
+
+    def abre_aristas(self, aristas: Iterable[int], modos: Iterable[Union[str, Callable]] = None) -> None:
+        """ Vuelve a abrir unas aristas cerradas con cierra_aristas, con sus pesos de partida.
+
+        Args:
+            aristas (Iterable[int]): posiciones de las aristas
+            modos (Iterable[str o función], opcional): modos de ruta; todos los del grafo si no se dan
+        Returns: None
+        """
+        for modo in (list(self.pesos) if modos is None else modos):
+            self.restablece_pesos(modo, aristas)
+
+    def refresca_pesos(self, peso: Union[str, Callable]) -> None:
+        """ Descarta lo que se ha calculado a partir del array de pesos de un modo (sus listas de
+        Python, su cota y sus pesos en el grafo inverso) cuando el array ha cambiado sin pasar por
+        actualiza_pesos; por ejemplo, desde otro proceso que lo comparte en memoria (ver
+        enrutador_paralelo.PesosCompartidos). Como no se sabe qué pesos han cambiado, cuenta como
+        una actualización con bajadas de pesos.
+
+        Args:
+            peso (str o función): modo de ruta
+        Returns: None
+        """
+        modo = self.modo(peso)
+        self._listas.pop(modo, None)
+        self._cotas.pop(modo, None)
+        if self._inverso is not None:
+            self._inverso._olvida_modo(modo)
+        self.versiones[modo] = self.versiones.get(modo, 0) + 1
+        self.reducciones[modo] = self.reducciones.get(modo, 0) + 1
+
+    def a_networkx(self, textos: Iterable[str] = ('name',)) -> nx.DiGraph:
+        """ Reconstruye un digrafo de networkx ligero con las coordenadas y los atributos guardados
+        en datos_nodos y datos_aristas, para las funciones que todavía trabajan sobre networkx.
+
+        Args:
+            textos (Iterable[str]): atributos de las aristas que son posiciones en la tabla nombres.
+                Se traducen a su cadena y se omiten en las aristas que no lo tienen (posición -1).
+        Returns:
+            nx.DiGraph: digrafo con los mismos vértices y aristas
+        """
+        G = nx.DiGraph(crs='epsg:4326')
+        nodos = self.camino_original(range(self.n))
+        columnas_nodos = {'x': self.x.tolist(), 'y': self.y.tolist()}
+        columnas_nodos.update({clave: valores.tolist() for clave, valores in self.datos_nodos.items()})
+        G.add_nodes_from((nodo, {clave: valores[i] for clave, valores in columnas_nodos.items()})
+                         for i, nodo in enumerate(nodos))
+        columnas = {clave: valores.tolist() for clave, valores in self.datos_aristas.items()}
+        for clave in textos:
+            if clave in columnas:
+                columnas[clave] = [self.nombres[i] if i >= 0 else None for i in columnas[clave]]
+        origenes = self.origenes().tolist()
+        indices = self.indices.tolist()
+        G.add_edges_from((nodos[origenes[k]], nodos[indices[k]],
+                          {clave: valores[k] for clave, valores in columnas.items() if valores[k] is not None})
+                         for k in range(self.m))
+        return G
+
+    def guarda(self, directorio: str) -> None:
+        """ Guarda el grafo en un directorio, con un fichero .npy por array, para poder cargarlo
+        después con carga_grafo_compilado sin leer ni procesar el grafo original. Solo se guardan
+        los modos de ruta con nombre (str).
+
+        El directorio se escribe primero con otro nombre y se renombra al final, de forma que
+        otro proceso nunca ve un directorio a medio escribir.
+
+        Args:
+            directorio (str): directorio en el que guardar el grafo
+        Returns: None
+        """
+        temporal = f"{directorio}.{os.getpid()}.tmp"
+        os.makedirs(temporal, exist_ok=True)
+        arrays = {'nodos': self.nodos, 'indptr': self.indptr, 'indices': self.indices,
+                  'x': self.x, 'y': self.y, 'nombres': np.array(self.nombres, dtype=str)}
+        modos = [modo for modo in self.pesos if isinstance(modo, str)]
+        for i, modo in enumerate(modos):
+            arrays[f'peso_{i}'] = self.pesos[modo]
+        for clave, valores in self.datos_nodos.items():
+            arrays[f'nodo_{clave}'] = valores
+        for clave, valores in self.datos_aristas.items():
+            arrays[f'arista_{clave}'] = valores
+        for nombre, array in arrays.items():
+            np.save(os.path.join(temporal, f"{nombre}.npy"), np.ascontiguousarray(array))
+        meta = {'modos': modos, 'datos_nodos': list(self.datos_nodos), 'datos_aristas': list(self.datos_aristas)}
+        with open(os.path.join(temporal, 'meta.json'), 'w', encoding='utf-8') as fichero:
+            json.dump(meta, fichero)
+        if os.path.exists(directorio):
+            shutil.rmtree(directorio)
+        os.replace(temporal, directorio)
+
+    def camino_original(self, camino: Iterable[int]) -> List[object]:
+        """ Traduce un camino de posiciones a los vértices del grafo original.
+
+        Args:
+            camino (Iterable[int]): posiciones de los vértices
+        Returns:
+            List[object]: vértices originales
+        """
+        if 'nodos' not in self._listas:
+            self._listas['nodos'] = self.nodos.tolist()
+        nodos = self._listas['nodos']
+        return [nodos[i] for i in camino]
+
+
+def distancia_haversine(lat1, lon1, lat2, lon2):
+    """ Distancia ortodrómica (sobre la esfera terrestre) en metros entre dos puntos dados en
+    grados. Admite tanto números como arrays de numpy.
+
+    Args:
+        lat1, lon1: latitud y longitud del primer punto
+        lat2, lon2: latitud y longitud del segundo punto
+    Returns:
+        Distancia en metros (float o np.ndarray)
+    Example:
+        distancia_haversine(40.4169, -3.7035, 40.4531, -3.6883) es aproximadamente 4200
+    """
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+def pesos_aristas(G: Union[nx.Graph, nx.DiGraph], grafo: GrafoCompilado, peso: Callable[[nx.DiGraph, object, object], float]) -> np.ndarray:
+    """ Evalúa una función de peso sobre todas las aristas de un grafo compilado, una sola vez.
+
+    Args:
+        G (nx.Graph o nx.DiGraph): grafo original
+        grafo (GrafoCompilado): grafo compilado a partir de G
+        peso (función): función que recibe el grafo y dos vértices y devuelve el peso de la arista
+    Returns:
+        np.ndarray: array de m pesos en el orden de grafo.indices
+    """
+    nodos = grafo.nodos.tolist()
+    indices = grafo.indices.tolist()
+    indptr = grafo.indptr.tolist()
+    pesos = np.empty(grafo.m, dtype=np.float64)
+    for u in range(grafo.n):
+        nodo_u = nodos[u]
+        for k in range(indptr[u], indptr[u+1]):
+            pesos[k] = peso(G, nodo_u, nodos[indices[k]])
+    return pesos
+
+
+def compila_grafo(G: Union[nx.Graph, nx.DiGraph], pesos: Union[Dict[object, Callable], Iterable[Callable]] = ()) -> GrafoCompilado:
+    """ Construye la representación compilada de un grafo o digrafo de networkx.
+
+    En un grafo no dirigido cada arista aparece en los dos sentidos.
+
+    Args:
+        G (nx.Graph o nx.DiGraph): grafo a compilar (por ejemplo la salida de callejero.procesa_grafo)
+        pesos: funciones de peso a precalcular. Si es un diccionario, sus claves son los nombres de
+            los modos; si es una lista de funciones, cada modo se nombra con el nombre de su función.
+    Returns:
+        GrafoCompilado: grafo compilado con un array de pesos por modo.
+    Example:
+        grafo = compila_grafo(digrafo, [peso_ruta_mas_corta, peso_ruta_mas_rapida])
+        grafo.pesos['peso_ruta_mas_corta'][k] es la longitud de la arista k.
+    """
+    lista_nodos = list(G.nodes())
+    nodos = np.array(lista_nodos)
+    if nodos.ndim != 1:
+        # Vértices que numpy interpretaría como secuencias (tuplas, por ejemplo)
+        nodos = np.empty(len(lista_nodos), dtype=object)
+        nodos[:] = lista_nodos
+    posicion = {nodo: i for i, nodo in enumerate(lista_nodos)}
+    indptr = np.zeros(len(lista_nodos) + 1, dtype=np.int64)
+    indices = []
+    for i, nodo in enumerate(lista_nodos):
+        sucesores = G.adj[nodo]
+        indices.extend(posicion[v] for v in sucesores)
+        indptr[i+1] = len(indices)
+    indices = np.array(indices, dtype=np.int32 if len(lista_nodos) < 2**31 else np.int64)
+    x = np.array([datos.get('x', np.nan) for _, datos in G.nodes(data=True)], dtype=np.float64)
+    y = np.array([datos.get('y', np.nan) for _, datos in G.nodes(data=True)], dtype=np.float64)
+
+    grafo = GrafoCompilado(nodos, indptr, indices, x, y)
+    grafo.grafo = G
+    if not isinstance(pesos, dict):
+        pesos = {peso.__name__: peso for peso in pesos}
+    for modo, peso in pesos.items():
+        grafo.pesos[modo] = pesos_aristas(G, grafo, peso)
+        grafo.funciones[modo] = peso
+    return grafo
+
+
+def carga_grafo_compilado(directorio: str, mmap: bool = True) -> GrafoCompilado:
+    """ Carga un grafo guardado con GrafoCompilado.guarda.
+
+    Con mmap=True los arrays se proyectan en memoria en modo lectura en lugar de leerse: la carga
+    es casi instantánea y varios procesos que carguen el mismo grafo comparten las mismas páginas.
+
+    Args:
+        directorio (str): directorio en el que se guardó el grafo
+        mmap (bool): si es True los arrays se proyectan en memoria en lugar de leerse
+    Returns:
+        GrafoCompilado: grafo guardado en el directorio
+    Raises:
+        FileNotFoundError: Si el directorio no contiene un grafo guardado
+    """
+    with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as fichero:
+        meta = json.load(fichero)
+
+    def carga(nombre: str) -> np.ndarray:
+        return np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode='r' if mmap else None)
+
+    grafo = GrafoCompilado(carga('nodos'), carga('indptr'), carga('indices'), carga('x'), carga('y'),
+                           {modo: carga(f'peso_{i}') for i, modo in enumerate(meta['modos'])})
+    grafo.datos_nodos = {clave: carga(f'nodo_{clave}') for clave in meta['datos_nodos']}
+    grafo.datos_aristas = {clave: carga(f'arista_{clave}') for clave in meta['datos_aristas']}
+    grafo.nombres = np.load(os.path.join(directorio, 'nombres.npy')).tolist()
+    grafo.directorio = directorio
+    return grafo
@@ -15,7 +15,12 @@ Librería para el análisis de grafos pesados.
 
 from typing import List, Tuple, Dict, Callable, Union
 import networkx as nx
+import numpy as np
 import sys
+import math
+
+from grafo_compilado import GrafoCompilado, compila_grafo, RADIO_TIERRA
+import metricas
 
 import heapq  # Librería para la creación de colas de prioridad
 
@@ -32,11 +37,297 @@ y, en tal caso, para calcular Dijkstra con dicho parámetro haríamos
 
 camino=dijkstra(G,mi_peso,origen, destino)
 
-
+Internamente los caminos mínimos se calculan sobre un GrafoCompilado (adyacencia CSR y un array
+de pesos por función de peso). Con un grafo de networkx se compila en cada llamada, de forma que
+siempre se usan sus aristas y atributos actuales; para no repetir ese trabajo en muchas consultas
+sobre el mismo grafo puede pasarse directamente un GrafoCompilado (ver compila_grafo) y, como
+peso, el nombre de uno de sus modos.
 """
 
+def compilado(G: Union[nx.Graph, nx.DiGraph, GrafoCompilado], peso: Union[str, Callable]) -> Tuple[GrafoCompilado, object]:
+    """ Devuelve el grafo compilado asociado a G y la clave del modo de ruta asociado a peso.
+
+    Si G es un grafo de networkx se compila de nuevo en cada llamada, porque sus aristas o sus
+    atributos pueden haber cambiado desde la anterior sin que haya forma barata de saberlo.
+
+    Args:
+        G (nx.Graph, nx.DiGraph o GrafoCompilado): grafo
+        peso (str o función): función de peso o nombre de un modo de ruta compilado
+    Returns:
+        Tuple[GrafoCompilado,object]: grafo compilado y clave del modo en grafo.pesos
+    """
+    if isinstance(G, GrafoCompilado):
+        return G, G.modo(peso)
+    grafo = compila_grafo(G)
+    return grafo, grafo.modo(peso)
+
+
+def anota_busqueda(estadisticas: Dict[str, int], asentados: int, descartados: int, pendientes: int, iniciales: int = 1) -> None:
+    """ Guarda en estadisticas los contadores de una búsqueda con cola de prioridad.
+
+    Solo se cuentan en el bucle los vértices fijados y las extracciones descartadas (de vértices
+    ya fijados); el resto se deduce al terminar, sin coste en el bucle: cada inserción en la cola
+    se ha extraído o sigue en ella, y cada inserción, salvo las de los vértices iniciales, es una
+    arista relajada que mejora la distancia de su destino.
+
+    Args:
+        estadisticas (Dict[str,int]): diccionario en el que se guardan 'nodos_asentados',
+            'extracciones', 'inserciones' y 'aristas_relajadas'
+        asentados (int): vértices fijados
+        descartados (int): extracciones de vértices ya fijados
+        pendientes (int): elementos que quedan en la cola (o colas)
+        iniciales (int): elementos insertados al empezar
+    Returns: None
+    """
+    extracciones = asentados + descartados
+    estadisticas['nodos_asentados'] = asentados
+    estadisticas['extracciones'] = extracciones
+    estadisticas['inserciones'] = extracciones + pendientes
+    estadisticas['aristas_relajadas'] = extracciones + pendientes - iniciales
+
+
+@metricas.instrumenta('dijkstra')
+def dijkstra_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], origen: int, destino: int = None, estadisticas: Dict[str, int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Calcula el Árbol de Caminos Mínimos desde "origen" sobre un grafo compilado usando el
+    algoritmo de Dijkstra. Los vértices se identifican por su posición en el grafo compilado.
+
+    Si se indica un destino, la búsqueda se detiene en cuanto el destino queda fijado, de forma
+    que el árbol solo es completo para los vértices fijados hasta ese momento.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origen (int): posición del vértice de origen
+        destino (int, opcional): posición del vértice en el que parar la búsqueda
+        estadisticas (Dict[str,int], opcional): si se da, se guardan en él las estadísticas de
+            la búsqueda (ver anota_busqueda)
+    Returns:
+        Tuple[np.ndarray,np.ndarray]: distancias desde el origen (INFTY si el vértice no es alcanzable)
+            y padre de cada vértice en el árbol (-1 para el origen y los vértices no alcanzables).
+    """
+    indptr, indices, pesos = grafo.listas(peso)
+    n = grafo.n
+    d = [INFTY] * n
+    padre = [-1] * n
+    visitado = [False] * n
+    d[origen] = 0
+    asentados = descartados = 0
+    # Al ser los vértices enteros podemos desempatar directamente por su posición
+    Q = [(0, origen)]
+    while Q:
+        dist_v, v = heapq.heappop(Q)
+        if visitado[v]:
+            descartados += 1
+            continue
+        visitado[v] = True
+        asentados += 1
+        if v == destino:
+            break
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            dist_x = dist_v + pesos[k]
+            if dist_x < d[x]:
+                d[x] = dist_x
+                padre[x] = v
+                heapq.heappush(Q, (dist_x, x))
+    if estadisticas is not None:
+        anota_busqueda(estadisticas, asentados, descartados, len(Q))
+    return np.array(d, dtype=np.float64), np.array(padre, dtype=np.int64)
+
+
+@metricas.instrumenta()
+def dijkstra_bidireccional(grafo: GrafoCompilado, peso: Union[str, Callable], origen: int, destino: int, estadisticas: Dict[str, int] = None) -> List[int]:
+    """ Calcula el camino mínimo entre dos vértices de un grafo compilado con el algoritmo de
+    Dijkstra bidireccional: una búsqueda avanza desde el origen sobre el grafo y otra desde el
+    destino sobre el grafo inverso, expandiendo siempre la que tiene la cola con menor distancia.
+    La búsqueda termina cuando la suma de las distancias mínimas de ambas colas supera el mejor
+    camino encontrado.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+        estadisticas (Dict[str,int], opcional): si se da, se guardan en él las estadísticas de
+            ambas búsquedas juntas (ver anota_busqueda)
+    Returns:
+        List[int]: posiciones de los vértices del camino, de origen a destino
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    modo = grafo.modo(peso)
+    inverso = grafo.inverso()
+    n = grafo.n
+    # Índice 0: búsqueda hacia delante desde el origen. Índice 1: búsqueda hacia atrás desde el destino
+    adyacencias = (grafo.listas(modo), inverso.listas(modo))
+    d = ([INFTY] * n, [INFTY] * n)
+    padre = ([-1] * n, [-1] * n)
+    visitado = ([False] * n, [False] * n)
+    d[0][origen] = 0
+    d[1][destino] = 0
+    Q = ([(0, origen)], [(0, destino)])
+    mejor = INFTY if origen != destino else 0
+    encuentro = origen if origen == destino else -1
+    asentados = descartados = 0
+    while Q[0] and Q[1] and Q[0][0][0] + Q[1][0][0] < mejor:
+        lado = 0 if Q[0][0][0] <= Q[1][0][0] else 1
+        dist_v, v = heapq.heappop(Q[lado])
+        if visitado[lado][v]:
+            descartados += 1
+            continue
+        visitado[lado][v] = True
+        asentados += 1
+        indptr, indices, pesos = adyacencias[lado]
+        d_lado, padre_lado, Q_lado, d_otro = d[lado], padre[lado], Q[lado], d[1 - lado]
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            dist_x = dist_v + pesos[k]
+            if dist_x < d_lado[x]:
+                d_lado[x] = dist_x
+                padre_lado[x] = v
+                heapq.heappush(Q_lado, (dist_x, x))
+            # Si la otra búsqueda ya ha llegado a x tenemos un camino candidato que pasa por x
+            if dist_x + d_otro[x] < mejor:
+                mejor = dist_x + d_otro[x]
+                encuentro = x
+    if estadisticas is not None:
+        anota_busqueda(estadisticas, asentados, descartados, len(Q[0]) + len(Q[1]), 2)
+    if encuentro < 0:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    # La primera mitad va del origen al punto de encuentro y la segunda se recorre hacia atrás
+    camino = reconstruye_camino(padre[0], origen, encuentro)
+    nodo = encuentro
+    while nodo != destino:
+        nodo = padre[1][nodo]
+        camino.append(nodo)
+    return camino
+
+
+def reconstruye_camino(padre: Union[List[int], np.ndarray], origen: int, destino: int) -> List[int]:
+    """ Reconstruye el camino desde origen hasta destino a partir del array de padres de un árbol
+    de caminos mínimos, en tiempo lineal en la longitud del camino.
 
-def dijkstra(G: Union[nx.Graph, nx.DiGraph], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origen: object) -> Dict[object, object]:
+    Args:
+        padre (List[int] o np.ndarray): padre de cada vértice (-1 si no tiene)
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+    Returns:
+        List[int]: posiciones de los vértices del camino, de origen a destino
+    Raises:
+        ValueError: Si destino no es alcanzable desde origen
+    """
+    camino = [destino]
+    nodo = destino
+    while nodo != origen:
+        nodo = int(padre[nodo])
+        if nodo < 0:
+            raise ValueError(
+                f"No hay camino posible que vaya de {origen} hasta {destino}.")
+        camino.append(nodo)
+    camino.reverse()
+    return camino
+
+
+def camino_minimo_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], origen: int, destino: int, bidireccional: bool = False, estadisticas: Dict[str, int] = None) -> List[int]:
+    """ Calcula el camino mínimo entre dos vértices de un grafo compilado con Dijkstra,
+    deteniendo la búsqueda en cuanto se fija el destino.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+        bidireccional (bool): si es True se usa Dijkstra bidireccional
+        estadisticas (Dict[str,int], opcional): diccionario en el que guardar el número de
+            vértices fijados ('nodos_asentados')
+    Returns:
+        List[int]: posiciones de los vértices del camino, de origen a destino
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    if bidireccional:
+        return dijkstra_bidireccional(grafo, peso, origen, destino, estadisticas)
+    _, padre = dijkstra_compilado(grafo, peso, origen, destino, estadisticas)
+    return reconstruye_camino(padre, origen, destino)
+
+
+@metricas.instrumenta()
+def a_estrella(grafo: GrafoCompilado, peso: Union[str, Callable], origen: int, destino: int, factor: float = None, estadisticas: Dict[str, int] = None, heuristica: List[float] = None) -> List[int]:
+    """ Calcula el camino mínimo entre dos vértices de un grafo compilado con el algoritmo A*,
+    usando como heurística la distancia en línea recta (haversine) hasta el destino multiplicada
+    por un factor (1 si los pesos son metros, 1/velocidad máxima si son segundos).
+
+    Para que el camino sea mínimo la heurística tiene que ser admisible, así que el factor se
+    reduce si alguna arista del grafo tiene un peso por metro menor que él
+    (ver GrafoCompilado.cota_peso_distancia).
+
+    También puede darse una heurística ya calculada para todos los vértices (por ejemplo la de
+    los hitos de hitos.py), que se usa en lugar de la distancia en línea recta.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas x, y en grados
+        peso (str o función): modo de ruta
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+        factor (float, opcional): peso mínimo por metro del modo. Si no se da se usa la cota
+            calculada a partir de las aristas del grafo.
+        estadisticas (Dict[str,int], opcional): diccionario en el que guardar las estadísticas
+            de la búsqueda (ver anota_busqueda)
+        heuristica (List[float], opcional): cota inferior del peso desde cada vértice hasta el destino
+    Returns:
+        List[int]: posiciones de los vértices del camino, de origen a destino
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    modo = grafo.modo(peso)
+    indptr, indices, pesos = grafo.listas(modo)
+    n = grafo.n
+    if heuristica is None:
+        cota = grafo.cota_peso_distancia(modo)
+        factor = cota if factor is None else min(factor, cota)
+        latitudes, longitudes, cosenos = grafo.listas_coordenadas()
+        lat_t, lon_t, cos_t = latitudes[destino], longitudes[destino], cosenos[destino]
+        escala = 2 * RADIO_TIERRA * factor
+        # Heurística de cada vértice, que se calcula la primera vez que se alcanza
+        h = [-1.0] * n
+    else:
+        h = heuristica
+    d = [INFTY] * n
+    padre = [-1] * n
+    visitado = [False] * n
+    d[origen] = 0
+    asentados = descartados = 0
+    Q = [(0, 0, origen)]
+    while Q:
+        _, dist_v, v = heapq.heappop(Q)
+        if visitado[v]:
+            descartados += 1
+            continue
+        visitado[v] = True
+        asentados += 1
+        if v == destino:
+            break
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            dist_x = dist_v + pesos[k]
+            if dist_x < d[x]:
+                d[x] = dist_x
+                padre[x] = v
+                h_x = h[x]
+                if h_x < 0:
+                    # Fórmula del haversine con los cosenos de las latitudes ya calculados
+                    seno_lat = math.sin((lat_t - latitudes[x]) / 2)
+                    seno_lon = math.sin((lon_t - longitudes[x]) / 2)
+                    a = seno_lat * seno_lat + cosenos[x] * cos_t * seno_lon * seno_lon
+                    h_x = h[x] = escala * math.asin(math.sqrt(min(a, 1.0)))
+                heapq.heappush(Q, (dist_x + h_x, dist_x, x))
+    if estadisticas is not None:
+        anota_busqueda(estadisticas, asentados, descartados, len(Q))
+    return reconstruye_camino(padre, origen, destino)
+
+
+def dijkstra(G: Union[nx.Graph, nx.DiGraph, GrafoCompilado], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origen: object) -> Dict[object, object]:
     """ Calcula un Árbol de Caminos Mínimos para el grafo pesado partiendo
     del vértice "origen" usando el algoritmo de Dijkstra. Calcula únicamente
     el árbol de la componente conexa que contiene a "origen".
@@ -56,47 +347,26 @@ def dijkstra(G: Union[nx.Graph, nx.DiGraph], peso: Union[Callable[[nx.Graph, obj
         hash(origen)
     except TypeError:
         raise TypeError("el origen debe ser hashable.")
+    grafo, modo = compilado(G, peso)
+    _, padres = dijkstra_compilado(grafo, modo, grafo.indice[origen])
+    nodos = grafo.camino_original(range(grafo.n))
     padre = {}
-    d = {}
-    visitado = {}
-    for v in G.nodes():
-        padre[v] = None
-        visitado[v] = False
-        d[v] = INFTY
-    d[origen] = 0
-
-    contador = 0  # añadimos un parametro distinto en el heap entre el peso y el nombre para que nunca nos compare el nombre
-    # es decir, si el peso es el mismo nos comparar el contador en lugar de comparar el nombre eligiendo entonces el primero a la hora de hacer el heappop
-    # creamos una cola de prioridad con la librria heapq
-    Q = []
-    heapq.heappush(Q, (d[origen], contador, origen))
-
-    while Q:
-        contador += 1
-        # extraer el nodo con menor distancia al origen
-        dist_v, _, v = heapq.heappop(Q)
-        if not visitado[v]:
-            visitado[v] = True
-            for x in G.neighbors(v):
-                contador += 1
-                peso_arista_v_x = peso(G, v, x)
-                if d[x] > d[v] + peso_arista_v_x:
-                    d[x] = d[v] + peso_arista_v_x
-                    padre[x] = v
-                    # añadimos x a la cola de prioridad
-                    heapq.heappush(Q, (d[x], contador, x))
+    for v, p in zip(nodos, padres.tolist()):
+        padre[v] = nodos[p] if p >= 0 else None
     return padre
 
 
-def camino_minimo(G: Union[nx.Graph, nx.DiGraph], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origen: object, destino: object) -> List[object]:
+def camino_minimo(G: Union[nx.Graph, nx.DiGraph, GrafoCompilado], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origen: object, destino: object, bidireccional: bool = False) -> List[object]:
     """ Calcula el camino mínimo desde el vértice origen hasta el vértice
-    destino utilizando el algoritmo de Dijkstra.
+    destino utilizando el algoritmo de Dijkstra. La búsqueda se detiene
+    en cuanto se alcanza el destino.
 
     Args:
         G (nx.Graph o nx.Digraph): grafo a grado dirigido
         peso (función): función que recibe un grafo o grafo dirigido y dos vértices del mismo y devuelve el peso de la arista que los conecta
         origen (object): vértice del grafo de origen
         destino (object): vértice del grafo de destino
+        bidireccional (bool): si es True se busca a la vez desde el origen y, sobre el grafo inverso, desde el destino
     Returns:
         List[object]: Devuelve una lista con los vértices del grafo por los que pasa
             el camino más corto entre el origen y el destino. El primer elemento de
@@ -112,19 +382,226 @@ def camino_minimo(G: Union[nx.Graph, nx.DiGraph], peso: Union[Callable[[nx.Graph
         hash(destino)
     except TypeError:
         raise TypeError("el origen y el destino deben ser hashables.")
-    if origen not in G or destino not in G:
+    grafo, modo = compilado(G, peso)
+    if origen not in grafo.indice or destino not in grafo.indice:
         raise ValueError(
             f"No hay camino posible que vaya de {origen} hasta {destino}.")
-    padres = dijkstra(G, peso, origen)
-    nodo = destino
-    camino = [destino]
-    while nodo != origen:
-        if nodo not in padres:
-            raise ValueError(
-                f"No hay camino posible que vaya de {origen} hasta {destino}.")
-        nodo = padres[nodo]
-        camino = [nodo]+camino
-    return camino
+    try:
+        camino = camino_minimo_compilado(
+            grafo, modo, grafo.indice[origen], grafo.indice[destino], bidireccional)
+    except ValueError:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    return grafo.camino_original(camino)
+
+
+def camino_minimo_a_estrella(G: Union[nx.Graph, nx.DiGraph, GrafoCompilado], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origen: object, destino: object, factor: float = None) -> List[object]:
+    """ Calcula el camino mínimo desde el vértice origen hasta el vértice destino
+    utilizando el algoritmo A* con la distancia en línea recta hasta el destino
+    como heurística. Los vértices del grafo deben tener coordenadas 'x' (longitud)
+    e 'y' (latitud) en grados.
+
+    Args:
+        G (nx.Graph, nx.DiGraph o GrafoCompilado): grafo
+        peso (función): función que recibe un grafo o grafo dirigido y dos vértices del mismo y devuelve el peso de la arista que los conecta
+        origen (object): vértice del grafo de origen
+        destino (object): vértice del grafo de destino
+        factor (float, opcional): peso mínimo por metro recorrido (1 si el peso es la longitud,
+            3.6/velocidad máxima en km/h si el peso es el tiempo en segundos)
+    Returns:
+        List[object]: lista con los vértices del camino más corto, de origen a destino.
+    Raises:
+        TypeError: Si origen o destino no son "hashable".
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    try:
+        hash(origen)
+        hash(destino)
+    except TypeError:
+        raise TypeError("el origen y el destino deben ser hashables.")
+    grafo, modo = compilado(G, peso)
+    if origen not in grafo.indice or destino not in grafo.indice:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    try:
+        camino = a_estrella(
+            grafo, modo, grafo.indice[origen], grafo.indice[destino], factor)
+    except ValueError:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    return grafo.camino_original(camino)
+
+
+def matriz_distancias_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], origenes: List[int], destinos: List[int], caminos: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, List[List[List[int]]]]]:
+    """ Calcula la matriz de distancias mínimas entre unos vértices de origen y otros de destino
+    de un grafo compilado. Se hace una búsqueda de Dijkstra por cada origen, que se detiene en
+    cuanto se han fijado todos los destinos.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origenes (List[int]): posiciones de los vértices de origen
+        destinos (List[int]): posiciones de los vértices de destino
+        caminos (bool): si es True también se devuelven los caminos
+    Returns:
+        np.ndarray: matriz (len(origenes) x len(destinos)) con la distancia mínima de cada origen
+            a cada destino (np.inf si no se puede llegar)
+        List[List[List[int]]]: solo si caminos es True, caminos[i][j] es el camino mínimo
+            (posiciones de los vértices) del origen i al destino j, o None si no existe
+    """
+    indptr, indices, pesos = grafo.listas(peso)
+    n = grafo.n
+    destinos = [int(t) for t in destinos]
+    objetivos = set(destinos)
+    matriz = np.full((len(origenes), len(destinos)), np.inf)
+    lista_caminos = []
+    for i, origen in enumerate(origenes):
+        origen = int(origen)
+        d = [INFTY] * n
+        padre = [-1] * n
+        visitado = [False] * n
+        d[origen] = 0
+        pendientes = len(objetivos)
+        Q = [(0, origen)]
+        while Q and pendientes:
+            dist_v, v = heapq.heappop(Q)
+            if visitado[v]:
+                continue
+            visitado[v] = True
+            if v in objetivos:
+                pendientes -= 1
+            for k in range(indptr[v], indptr[v+1]):
+                x = indices[k]
+                dist_x = dist_v + pesos[k]
+                if dist_x < d[x]:
+                    d[x] = dist_x
+                    padre[x] = v
+                    heapq.heappush(Q, (dist_x, x))
+        for j, destino in enumerate(destinos):
+            if visitado[destino]:
+                matriz[i, j] = d[destino]
+        if caminos:
+            lista_caminos.append([reconstruye_camino(padre, origen, destino) if visitado[destino] else None
+                                  for destino in destinos])
+    if caminos:
+        return matriz, lista_caminos
+    return matriz
+
+
+def matriz_distancias(G: Union[nx.Graph, nx.DiGraph, GrafoCompilado], peso: Union[Callable[[nx.Graph, object, object], float], Callable[[nx.DiGraph, object, object], float]], origenes: List[object], destinos: List[object], caminos: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, List[List[List[object]]]]]:
+    """ Calcula la matriz de distancias mínimas desde cada vértice de origenes hasta cada
+    vértice de destinos, con una búsqueda de Dijkstra por origen.
+
+    Args:
+        G (nx.Graph, nx.DiGraph o GrafoCompilado): grafo
+        peso (función): función que recibe un grafo o grafo dirigido y dos vértices del mismo y devuelve el peso de la arista que los conecta
+        origenes (List[object]): vértices de origen
+        destinos (List[object]): vértices de destino
+        caminos (bool): si es True también se devuelven los caminos
+    Returns:
+        np.ndarray: matriz (len(origenes) x len(destinos)) de distancias mínimas, con np.inf
+            cuando no hay camino
+        List[List[List[object]]]: solo si caminos es True, caminos[i][j] es la lista de vértices
+            del camino mínimo de origenes[i] a destinos[j], o None si no hay camino
+    Raises:
+        ValueError: Si algún origen o destino no es un vértice del grafo
+    Example:
+        matriz_distancias(G, peso, [1, 2], [3, 4, 5])[1, 2] es la distancia mínima de 2 a 5.
+    """
+    grafo, modo = compilado(G, peso)
+    for v in list(origenes) + list(destinos):
+        if v not in grafo.indice:
+            raise ValueError(f"{v} no es un vértice del grafo.")
+    resultado = matriz_distancias_compilado(grafo, modo, [grafo.indice[v] for v in origenes],
+                                            [grafo.indice[v] for v in destinos], caminos)
+    if not caminos:
+        return resultado
+    matriz, lista_caminos = resultado
+    return matriz, [[grafo.camino_original(camino) if camino is not None else None for camino in fila]
+                    for fila in lista_caminos]
+
+
+def prim_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], origen: int = 0) -> np.ndarray:
+    """ Calcula un Árbol Abarcador Mínimo de la componente conexa de origen con el algoritmo de
+    Prim sobre un grafo compilado no dirigido (cada arista en los dos sentidos).
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origen (int): posición del vértice raíz
+    Returns:
+        np.ndarray: padre de cada vértice en el árbol (-1 para la raíz y para los vértices de
+            otras componentes conexas)
+    """
+    indptr, indices, pesos = grafo.listas(peso)
+    n = grafo.n
+    coste_minimo = [INFTY] * n
+    padre = [-1] * n
+    visitado = [False] * n
+    coste_minimo[origen] = 0
+    Q = [(0, origen)]
+    while Q:
+        _, v = heapq.heappop(Q)
+        if visitado[v]:
+            continue
+        visitado[v] = True
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            peso_arista = pesos[k]
+            if not visitado[x] and peso_arista < coste_minimo[x]:
+                coste_minimo[x] = peso_arista
+                padre[x] = v
+                heapq.heappush(Q, (peso_arista, x))
+    return np.array(padre, dtype=np.int64)
+
+
+def kruskal_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], dirigido: bool = False) -> np.ndarray:
+    """ Calcula un Árbol (o bosque) Abarcador Mínimo con el algoritmo de Kruskal sobre un grafo
+    compilado no dirigido. Las aristas se ordenan de una vez por su peso y las componentes se
+    mantienen en una estructura de conjuntos disjuntos (unión por rango y compresión de caminos).
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        dirigido (bool): si es False cada arista está en los dos sentidos y solo se considera una
+            vez; si es True se consideran todas las aristas, ignorando su sentido
+    Returns:
+        np.ndarray: posiciones (en grafo.indices) de las aristas del árbol, en el orden en que se añaden
+    """
+    modo = grafo.modo(peso)
+    origenes = grafo.origenes()
+    if dirigido:
+        aristas = np.flatnonzero(origenes != grafo.indices)
+    else:
+        # Cada arista aparece en los dos sentidos: nos quedamos con la que va al vértice posterior
+        aristas = np.flatnonzero(origenes < grafo.indices)
+    aristas = aristas[np.argsort(grafo.pesos[modo][aristas], kind='stable')]
+    extremos_u = origenes[aristas].tolist()
+    extremos_v = grafo.indices[aristas].tolist()
+    raiz = list(range(grafo.n))
+    rango = [0] * grafo.n
+    arbol = []
+    restantes = grafo.n - 1
+    for k, u, v in zip(aristas.tolist(), extremos_u, extremos_v):
+        # Búsqueda de las raíces acortando el camino a la mitad en cada paso
+        while raiz[u] != u:
+            raiz[u] = raiz[raiz[u]]
+            u = raiz[u]
+        while raiz[v] != v:
+            raiz[v] = raiz[raiz[v]]
+            v = raiz[v]
+        if u == v:
+            continue
+        if rango[u] < rango[v]:
+            u, v = v, u
+        raiz[v] = u
+        if rango[u] == rango[v]:
+            rango[u] += 1
+        arbol.append(k)
+        restantes -= 1
+        if not restantes:
+            break
+    return np.array(arbol, dtype=np.int64)
 
 
 def prim(G: nx.Graph, peso: Callable[[nx.Graph, object, object], float]) -> Dict[object, object]:
@@ -144,33 +621,13 @@ def prim(G: nx.Graph, peso: Callable[[nx.Graph, object, object], float]) -> Dict
             1 es padre de 2 y de 4
             2 es padre de 3
     """
-    padre = {}
-    coste_minimo = {}
-    Q = []
-    nodos_sin_visitar = set(G.nodes())
-    for v in G.nodes():
-        padre[v] = None
-        coste_minimo[v] = INFTY
-    # cogemos un nodo cualquiera como nodo origen (hemos cogido el primero de G.nodes() por coger uno)
-    nodo_inicial = list(G.nodes())[0]
-    coste_minimo[nodo_inicial] = 0
-    contador = 0
-    heapq.heappush(Q, (coste_minimo[nodo_inicial], contador, nodo_inicial))
-
-    while Q != []:
-        contador += 1
-        coste_minimo_v, _,  v = heapq.heappop(Q)
-        if v in nodos_sin_visitar:
-            nodos_sin_visitar.remove(v)
-        for x in G.neighbors(v):
-            contador += 1
-            if x in nodos_sin_visitar:
-                peso_arista_v_x = peso(G, v, x)
-                if peso_arista_v_x < coste_minimo[x]:
-                    coste_minimo[x] = peso_arista_v_x
-                    padre[x] = v
-                    heapq.heappush(Q, (coste_minimo[x], contador, x))
-    return padre
+    # cogemos un nodo cualquiera como nodo origen (el primero de G.nodes(), que es la posición 0 del grafo compilado)
+    grafo, modo = compilado(G, peso)
+    if grafo.n == 0:
+        return {}
+    padre = prim_compilado(grafo, modo, 0).tolist()
+    nodos = grafo.nodos.tolist()
+    return {nodos[i]: nodos[p] if p >= 0 else None for i, p in enumerate(padre)}
 
 
 def kruskal(G: nx.Graph, peso: Callable[[nx.Graph, object, object], float]) -> List[Tuple[object, object]]:
@@ -189,20 +646,9 @@ def kruskal(G: nx.Graph, peso: Callable[[nx.Graph, object, object], float]) -> L
         En el ejemplo anterior en que prim(G,peso)={1:None, 2:1, 3:2, 4:1} podríamos tener, por ejemplo,
         kruskal(G,peso)=[(1,2),(1,4),(3,2)]
     """
-    aristas_arbol = []
-    L = []
-    for u, v in G.edges():
-        L.append((peso(G, u, v), u, v))
-    L.sort(key=lambda x: x[0])
-
-    componentes = {v: (v,) for v in G.nodes()}
-    for peso_arista, u, v in L:
-        if componentes[u] != componentes[v]:
-            aristas_arbol.append((u, v))
-            componente_u = componentes[u]
-            componente_v = componentes[v]
-            componente_unida = componente_u + componente_v
-            for nodo in componente_unida:
-                componentes[nodo] = componente_unida
-
-    return aristas_arbol
+    grafo, modo = compilado(G, peso)
+    aristas = kruskal_compilado(grafo, modo, G.is_directed())
+    nodos = grafo.nodos.tolist()
+    origenes = grafo.origenes()[aristas].tolist()
+    destinos = grafo.indices[aristas].tolist()
+    return [(nodos[u], nodos[v]) for u, v in zip(origenes, destinos)]
@@ -0,0 +1,249 @@
+"""
+hitos.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Índice de hitos (landmarks) para el algoritmo A* con la técnica ALT (A*, Landmarks y
+desigualdad Triangular). Para unos pocos vértices L del grafo (los hitos) se precalculan
+las distancias d(L,v) y d(v,L) a todos los vértices v en cada modo de ruta. Por la
+desigualdad triangular, para cualquier par de vértices v, t:
+
+    d(v,t) >= d(L,t) - d(L,v)    y    d(v,t) >= d(v,L) - d(t,L)
+
+lo que da una cota inferior del peso que falta hasta el destino mucho más ajustada que la
+distancia en línea recta, sobre todo en los modos de ruta basados en tiempo.
+"""
+
+from typing import List, Dict, Callable, Union
+import math
+import os
+import numpy as np
+
+from grafo_compilado import GrafoCompilado
+from grafo_pesado import dijkstra_compilado, a_estrella, INFTY
+
+NUMERO_HITOS = 16  # Hitos que se eligen por defecto
+HITOS_ACTIVOS = 4  # Hitos que se usan en cada consulta (los que mejor acotan el origen)
+
+
+class IndiceHitos:
+    """ Distancias desde y hasta cada hito en un modo de ruta, guardadas en float32.
+
+    Attributes:
+        nodos (np.ndarray): identificadores originales de los vértices del grafo
+        hitos (np.ndarray): posición de cada hito en el grafo
+        desde (np.ndarray): array (hitos x vértices) con d(hito, v); inf si v no es alcanzable
+        hasta (np.ndarray): array (hitos x vértices) con d(v, hito); inf si el hito no es alcanzable desde v
+        reducciones (int): actualizaciones con bajadas de pesos del grafo (GrafoCompilado.reducciones)
+            hechas antes de calcular el índice; los índices guardados en disco son de los pesos de partida
+        huella (str): huella de los pesos con los que se calculó (GrafoCompilado.huella_pesos), o
+            None si no se conoce
+    """
+
+    def __init__(self, nodos: np.ndarray, hitos: np.ndarray, desde: np.ndarray, hasta: np.ndarray):
+        self.nodos = nodos
+        self.hitos = hitos
+        self.desde = desde
+        self.hasta = hasta
+        self.reducciones = 0
+        self.huella = None
+        # Al guardar las distancias en float32 se redondean; restamos este margen a la cota
+        # para que siga siendo una cota inferior
+        finitas = np.concatenate([desde[np.isfinite(desde)], hasta[np.isfinite(hasta)]])
+        maximo = float(finitas.max()) if len(finitas) else 0.0
+        self.tolerancia = 4 * maximo * float(np.finfo(np.float32).eps)
+
+    def heuristica(self, origen: int, destino: int, activos: int = HITOS_ACTIVOS) -> List[float]:
+        """ Calcula la cota inferior de d(v, destino) para todos los vértices v.
+
+        Se usan solo los hitos que mejor acotan d(origen, destino), que suelen ser los que
+        quedan "detrás" del origen o "delante" del destino.
+
+        Args:
+            origen (int): posición del vértice de origen
+            destino (int): posición del vértice de destino
+            activos (int): número de hitos a usar
+        Returns:
+            List[float]: cota inferior para cada vértice
+        """
+        # Las restas entre infinitos dan NaN, que fmax ignora
+        with np.errstate(invalid='ignore'):
+            cotas_origen = np.fmax(self.desde[:, destino] - self.desde[:, origen],
+                                   self.hasta[:, origen] - self.hasta[:, destino])
+            cotas_origen = np.nan_to_num(cotas_origen, nan=-np.inf)
+            elegidos = np.argsort(-cotas_origen)[:activos]
+            desde = self.desde[elegidos].astype(np.float64)
+            hasta = self.hasta[elegidos].astype(np.float64)
+            cotas = np.fmax(desde[:, destino, None] - desde, hasta - hasta[:, destino, None])
+            h = np.nanmax(np.where(np.isnan(cotas), -np.inf, cotas), axis=0) - self.tolerancia
+        return np.maximum(h, 0).tolist()
+
+
+def selecciona_hitos(grafo: GrafoCompilado, numero: int = NUMERO_HITOS) -> np.ndarray:
+    """ Elige hitos repartidos por la periferia del grafo: se divide el plano en sectores
+    angulares alrededor del centro y en cada sector se toma el vértice más alejado del centro.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas
+        numero (int): número de hitos
+    Returns:
+        np.ndarray: posiciones de los hitos
+    """
+    # Coordenadas aproximadamente en metros (proyección equirectangular) respecto al centro
+    centro_x, centro_y = np.nanmean(grafo.x), np.nanmean(grafo.y)
+    este = (grafo.x - centro_x) * math.cos(math.radians(centro_y))
+    norte = grafo.y - centro_y
+    radio = np.hypot(este, norte)
+    sector = ((np.arctan2(norte, este) + np.pi) / (2 * np.pi) * numero).astype(np.int64) % numero
+    # Los vértices sin aristas no sirven como hitos
+    grado = np.diff(grafo.indptr)
+    radio = np.where(grado > 0, radio, -1)
+    hitos = []
+    for s in range(numero):
+        candidatos = np.flatnonzero(sector == s)
+        if len(candidatos):
+            hitos.append(candidatos[np.argmax(radio[candidatos])])
+    return np.array(hitos, dtype=np.int64)
+
+
+def construye_hitos(grafo: GrafoCompilado, peso: Union[str, Callable], hitos: np.ndarray) -> IndiceHitos:
+    """ Precalcula las distancias desde y hasta cada hito con un Dijkstra completo sobre el grafo
+    y otro sobre el grafo inverso.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        hitos (np.ndarray): posiciones de los hitos
+    Returns:
+        IndiceHitos: índice de hitos del modo
+    """
+    modo = grafo.modo(peso)
+    inverso = grafo.inverso()
+    desde = np.empty((len(hitos), grafo.n), dtype=np.float32)
+    hasta = np.empty((len(hitos), grafo.n), dtype=np.float32)
+    for i, hito in enumerate(hitos.tolist()):
+        for distancias, g in ((desde, grafo), (hasta, inverso)):
+            d, _ = dijkstra_compilado(g, modo, hito)
+            d[d >= INFTY] = np.inf
+            distancias[i] = d
+    indice = IndiceHitos(grafo.nodos, hitos, desde, hasta)
+    indice.reducciones = grafo.reducciones.get(modo, 0)
+    indice.huella = grafo.huella_pesos(modo)
+    return indice
+
+
+def guarda_hitos(indice: IndiceHitos, fichero: str) -> None:
+    """ Guarda un índice de hitos en un fichero .npz.
+
+    Args:
+        indice (IndiceHitos): índice a guardar
+        fichero (str): ruta del fichero
+    Returns: None
+    """
+    np.savez(fichero, nodos=indice.nodos, hitos=indice.hitos, desde=indice.desde, hasta=indice.hasta,
+             huella=np.array(indice.huella or ""))
+
+
+def carga_hitos(fichero: str) -> IndiceHitos:
+    """ Carga un índice de hitos guardado con guarda_hitos.
+
+    Args:
+        fichero (str): ruta del fichero
+    Returns:
+        IndiceHitos: índice guardado en el fichero
+    Raises:
+        FileNotFoundError: Si el fichero no existe
+    """
+    with np.load(fichero) as datos:
+        indice = IndiceHitos(datos['nodos'], datos['hitos'], datos['desde'], datos['hasta'])
+        # Los ficheros anteriores a la huella de los pesos no la tienen
+        indice.huella = (str(datos['huella']) or None) if 'huella' in datos.files else None
+    return indice
+
+
+def hitos_modos(grafo: GrafoCompilado, modos: List[Union[str, Callable]], directorio: str, numero: int = NUMERO_HITOS) -> Dict[object, IndiceHitos]:
+    """ Devuelve el índice de hitos de cada modo de ruta, cargándolo del directorio si ya se
+    calculó para este grafo y calculándolo y guardándolo en caso contrario. Todos los modos
+    comparten los mismos hitos.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        modos (List[str o función]): modos de ruta
+        directorio (str): directorio en el que se guardan los índices
+        numero (int): número de hitos
+    Returns:
+        Dict[object,IndiceHitos]: índice de cada modo, con el modo como clave
+    """
+    os.makedirs(directorio, exist_ok=True)
+    indices = {}
+    hitos = None
+    for peso in modos:
+        nombre = peso if isinstance(peso, str) else peso.__name__
+        fichero = os.path.join(directorio, f"hitos_{nombre}.npz")
+        indice = None
+        if os.path.exists(fichero):
+            indice = carga_hitos(fichero)
+            # Si el grafo o sus pesos han cambiado desde el preproceso hay que calcularlo de nuevo
+            if len(indice.nodos) != grafo.n or not np.array_equal(indice.nodos, grafo.nodos) \
+                    or indice.huella != grafo.huella_pesos(peso):
+                indice = None
+        if indice is None:
+            if hitos is None:
+                hitos = selecciona_hitos(grafo, numero)
+            indice = construye_hitos(grafo, peso, hitos)
+            guarda_hitos(indice, fichero)
+        indices[peso] = indice
+    return indices
+
+
+def camino_minimo_alt(indice: IndiceHitos, grafo: GrafoCompilado, peso: Union[str, Callable], origen: object, destino: object) -> List[object]:
+    """ Calcula el camino mínimo desde el vértice origen hasta el vértice destino con A*,
+    usando la cota de los hitos como heurística.
+
+    Si después de calcular el índice ha bajado el peso de alguna arista del grafo
+    (GrafoCompilado.actualiza_pesos) la cota puede dejar de ser una cota inferior, y se usa la
+    distancia en línea recta, con la que el A* fija muchos más vértices, hasta que los pesos
+    vuelven a ser aquellos con los que se calculó el índice (misma huella, ver
+    GrafoCompilado.huella_pesos), por ejemplo con restablece_pesos. Las subidas de pesos y los
+    cierres de aristas no le afectan.
+
+    Args:
+        indice (IndiceHitos): índice de hitos del modo de ruta
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta (el mismo con el que se construyó el índice)
+        origen (object): vértice del grafo de origen
+        destino (object): vértice del grafo de destino
+    Returns:
+        List[object]: lista con los vértices del camino más corto, de origen a destino.
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    if origen not in grafo.indice or destino not in grafo.indice:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    i_origen, i_destino = grafo.indice[origen], grafo.indice[destino]
+    heuristica = None
+    modo = grafo.modo(peso)
+    if grafo.reducciones.get(modo, 0) == indice.reducciones or grafo.huella_pesos(modo) == indice.huella:
+        heuristica = indice.heuristica(i_origen, i_destino)
+    try:
+        camino = a_estrella(grafo, peso, i_origen, i_destino, heuristica=heuristica)
+    except ValueError:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    return grafo.camino_original(camino)
+
+
+if __name__ == "__main__":
+    # Preproceso de los hitos del callejero de Madrid para los tres modos de ruta del GPS
+    import callejero as c
+    import gps
+    from grafo_compilado import compila_grafo
+
+    modos = list(gps.FACTORES_HEURISTICA)
+    digrafo = c.procesa_grafo(c.carga_grafo())
+    grafo = compila_grafo(digrafo, modos)
+    for modo, indice in hitos_modos(grafo, modos, "hitos").items():
+        print(f"{modo.__name__}: {len(indice.hitos)} hitos, {indice.desde.nbytes + indice.hasta.nbytes} bytes")
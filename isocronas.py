@@ -0,0 +1,259 @@
+"""
+isocronas.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Isocronas (zonas alcanzables en un tiempo o una distancia máxima) sobre un grafo compilado, para
+planificar áreas de servicio. Se calcula un Dijkstra acotado, que se detiene al superar el umbral
+más alto, desde uno o varios orígenes a la vez (por ejemplo todos los almacenes de una flota), y
+con las distancias de cada vértice se construye un polígono para cada umbral: la envolvente
+cóncava de los puntos alcanzados o la unión de las celdas de una rejilla que contienen alguno.
+
+Los puntos alcanzados son los vértices y puntos a lo largo de las aristas, incluida la parte de
+las aristas que se recorre antes de agotar el umbral.
+"""
+
+from typing import List, Dict, Tuple, Callable, Union, Iterable
+import heapq
+import numpy as np
+import shapely
+
+from grafo_compilado import GrafoCompilado, distancia_haversine, RADIO_TIERRA
+from grafo_pesado import INFTY
+
+TAMANO_CELDA = 100  # Lado en metros de las celdas de la rejilla
+PASO_PUNTOS = 50  # Metros como máximo entre dos puntos alcanzados consecutivos de una arista
+CONCAVIDAD = 0.3  # Parámetro ratio de shapely.concave_hull: 0 es lo más cóncavo y 1 la envolvente convexa
+FORMAS = ('concava', 'rejilla')
+
+
+def distancias_acotadas(grafo: GrafoCompilado, peso: Union[str, Callable], origenes: Iterable[int], limite: float,
+                        estadisticas: Dict[str, int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Calcula la distancia a todos los vértices que están a lo sumo a una distancia límite del
+    más cercano de varios orígenes, con un algoritmo de Dijkstra que empieza con todos los
+    orígenes a distancia 0 y se detiene al superar el límite.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        origenes (Iterable[int]): posiciones de los vértices de origen
+        limite (float): distancia máxima, en las unidades del modo (metros o segundos)
+        estadisticas (Dict[str,int], opcional): diccionario en el que guardar el número de
+            vértices fijados ('nodos_asentados')
+    Returns:
+        Tuple[np.ndarray,np.ndarray]: distancia de cada vértice al origen más cercano (np.inf si
+            supera el límite) y posición en origenes de ese origen (-1 si supera el límite)
+    """
+    indptr, indices, pesos = grafo.listas(peso)
+    n = grafo.n
+    d = [INFTY] * n
+    fuente = [-1] * n
+    visitado = [False] * n
+    Q = []
+    for i, origen in enumerate(origenes):
+        if fuente[origen] < 0:
+            d[origen] = 0
+            fuente[origen] = i
+            Q.append((0, origen))
+    heapq.heapify(Q)
+    asentados = 0
+    while Q:
+        dist_v, v = heapq.heappop(Q)
+        if visitado[v]:
+            continue
+        visitado[v] = True
+        asentados += 1
+        f = fuente[v]
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            dist_x = dist_v + pesos[k]
+            # Los vértices más allá del límite no se llegan a meter en la cola
+            if dist_x < d[x] and dist_x <= limite:
+                d[x] = dist_x
+                fuente[x] = f
+                heapq.heappush(Q, (dist_x, x))
+    if estadisticas is not None:
+        estadisticas['nodos_asentados'] = asentados
+    distancias = np.array(d, dtype=np.float64)
+    distancias[distancias >= INFTY] = np.inf
+    return distancias, np.array(fuente, dtype=np.int32)
+
+
+def puntos_alcanzados(grafo: GrafoCompilado, peso: Union[str, Callable], distancias: np.ndarray, umbral: float,
+                      paso: float = PASO_PUNTOS) -> np.ndarray:
+    """ Devuelve las coordenadas de los puntos de la red alcanzados sin superar un umbral: los
+    vértices y puntos cada paso metros a lo largo de las aristas que salen de ellos, hasta el
+    final de la arista o hasta donde se agota el umbral.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas
+        peso (str o función): modo de ruta con el que se calcularon las distancias
+        distancias (np.ndarray): distancia de cada vértice (np.inf si no se alcanza)
+        umbral (float): distancia máxima
+        paso (float): metros como máximo entre dos puntos de una arista
+    Returns:
+        np.ndarray: array (puntos x 2) con la longitud y la latitud de cada punto
+    """
+    modo = grafo.modo(peso)
+    alcanzados = np.flatnonzero(distancias <= umbral)
+    # Aristas que salen de los vértices alcanzados
+    inicios, finales = grafo.indptr[alcanzados], grafo.indptr[alcanzados + 1]
+    cuantas = finales - inicios
+    aristas = np.repeat(finales - np.cumsum(cuantas), cuantas) + np.arange(cuantas.sum())
+    u = np.repeat(alcanzados, cuantas)
+    v = grafo.indices[aristas]
+    pesos = grafo.pesos[modo][aristas]
+    # Fracción de cada arista que se recorre antes de agotar el umbral
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraccion = np.where(pesos > 0, np.clip((umbral - distancias[u]) / pesos, 0, 1), 1.0)
+    x_u, y_u, x_v, y_v = grafo.x[u], grafo.y[u], grafo.x[v], grafo.y[v]
+    longitud = distancia_haversine(y_u, x_u, y_v, x_v) * fraccion
+    muestras = np.maximum(1, np.ceil(np.nan_to_num(longitud) / paso)).astype(np.int64)
+    arista = np.repeat(np.arange(len(aristas)), muestras)
+    # Posición j/muestras (j = 1..muestras) de cada punto dentro de la parte recorrida de su arista
+    j = np.arange(len(arista)) - np.repeat(np.cumsum(muestras) - muestras, muestras) + 1
+    t = fraccion[arista] * j / muestras[arista]
+    longitudes = np.concatenate([grafo.x[alcanzados], x_u[arista] + (x_v - x_u)[arista] * t])
+    latitudes = np.concatenate([grafo.y[alcanzados], y_u[arista] + (y_v - y_u)[arista] * t])
+    puntos = np.column_stack([longitudes, latitudes])
+    return puntos[np.isfinite(puntos).all(axis=1)]
+
+
+def _celdas_distintas(planos: np.ndarray, tamano: float) -> Tuple[np.ndarray, np.ndarray]:
+    """ Devuelve las celdas (columna y fila) de una rejilla de lado tamano que contienen algún
+    punto y la posición de un punto de cada una. """
+    celdas = np.floor(planos / tamano).astype(np.int64)
+    minimo = celdas.min(axis=0)
+    celdas -= minimo
+    # Una clave entera por celda es mucho más rápida de ordenar que las filas de un array 2D
+    filas = int(celdas[:, 1].max()) + 1
+    _, posiciones = np.unique(celdas[:, 0] * filas + celdas[:, 1], return_index=True)
+    return celdas[posiciones] + minimo, posiciones
+
+
+def poligono(grafo: GrafoCompilado, peso: Union[str, Callable], distancias: np.ndarray, umbral: float,
+             forma: str = 'concava', tamano_celda: float = TAMANO_CELDA, concavidad: float = CONCAVIDAD) -> shapely.Geometry:
+    """ Construye el polígono (en longitud y latitud) de la zona alcanzada sin superar un umbral.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas
+        peso (str o función): modo de ruta con el que se calcularon las distancias
+        distancias (np.ndarray): distancia de cada vértice (np.inf si no se alcanza)
+        umbral (float): distancia máxima
+        forma (str): 'concava' para la envolvente cóncava de los puntos alcanzados o 'rejilla'
+            para la unión de las celdas de la rejilla que contienen algún punto alcanzado
+        tamano_celda (float): lado en metros de las celdas de la rejilla (y margen alrededor
+            de la envolvente cuando los puntos no forman un polígono)
+        concavidad (float): ratio de shapely.concave_hull, entre 0 y 1
+    Returns:
+        shapely.Geometry: polígono o multipolígono de la zona (vacío si no se alcanza nada)
+    Raises:
+        ValueError: Si la forma no es 'concava' ni 'rejilla'
+    """
+    if forma not in FORMAS:
+        raise ValueError(f"Forma de isocrona no soportada: {forma}. Las formas son {', '.join(FORMAS)}.")
+    puntos = puntos_alcanzados(grafo, peso, distancias, umbral, min(PASO_PUNTOS, tamano_celda / 2))
+    if not len(puntos):
+        return shapely.Polygon()
+    # Se trabaja en metros con una proyección equirectangular centrada en los puntos
+    longitud_0, latitud_0 = puntos.mean(axis=0)
+    escala = np.array([np.cos(np.radians(latitud_0)), 1.0]) * np.radians(1) * RADIO_TIERRA
+    planos = (puntos - (longitud_0, latitud_0)) * escala
+    if forma == 'concava':
+        # Basta un punto por cada celda de PASO_PUNTOS metros, lo que reduce mucho los puntos de la envolvente
+        planos = planos[_celdas_distintas(planos, PASO_PUNTOS)[1]]
+        zona = shapely.concave_hull(shapely.multipoints(planos), ratio=concavidad)
+        if not isinstance(zona, (shapely.Polygon, shapely.MultiPolygon)):
+            # Con uno o dos puntos, o todos alineados, la envolvente es un punto o una línea
+            zona = zona.buffer(tamano_celda / 2)
+    else:
+        celdas = _celdas_distintas(planos, tamano_celda)[0] * tamano_celda
+        cajas = shapely.box(celdas[:, 0], celdas[:, 1], celdas[:, 0] + tamano_celda, celdas[:, 1] + tamano_celda)
+        # Las celdas no se solapan, así que su unión se puede hacer como una cobertura, que es mucho más rápida
+        zona = shapely.coverage_union_all(cajas)
+    return shapely.transform(zona, lambda xy: xy / escala + (longitud_0, latitud_0))
+
+
+def isocronas_compilado(grafo: GrafoCompilado, peso: Union[str, Callable], origenes: List[int], umbrales: List[float],
+                        forma: str = 'concava', multiorigen: bool = False) -> List[Dict[str, object]]:
+    """ Calcula las isocronas de varios orígenes, dados como posiciones en el grafo compilado.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas
+        peso (str o función): modo de ruta
+        origenes (List[int]): posiciones de los vértices de origen
+        umbrales (List[float]): distancias máximas, en las unidades del modo (metros o segundos)
+        forma (str): forma de los polígonos, 'concava' o 'rejilla' (ver poligono)
+        multiorigen (bool): si es True se calcula una sola isocrona para todos los orígenes
+            (la zona a la que se llega desde alguno de ellos) y, si es False, una por origen
+    Returns:
+        List[Dict[str,object]]: para cada origen (o una sola si multiorigen es True) un
+            diccionario con los orígenes ('origenes'), la distancia de cada vértice al origen
+            más cercano ('distancias', np.inf si supera el umbral más alto), el origen más
+            cercano a cada vértice como posición en origenes ('fuente') y el polígono de cada
+            umbral ('poligonos', con el umbral como clave)
+    Raises:
+        ValueError: Si algún umbral es negativo o la forma no es válida
+    """
+    umbrales = sorted(float(umbral) for umbral in umbrales)
+    if not umbrales or umbrales[0] < 0:
+        raise ValueError("Los umbrales de las isocronas tienen que ser positivos.")
+    if forma not in FORMAS:
+        raise ValueError(f"Forma de isocrona no soportada: {forma}. Las formas son {', '.join(FORMAS)}.")
+    grupos = [list(origenes)] if multiorigen else [[origen] for origen in origenes]
+    resultados = []
+    for grupo in grupos:
+        distancias, fuente = distancias_acotadas(grafo, peso, grupo, umbrales[-1])
+        resultados.append({'origenes': grupo, 'distancias': distancias, 'fuente': fuente,
+                           'poligonos': {umbral: poligono(grafo, peso, distancias, umbral, forma) for umbral in umbrales}})
+    return resultados
+
+
+def isocronas(grafo: GrafoCompilado, peso: Union[str, Callable], origenes: List[object], umbrales: List[float],
+              forma: str = 'concava', multiorigen: bool = False) -> List[Dict[str, object]]:
+    """ Calcula las isocronas de varios vértices del grafo original.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas
+        peso (str o función): modo de ruta
+        origenes (List[object]): vértices de origen
+        umbrales (List[float]): distancias máximas, en las unidades del modo (metros o segundos)
+        forma (str): forma de los polígonos, 'concava' o 'rejilla'
+        multiorigen (bool): si es True se calcula una sola isocrona para todos los orígenes
+    Returns:
+        List[Dict[str,object]]: lo mismo que isocronas_compilado, con los vértices originales en 'origenes'
+    Raises:
+        ValueError: Si algún origen no es un vértice del grafo, algún umbral es negativo o la
+            forma no es válida
+    Example:
+        zona = isocronas(grafo, 'peso_ruta_mas_rapida', [almacen], [300, 600, 900])[0]['poligonos'][600]
+        es la zona a la que se llega en 10 minutos desde el almacén.
+    """
+    for origen in origenes:
+        if origen not in grafo.indice:
+            raise ValueError(f"El vértice {origen} no está en el grafo.")
+    resultados = isocronas_compilado(grafo, peso, [grafo.indice[origen] for origen in origenes], umbrales,
+                                     forma, multiorigen)
+    for resultado in resultados:
+        resultado['origenes'] = grafo.camino_original(resultado['origenes'])
+    return resultados
+
+
+def a_geojson(resultado: Dict[str, object], propiedades: Dict[str, object] = None) -> Dict[str, object]:
+    """ Convierte los polígonos de una isocrona en una FeatureCollection de GeoJSON, con un
+    elemento por umbral (del más alto al más bajo, para que los más pequeños se dibujen encima).
+
+    Args:
+        resultado (Dict[str,object]): un elemento de la salida de isocronas
+        propiedades (Dict[str,object], opcional): propiedades comunes de todos los elementos
+    Returns:
+        Dict[str,object]: objeto GeoJSON
+    """
+    distancias = resultado['distancias']
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'geometry': shapely.geometry.mapping(zona),
+                          'properties': {**(propiedades or {}), 'umbral': umbral,
+                                         'vertices': int(np.count_nonzero(distancias <= umbral))}}
+                         for umbral, zona in sorted(resultado['poligonos'].items(), reverse=True)]}
@@ -0,0 +1,387 @@
+"""
+jerarquia_contraccion.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Jerarquías de contracción (Contraction Hierarchies) para calcular caminos mínimos en el
+callejero de Madrid. En un preproceso, que se hace una sola vez por modo de ruta, se ordenan
+los vértices por "importancia" y se contraen de menos a más importante: al quitar un vértice v
+se añaden atajos u->w entre sus vecinos cuando el único camino mínimo entre ellos pasa por v.
+
+Después, un camino mínimo se calcula con un Dijkstra bidireccional en el que ambas búsquedas
+solo suben en la jerarquía, por lo que se fijan muy pocos vértices. Los atajos del camino
+resultante se deshacen para devolver los vértices del grafo original.
+"""
+
+from typing import List, Dict, Callable, Union, Tuple
+import heapq
+import os
+import numpy as np
+
+from grafo_compilado import GrafoCompilado
+from grafo_pesado import INFTY, camino_minimo
+
+LIMITE_TESTIGOS = 60  # Máximo de vértices que fija cada búsqueda de caminos testigo durante la contracción
+
+
+class JerarquiaContraccion:
+    """ Jerarquía de contracción de un grafo compilado para un modo de ruta.
+
+    La búsqueda hacia delante usa las aristas u->w con rango[w] > rango[u] (arriba) y la búsqueda
+    hacia atrás las aristas u->w con rango[u] > rango[w], guardadas en w (abajo). Ambas en CSR.
+
+    Attributes:
+        nodos (np.ndarray): identificadores originales de los vértices
+        rango (np.ndarray): posición de cada vértice en el orden de contracción
+        arriba (Tuple[np.ndarray,np.ndarray,np.ndarray]): indptr, indices y pesos de las aristas hacia arriba
+        abajo (Tuple[np.ndarray,np.ndarray,np.ndarray]): indptr, indices y pesos de las aristas hacia
+            abajo, guardadas en su vértice de destino
+        atajos (Tuple[np.ndarray,np.ndarray,np.ndarray]): origen, destino y vértice intermedio de cada atajo
+        version (int): versión de los pesos del grafo (GrafoCompilado.versiones) con la que se
+            contrajo; las jerarquías guardadas en disco son de los pesos de partida (versión 0)
+        huella (str): huella de los pesos con los que se contrajo (GrafoCompilado.huella_pesos),
+            o None si no se conoce
+    """
+
+    def __init__(self, nodos: np.ndarray, rango: np.ndarray, arriba: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                 abajo: Tuple[np.ndarray, np.ndarray, np.ndarray], atajos: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self.nodos = nodos
+        self.indice = {nodo: i for i, nodo in enumerate(nodos.tolist())}
+        self.rango = rango
+        self.arriba = arriba
+        self.abajo = abajo
+        self.atajos = atajos
+        self.version = 0
+        self.huella = None
+        # Listas de Python de los arrays anteriores para las consultas
+        self._listas = None
+
+    @property
+    def n(self) -> int:
+        "Número de vértices del grafo"
+        return len(self.rango)
+
+    def _prepara(self):
+        "Construye las listas usadas por las consultas la primera vez que se necesitan"
+        if self._listas is None:
+            intermedios = {(u, w): v for u, w, v in zip(*(a.tolist() for a in self.atajos))}
+            self._listas = (tuple(a.tolist() for a in self.arriba),
+                            tuple(a.tolist() for a in self.abajo),
+                            intermedios,
+                            self.nodos.tolist())
+        return self._listas
+
+    def camino_compilado(self, origen: int, destino: int, estadisticas: Dict[str, int] = None, desempaquetar: bool = True) -> List[int]:
+        """ Calcula el camino mínimo entre dos vértices, identificados por su posición.
+
+        Args:
+            origen (int): posición del vértice de origen
+            destino (int): posición del vértice de destino
+            estadisticas (Dict[str,int], opcional): diccionario en el que guardar el número de
+                vértices fijados ('nodos_asentados')
+            desempaquetar (bool): si es False se devuelve el camino con los atajos sin deshacer
+        Returns:
+            List[int]: posiciones de los vértices del camino, de origen a destino
+        Raises:
+            ValueError: Si no se puede llegar desde el origen hasta el destino
+        """
+        arriba, abajo, intermedios, _ = self._prepara()
+        adyacencias = (arriba, abajo)
+        # Las búsquedas solo visitan unos pocos vértices, así que guardamos su estado en diccionarios
+        d = ({origen: 0}, {destino: 0})
+        padre = ({origen: -1}, {destino: -1})
+        visitado = (set(), set())
+        Q = ([(0, origen)], [(0, destino)])
+        mejor = INFTY
+        encuentro = -1
+        asentados = 0
+        while Q[0] or Q[1]:
+            # Expandimos la búsqueda con menor distancia en la cola; la que no puede mejorar se descarta
+            for lado in (0, 1):
+                if Q[lado] and Q[lado][0][0] >= mejor:
+                    Q[lado].clear()
+            if not Q[0] and not Q[1]:
+                break
+            lado = 0 if not Q[1] or (Q[0] and Q[0][0][0] <= Q[1][0][0]) else 1
+            dist_v, v = heapq.heappop(Q[lado])
+            if v in visitado[lado]:
+                continue
+            visitado[lado].add(v)
+            asentados += 1
+            d_otro = d[1 - lado]
+            if v in d_otro and dist_v + d_otro[v] < mejor:
+                mejor = dist_v + d_otro[v]
+                encuentro = v
+            indptr, indices, pesos = adyacencias[lado]
+            d_lado, padre_lado = d[lado], padre[lado]
+            for k in range(indptr[v], indptr[v+1]):
+                x = indices[k]
+                dist_x = dist_v + pesos[k]
+                if dist_x < d_lado.get(x, INFTY):
+                    d_lado[x] = dist_x
+                    padre_lado[x] = v
+                    heapq.heappush(Q[lado], (dist_x, x))
+        if estadisticas is not None:
+            estadisticas['nodos_asentados'] = asentados
+        if encuentro < 0:
+            raise ValueError(
+                f"No hay camino posible que vaya de {origen} hasta {destino}.")
+
+        # Camino en el grafo con atajos: origen -> encuentro por la búsqueda hacia delante y
+        # encuentro -> destino por la búsqueda hacia atrás
+        camino_atajos = [encuentro]
+        nodo = encuentro
+        while padre[0][nodo] >= 0:
+            nodo = padre[0][nodo]
+            camino_atajos.append(nodo)
+        camino_atajos.reverse()
+        nodo = encuentro
+        while padre[1][nodo] >= 0:
+            nodo = padre[1][nodo]
+            camino_atajos.append(nodo)
+        if not desempaquetar:
+            return camino_atajos
+
+        # Deshacemos los atajos: el atajo u->w con intermedio v es la concatenación de u->v y v->w
+        camino = [camino_atajos[0]]
+        for u, w in zip(camino_atajos[:-1], camino_atajos[1:]):
+            pila = [(u, w)]
+            while pila:
+                a, b = pila.pop()
+                v = intermedios.get((a, b))
+                if v is None:
+                    camino.append(b)
+                else:
+                    pila.append((v, b))
+                    pila.append((a, v))
+        return camino
+
+
+def contrae_grafo(grafo: GrafoCompilado, peso: Union[str, Callable], limite_testigos: int = LIMITE_TESTIGOS) -> JerarquiaContraccion:
+    """ Construye la jerarquía de contracción de un grafo compilado para un modo de ruta.
+
+    Los vértices se contraen en orden creciente de prioridad, que se recalcula de forma perezosa:
+    diferencia entre los atajos que habría que añadir y las aristas que se eliminan, más el número
+    de vecinos ya contraídos para repartir las contracciones por todo el grafo.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        peso (str o función): modo de ruta
+        limite_testigos (int): máximo de vértices que fija cada búsqueda de caminos alternativos.
+            Un límite menor acelera el preproceso a cambio de añadir atajos innecesarios.
+    Returns:
+        JerarquiaContraccion: jerarquía del grafo en ese modo
+    """
+    modo = grafo.modo(peso)
+    n = grafo.n
+    # Grafo que queda por contraer como diccionarios de sucesores y predecesores con su peso
+    salida = [dict() for _ in range(n)]
+    entrada = [dict() for _ in range(n)]
+    for u, w, p in zip(grafo.origenes().tolist(), grafo.indices.tolist(), grafo.pesos[modo].tolist()):
+        if u != w and p < salida[u].get(w, INFTY):
+            salida[u][w] = p
+            entrada[w][u] = p
+    intermedios = {}
+    contraidos_vecinos = [0] * n
+
+    def distancias_testigo(u: int, excluido: int, maximo: float) -> Dict[int, float]:
+        # Dijkstra local desde u sin pasar por el vértice que se va a contraer
+        d = {u: 0}
+        Q = [(0, u)]
+        fijados = 0
+        while Q and fijados < limite_testigos:
+            dist_v, v = heapq.heappop(Q)
+            if dist_v > d[v]:
+                continue
+            if dist_v > maximo:
+                break
+            fijados += 1
+            for x, p in salida[v].items():
+                if x != excluido and dist_v + p < d.get(x, INFTY):
+                    d[x] = dist_v + p
+                    heapq.heappush(Q, (d[x], x))
+        return d
+
+    def atajos_necesarios(v: int) -> List[Tuple[int, int, float]]:
+        atajos = []
+        for u, p_uv in entrada[v].items():
+            objetivos = {w: p_uv + p_vw for w, p_vw in salida[v].items() if w != u}
+            if not objetivos:
+                continue
+            d = distancias_testigo(u, v, max(objetivos.values()))
+            for w, p in objetivos.items():
+                if d.get(w, INFTY) > p:
+                    atajos.append((u, w, p))
+        return atajos
+
+    def prioridad(v: int) -> int:
+        return len(atajos_necesarios(v)) - len(entrada[v]) - len(salida[v]) + contraidos_vecinos[v]
+
+    Q = [(prioridad(v), v) for v in range(n)]
+    heapq.heapify(Q)
+    rango = np.empty(n, dtype=np.int32)
+    arriba = [[] for _ in range(n)]
+    abajo = [[] for _ in range(n)]
+    siguiente = 0
+    while Q:
+        _, v = heapq.heappop(Q)
+        # Actualización perezosa: si la prioridad ha empeorado y ya no es la mínima, se reinserta
+        p = prioridad(v)
+        if Q and p > Q[0][0]:
+            heapq.heappush(Q, (p, v))
+            continue
+        rango[v] = siguiente
+        siguiente += 1
+        for u, w, p_uw in atajos_necesarios(v):
+            if p_uw < salida[u].get(w, INFTY):
+                salida[u][w] = p_uw
+                entrada[w][u] = p_uw
+                intermedios[(u, w)] = v
+        # Las aristas que quedan en v unen v con vértices que se contraerán después (más importantes)
+        for w, p_vw in salida[v].items():
+            arriba[v].append((w, p_vw))
+            del entrada[w][v]
+            contraidos_vecinos[w] += 1
+        for u, p_uv in entrada[v].items():
+            abajo[v].append((u, p_uv))
+            del salida[u][v]
+            contraidos_vecinos[u] += 1
+        salida[v] = {}
+        entrada[v] = {}
+
+    def csr(listas: List[List[Tuple[int, float]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(lista) for lista in listas])
+        indices = np.array([x for lista in listas for x, _ in lista], dtype=np.int32)
+        pesos = np.array([p for lista in listas for _, p in lista], dtype=np.float64)
+        return indptr, indices, pesos
+
+    atajos = (np.array([u for u, _ in intermedios], dtype=np.int32),
+              np.array([w for _, w in intermedios], dtype=np.int32),
+              np.array(list(intermedios.values()), dtype=np.int32))
+    jerarquia = JerarquiaContraccion(grafo.nodos, rango, csr(arriba), csr(abajo), atajos)
+    jerarquia.version = grafo.versiones.get(modo, 0)
+    jerarquia.huella = grafo.huella_pesos(modo)
+    return jerarquia
+
+
+def guarda_jerarquia(jerarquia: JerarquiaContraccion, fichero: str) -> None:
+    """ Guarda una jerarquía de contracción en un fichero .npz.
+
+    Args:
+        jerarquia (JerarquiaContraccion): jerarquía a guardar
+        fichero (str): ruta del fichero
+    Returns: None
+    """
+    np.savez(fichero, nodos=jerarquia.nodos, rango=jerarquia.rango,
+             arriba_indptr=jerarquia.arriba[0], arriba_indices=jerarquia.arriba[1], arriba_pesos=jerarquia.arriba[2],
+             abajo_indptr=jerarquia.abajo[0], abajo_indices=jerarquia.abajo[1], abajo_pesos=jerarquia.abajo[2],
+             atajos_origen=jerarquia.atajos[0], atajos_destino=jerarquia.atajos[1], atajos_intermedio=jerarquia.atajos[2],
+             huella=np.array(jerarquia.huella or ""))
+
+
+def carga_jerarquia(fichero: str) -> JerarquiaContraccion:
+    """ Carga una jerarquía de contracción guardada con guarda_jerarquia.
+
+    Args:
+        fichero (str): ruta del fichero
+    Returns:
+        JerarquiaContraccion: jerarquía guardada en el fichero
+    Raises:
+        FileNotFoundError: Si el fichero no existe
+    """
+    with np.load(fichero) as datos:
+        jerarquia = JerarquiaContraccion(
+            datos['nodos'], datos['rango'],
+            (datos['arriba_indptr'], datos['arriba_indices'], datos['arriba_pesos']),
+            (datos['abajo_indptr'], datos['abajo_indices'], datos['abajo_pesos']),
+            (datos['atajos_origen'], datos['atajos_destino'], datos['atajos_intermedio']))
+        # Los ficheros anteriores a la huella de los pesos no la tienen
+        jerarquia.huella = (str(datos['huella']) or None) if 'huella' in datos.files else None
+    return jerarquia
+
+
+def jerarquias_modos(grafo: GrafoCompilado, modos: List[Union[str, Callable]], directorio: str) -> Dict[object, JerarquiaContraccion]:
+    """ Devuelve la jerarquía de contracción de cada modo de ruta, cargándola del directorio si ya
+    se preprocesó y contrayendo el grafo y guardándola en caso contrario.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        modos (List[str o función]): modos de ruta
+        directorio (str): directorio en el que se guardan las jerarquías
+    Returns:
+        Dict[object,JerarquiaContraccion]: jerarquía de cada modo, con el modo como clave
+    """
+    os.makedirs(directorio, exist_ok=True)
+    jerarquias = {}
+    for peso in modos:
+        nombre = peso if isinstance(peso, str) else peso.__name__
+        fichero = os.path.join(directorio, f"jerarquia_{nombre}.npz")
+        if os.path.exists(fichero):
+            jerarquia = carga_jerarquia(fichero)
+            # Si el grafo o sus pesos han cambiado desde el preproceso hay que contraerlo de nuevo
+            if len(jerarquia.nodos) != grafo.n or not np.array_equal(jerarquia.nodos, grafo.nodos) \
+                    or jerarquia.huella != grafo.huella_pesos(peso):
+                jerarquia = None
+        else:
+            jerarquia = None
+        if jerarquia is None:
+            jerarquia = contrae_grafo(grafo, peso)
+            guarda_jerarquia(jerarquia, fichero)
+        jerarquias[peso] = jerarquia
+    return jerarquias
+
+
+def camino_minimo_jerarquia(jerarquia: JerarquiaContraccion, origen: object, destino: object, grafo: GrafoCompilado = None, peso: Union[str, Callable] = None) -> List[object]:
+    """ Calcula el camino mínimo desde el vértice origen hasta el vértice destino con una jerarquía
+    de contracción. Devuelve los mismos vértices que camino_minimo (salvo empates entre caminos
+    de igual peso).
+
+    Los atajos de la jerarquía llevan los pesos con los que se contrajo el grafo. Si se dan el
+    grafo y el modo y sus pesos son distintos de esos (GrafoCompilado.actualiza_pesos), la
+    jerarquía no sirve y el camino se calcula con el Dijkstra bidireccional sobre el grafo, con
+    su coste, mientras duren las actualizaciones; en cuanto los pesos vuelven a ser los de
+    partida (restablece_pesos, abre_aristas) se usa de nuevo la jerarquía. Los pesos se comparan
+    por su versión y, si ha cambiado, por su huella (GrafoCompilado.huella_pesos).
+
+    Args:
+        jerarquia (JerarquiaContraccion): jerarquía del grafo en el modo de ruta deseado
+        origen (object): vértice del grafo de origen
+        destino (object): vértice del grafo de destino
+        grafo (GrafoCompilado, opcional): grafo compilado del que se obtuvo la jerarquía
+        peso (str o función, opcional): modo de ruta de la jerarquía
+    Returns:
+        List[object]: lista con los vértices del grafo por los que pasa el camino más corto
+            entre el origen y el destino.
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    if grafo is not None:
+        modo = grafo.modo(peso)
+        if grafo.versiones.get(modo, 0) != jerarquia.version and grafo.huella_pesos(modo) != jerarquia.huella:
+            return camino_minimo(grafo, peso, origen, destino, bidireccional=True)
+    if origen not in jerarquia.indice or destino not in jerarquia.indice:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    try:
+        camino = jerarquia.camino_compilado(jerarquia.indice[origen], jerarquia.indice[destino])
+    except ValueError:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    nodos = jerarquia._prepara()[3]
+    return [nodos[i] for i in camino]
+
+
+if __name__ == "__main__":
+    # Preproceso de las jerarquías del callejero de Madrid para los tres modos de ruta del GPS
+    import callejero as c
+    import gps
+    from grafo_compilado import compila_grafo
+
+    modos = list(gps.FACTORES_HEURISTICA)
+    digrafo = c.procesa_grafo(c.carga_grafo())
+    grafo = compila_grafo(digrafo, modos)
+    for modo, jerarquia in jerarquias_modos(grafo, modos, "jerarquias").items():
+        print(f"{modo.__name__}: {len(jerarquia.atajos[0])} atajos")
@@ -0,0 +1,196 @@
+"""
+mapa.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Dibujo rápido de rutas sobre el mapa de calles, sin interfaz gráfica. La red de calles, que es
+lo costoso de dibujar, se pinta una sola vez con un LineCollection y se guarda como una imagen
+(en memoria y, si el grafo se cargó de la caché, también en disco junto a él). Para cada ruta
+solo se dibujan sus aristas y sus extremos sobre esa imagen (restaurando la imagen en el lienzo
+y dibujando encima solo la ruta) y se devuelve un PNG o un SVG.
+"""
+
+from typing import List, Tuple
+import base64
+import io
+import os
+import threading
+
+import numpy as np
+import matplotlib.image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from PIL import Image
+
+from grafo_compilado import GrafoCompilado
+import metricas
+
+ANCHO_MAPA = 1000  # Ancho en píxeles de las imágenes
+COMPRESION_PNG = 1  # Nivel de compresión de los PNG de las rutas (0-9): más bajo es más rápido y ocupa más
+MARGEN = 0.01  # Margen alrededor de la red de calles, como fracción de su tamaño
+
+
+class MapaBase:
+    """ Mapa de la red de calles de un grafo compilado, dibujado una sola vez, sobre el que se
+    superponen las rutas.
+
+    Attributes:
+        grafo (GrafoCompilado): grafo con las coordenadas de los vértices
+        ancho (int): ancho de las imágenes en píxeles
+        alto (int): alto de las imágenes en píxeles (proporcional al tamaño del mapa)
+        limites (Tuple[float,float,float,float]): longitud y latitud mínimas y máximas del mapa
+        fondo (np.ndarray): imagen RGBA de la red de calles
+    """
+
+    def __init__(self, grafo: GrafoCompilado, ancho: int = ANCHO_MAPA):
+        self.grafo = grafo
+        self.ancho = ancho
+        validos = np.isfinite(grafo.x) & np.isfinite(grafo.y)
+        x_min, x_max = float(grafo.x[validos].min()), float(grafo.x[validos].max())
+        y_min, y_max = float(grafo.y[validos].min()), float(grafo.y[validos].max())
+        margen_x, margen_y = (x_max - x_min) * MARGEN, (y_max - y_min) * MARGEN
+        self.limites = (x_min - margen_x, x_max + margen_x, y_min - margen_y, y_max + margen_y)
+        # Un grado de longitud mide cos(latitud) veces lo que un grado de latitud
+        escala = np.cos(np.radians((y_min + y_max) / 2))
+        proporcion = (self.limites[3] - self.limites[2]) / ((self.limites[1] - self.limites[0]) * escala)
+        self.alto = max(1, int(round(ancho * proporcion)))
+        self._cerrojo = threading.Lock()
+        self.fondo = self._carga_fondo()
+        self._figura, self._ejes = self._figura_vacia()
+        self._ejes.imshow(self.fondo, extent=self.limites, origin='upper', interpolation='nearest', aspect='auto')
+        # La ruta y sus extremos no forman parte del fondo: se dibujan aparte sobre él en cada imagen
+        self._ruta, = self._ejes.plot([], [], color='black', linewidth=2.5, solid_capstyle='round', animated=True)
+        self._extremos, = self._ejes.plot([], [], linestyle='none', marker='o', markersize=6,
+                                          color='darkblue', animated=True)
+        self._figura.canvas.draw()
+        self._lienzo = self._figura.canvas.copy_from_bbox(self._figura.bbox)
+        # PNG del fondo codificado en base64 para los SVG, que se calcula la primera vez que se pide
+        self._fondo_svg = None
+
+    def _figura_vacia(self) -> Tuple[Figure, object]:
+        """ Crea una figura del tamaño del mapa con unos ejes que la ocupan entera y sin marcos. """
+        figura = Figure(figsize=(self.ancho / 100, self.alto / 100), dpi=100)
+        FigureCanvasAgg(figura)
+        ejes = figura.add_axes((0, 0, 1, 1))
+        ejes.set_axis_off()
+        ejes.set_xlim(self.limites[0], self.limites[1])
+        ejes.set_ylim(self.limites[2], self.limites[3])
+        return figura, ejes
+
+    def _carga_fondo(self) -> np.ndarray:
+        """ Devuelve la imagen de la red de calles, leyéndola del directorio del grafo si ya se
+        dibujó y dibujándola (y guardándola allí) en caso contrario. """
+        fichero = None
+        if self.grafo.directorio is not None:
+            fichero = os.path.join(self.grafo.directorio, f"mapa_{self.ancho}x{self.alto}.png")
+            if os.path.exists(fichero):
+                return matplotlib.image.imread(fichero)
+        fondo = self.dibuja_calles()
+        if fichero is not None:
+            temporal = f"{fichero}.{os.getpid()}.tmp.png"
+            matplotlib.image.imsave(temporal, fondo)
+            os.replace(temporal, fichero)
+        return fondo
+
+    def dibuja_calles(self) -> np.ndarray:
+        """ Dibuja todas las calles del grafo en una imagen RGBA.
+
+        Las aristas de ida y vuelta entre los mismos vértices se dibujan una sola vez.
+
+        Returns:
+            np.ndarray: imagen (alto x ancho x 4) con la red de calles
+        """
+        grafo = self.grafo
+        origenes = grafo.origenes()
+        destinos = grafo.indices.astype(np.int64)
+        clave = np.minimum(origenes, destinos) * grafo.n + np.maximum(origenes, destinos)
+        _, unicas = np.unique(clave, return_index=True)
+        origenes, destinos = origenes[unicas], destinos[unicas]
+        segmentos = np.stack([np.column_stack([grafo.x[origenes], grafo.y[origenes]]),
+                              np.column_stack([grafo.x[destinos], grafo.y[destinos]])], axis=1)
+        figura, ejes = self._figura_vacia()
+        figura.patch.set_facecolor('white')
+        ejes.add_collection(LineCollection(segmentos, colors='lightgray', linewidths=0.5, alpha=0.7))
+        figura.canvas.draw()
+        return np.asarray(figura.canvas.buffer_rgba()).copy()
+
+    @metricas.instrumenta()
+    def dibuja_ruta(self, camino: List[int], formato: str = 'png') -> bytes:
+        """ Dibuja una ruta sobre el mapa de calles.
+
+        Args:
+            camino (List[int]): posiciones en el grafo de los vértices de la ruta
+            formato (str): 'png' o 'svg'
+        Returns:
+            bytes: imagen en el formato pedido
+        Raises:
+            ValueError: Si el formato no es png ni svg
+        """
+        camino = np.asarray(camino, dtype=np.int64)
+        x, y = self.grafo.x[camino], self.grafo.y[camino]
+        if formato == 'svg':
+            return self._svg(x, y)
+        if formato != 'png':
+            raise ValueError(f"Formato de imagen no soportado: {formato}.")
+        extremos = [0, -1] if len(camino) else []
+        # El lienzo se reutiliza entre rutas, así que solo se dibuja una a la vez
+        with self._cerrojo:
+            lienzo = self._figura.canvas
+            lienzo.restore_region(self._lienzo)
+            self._ruta.set_data(x, y)
+            self._extremos.set_data(x[extremos], y[extremos])
+            self._ejes.draw_artist(self._ruta)
+            self._ejes.draw_artist(self._extremos)
+            imagen = np.array(lienzo.buffer_rgba())[:, :, :3]
+        salida = io.BytesIO()
+        Image.fromarray(imagen).save(salida, format='png', compress_level=COMPRESION_PNG)
+        return salida.getvalue()
+
+    def _svg(self, x: np.ndarray, y: np.ndarray) -> bytes:
+        """ Construye un SVG con el fondo como imagen incrustada y la ruta como polilínea. """
+        if self._fondo_svg is None:
+            salida = io.BytesIO()
+            Image.fromarray((np.asarray(self.fondo) * 255).astype(np.uint8) if self.fondo.dtype != np.uint8
+                            else self.fondo).save(salida, format='png')
+            self._fondo_svg = base64.b64encode(salida.getvalue()).decode('ascii')
+        x_min, x_max, y_min, y_max = self.limites
+        px = (x - x_min) / (x_max - x_min) * self.ancho
+        py = (y_max - y) / (y_max - y_min) * self.alto
+        puntos = " ".join(f"{a:.1f},{b:.1f}" for a, b in zip(px.tolist(), py.tolist()))
+        extremos = "".join(f'<circle cx="{px[i]:.1f}" cy="{py[i]:.1f}" r="4" fill="darkblue"/>'
+                           for i in ([0, -1] if len(px) else []))
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.ancho}" height="{self.alto}" '
+                f'viewBox="0 0 {self.ancho} {self.alto}">'
+                f'<image width="{self.ancho}" height="{self.alto}" href="data:image/png;base64,{self._fondo_svg}"/>'
+                f'<polyline points="{puntos}" fill="none" stroke="black" stroke-width="2.5" '
+                f'stroke-linecap="round" stroke-linejoin="round"/>{extremos}</svg>').encode('utf-8')
+
+    def guarda_ruta(self, camino: List[int], fichero: str) -> None:
+        """ Dibuja una ruta sobre el mapa de calles y la guarda en un fichero .png o .svg.
+
+        Args:
+            camino (List[int]): posiciones en el grafo de los vértices de la ruta
+            fichero (str): ruta del fichero; su extensión indica el formato
+        Returns: None
+        """
+        formato = os.path.splitext(fichero)[1].lstrip('.').lower()
+        datos = self.dibuja_ruta(camino, formato)
+        with open(fichero, 'wb') as f:
+            f.write(datos)
+
+
+def dibuja_camino(mapa: MapaBase, camino: List[object], formato: str = 'png') -> bytes:
+    """ Dibuja sobre un mapa una ruta dada con los vértices del grafo original.
+
+    Args:
+        mapa (MapaBase): mapa de la red de calles
+        camino (List[object]): vértices del grafo original de la ruta
+        formato (str): 'png' o 'svg'
+    Returns:
+        bytes: imagen en el formato pedido
+    """
+    indice = mapa.grafo.indice
+    return mapa.dibuja_ruta([indice[nodo] for nodo in camino], formato)
@@ -0,0 +1,385 @@
+"""
+metricas.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Instrumentación ligera de las etapas del GPS (carga del callejero, búsqueda de direcciones,
+asignación de vértices, búsqueda de caminos, instrucciones y dibujo): tiempos por etapa,
+contadores (vértices fijados, extracciones e inserciones en la cola de prioridad, aristas
+relajadas, aciertos de la caché de rutas...), una línea de registro estructurada (JSON) por
+petición y, opcionalmente, el perfil de cProfile de las peticiones.
+
+Está desactivada por defecto: cada punto instrumentado solo comprueba una variable global y no
+mide nada. Se activa con activa() o con la variable de entorno GPS_METRICAS ("1" para las
+métricas y "perfil" para añadir además cProfile). Los resultados acumulados se consultan con
+instantanea() y perfil(), y las líneas de cada petición se escriben en el registro
+"gps.metricas" del módulo logging (en la salida de errores si no se configura otra cosa).
+
+Uso:
+    import metricas
+    metricas.activa()
+    with metricas.peticion('ruta', origen=origen):
+        with metricas.etapa('busqueda'):
+            ...
+        metricas.cuenta('aciertos')
+    metricas.instantanea()
+"""
+
+from typing import Callable, Dict
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+registro = logging.getLogger('gps.metricas')
+
+_activas = False
+_perfilar = False
+_cerrojo = threading.Lock()
+# Acumulados de cada etapa y de cada tipo de petición: [llamadas, segundos totales, segundos máximos]
+_etapas: Dict[str, list] = {}
+_peticiones: Dict[str, list] = {}
+_contadores: Dict[str, int] = {}
+# Perfil acumulado de las peticiones perfiladas y si hay alguna perfilándose (cProfile no admite dos a la vez)
+_perfil = None
+_perfilando = False
+# Datos de la petición en curso en el hilo o tarea de asyncio actual
+_peticion_actual = contextvars.ContextVar('peticion_actual', default=None)
+
+
+def activa(perfilar: bool = False) -> None:
+    """ Activa la instrumentación.
+
+    Args:
+        perfilar (bool): si es True cada petición se ejecuta además con cProfile (salvo si ya se
+            está perfilando otra) y su perfil se acumula en el que devuelve perfil()
+    Returns: None
+    """
+    global _activas, _perfilar
+    if not registro.handlers and not logging.getLogger().handlers:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter('%(message)s'))
+        registro.addHandler(manejador)
+        registro.setLevel(logging.INFO)
+    _perfilar = perfilar
+    _activas = True
+
+
+def desactiva() -> None:
+    """ Desactiva la instrumentación (los resultados acumulados se conservan).
+
+    Returns: None
+    """
+    global _activas, _perfilar
+    _activas = _perfilar = False
+
+
+def activas() -> bool:
+    """ Indica si la instrumentación está activada. """
+    return _activas
+
+
+def reinicia() -> None:
+    """ Borra los tiempos, contadores y perfil acumulados.
+
+    Returns: None
+    """
+    global _perfil
+    with _cerrojo:
+        _etapas.clear()
+        _peticiones.clear()
+        _contadores.clear()
+        _perfil = None
+
+
+def _acumula(acumulados: Dict[str, list], nombre: str, segundos: float) -> None:
+    """ Suma una medida a los acumulados de un nombre (con el cerrojo ya tomado). """
+    acumulado = acumulados.get(nombre)
+    if acumulado is None:
+        acumulados[nombre] = [1, segundos, segundos]
+    else:
+        acumulado[0] += 1
+        acumulado[1] += segundos
+        if segundos > acumulado[2]:
+            acumulado[2] = segundos
+
+
+def anota_etapa(nombre: str, segundos: float) -> None:
+    """ Anota el tiempo de una etapa, en los acumulados y en la petición en curso.
+
+    Args:
+        nombre (str): nombre de la etapa
+        segundos (float): duración
+    Returns: None
+    """
+    with _cerrojo:
+        _acumula(_etapas, nombre, segundos)
+    datos = _peticion_actual.get()
+    if datos is not None:
+        datos['etapas'][nombre] = datos['etapas'].get(nombre, 0.0) + segundos
+
+
+def cuenta(nombre: str, cantidad: int = 1) -> None:
+    """ Suma una cantidad a un contador, en los acumulados y en la petición en curso. No hace
+    nada si la instrumentación está desactivada.
+
+    Args:
+        nombre (str): nombre del contador
+        cantidad (int): cantidad que se suma
+    Returns: None
+    """
+    if not _activas:
+        return
+    with _cerrojo:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+    datos = _peticion_actual.get()
+    if datos is not None:
+        datos['contadores'][nombre] = datos['contadores'].get(nombre, 0) + cantidad
+
+
+def suma(estadisticas: Dict[str, int]) -> None:
+    """ Suma a los contadores las estadísticas de una búsqueda (por ejemplo 'nodos_asentados').
+
+    Args:
+        estadisticas (Dict[str,int]): estadísticas de una de las búsquedas de grafo_pesado
+    Returns: None
+    """
+    for nombre, cantidad in estadisticas.items():
+        cuenta(nombre, cantidad)
+
+
+def anota(**campos) -> None:
+    """ Añade campos (por ejemplo el código de respuesta) a la línea de registro de la petición en curso.
+
+    Returns: None
+    """
+    datos = _peticion_actual.get()
+    if datos is not None:
+        datos.update(campos)
+
+
+class _Nula:
+    """ Etapa o petición que no mide nada, para cuando la instrumentación está desactivada. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+
+_NULA = _Nula()
+
+
+class _Etapa:
+    """ Mide el tiempo de un bloque with y lo anota como una etapa. """
+    __slots__ = ('nombre', 'inicio')
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *error):
+        anota_etapa(self.nombre, time.perf_counter() - self.inicio)
+        return False
+
+
+def etapa(nombre: str):
+    """ Devuelve un gestor de contexto que mide el tiempo de su bloque como la etapa nombre.
+
+    Args:
+        nombre (str): nombre de la etapa
+    Returns:
+        gestor de contexto para usar con with
+    Example:
+        with metricas.etapa('busca_direccion'):
+            coordenadas = c.busca_direccion(direccion, callejero)
+    """
+    return _Etapa(nombre) if _activas else _NULA
+
+
+class _Peticion:
+    """ Recoge las etapas y contadores de una petición y escribe su línea de registro al terminar. """
+
+    def __init__(self, nombre: str, campos: Dict[str, object]):
+        self.datos = {'peticion': nombre, **campos, 'etapas': {}, 'contadores': {}}
+
+    def __enter__(self):
+        global _perfilando
+        self.perfilador = None
+        if _perfilar:
+            with _cerrojo:
+                if not _perfilando:
+                    _perfilando = True
+                    self.perfilador = cProfile.Profile()
+        self.testigo = _peticion_actual.set(self.datos)
+        self.inicio = time.perf_counter()
+        if self.perfilador is not None:
+            self.perfilador.enable()
+        return self.datos
+
+    def __exit__(self, tipo, error, traza):
+        global _perfil, _perfilando
+        segundos = time.perf_counter() - self.inicio
+        if self.perfilador is not None:
+            self.perfilador.disable()
+        _peticion_actual.reset(self.testigo)
+        datos = self.datos
+        with _cerrojo:
+            _acumula(_peticiones, datos['peticion'], segundos)
+            if self.perfilador is not None:
+                if _perfil is None:
+                    _perfil = pstats.Stats(self.perfilador)
+                else:
+                    _perfil.add(self.perfilador)
+                _perfilando = False
+        datos['duracion_ms'] = round(segundos * 1000, 3)
+        datos['etapas'] = {nombre: round(tiempo * 1000, 3) for nombre, tiempo in datos['etapas'].items()}
+        if tipo is not None:
+            datos['error'] = tipo.__name__
+        registro.info(json.dumps(datos, ensure_ascii=False, default=str))
+        return False
+
+
+def peticion(nombre: str, **campos):
+    """ Devuelve un gestor de contexto que agrupa las etapas y contadores de una petición.
+
+    Las etapas y contadores anotados dentro del bloque (en el mismo hilo o tarea de asyncio, o
+    en funciones ejecutadas con propaga) se suman a la petición, y al terminar se escribe en
+    el registro "gps.metricas" una línea JSON con el nombre, los campos dados, la duración en
+    milisegundos, los milisegundos de cada etapa y los contadores.
+
+    Args:
+        nombre (str): tipo de petición (por ejemplo la ruta HTTP)
+        **campos: datos que se añaden a la línea de registro
+    Returns:
+        gestor de contexto para usar con with
+    """
+    return _Peticion(nombre, campos) if _activas else _NULA
+
+
+def propaga(funcion: Callable) -> Callable:
+    """ Devuelve una función que ejecuta funcion dentro de la petición en curso, para pasarla a
+    un ThreadPoolExecutor (run_in_executor no propaga las variables de contexto). No sirve con
+    procesos, que no comparten la petición.
+
+    Args:
+        funcion (función): función que se ejecuta en otro hilo
+    Returns:
+        función con los mismos argumentos
+    """
+    if not _activas:
+        return funcion
+    return functools.partial(contextvars.copy_context().run, funcion)
+
+
+def instrumenta(nombre: str = None) -> Callable[[Callable], Callable]:
+    """ Decorador que mide cada llamada a una función como una etapa. Si la función tiene un
+    parámetro estadisticas (como las búsquedas de grafo_pesado) y no se le da, se le pasa un
+    diccionario, y sus valores se suman a los contadores.
+
+    Con la instrumentación desactivada la función se llama directamente.
+
+    Args:
+        nombre (str, opcional): nombre de la etapa (por defecto, el de la función)
+    Returns:
+        decorador
+    """
+    def decorador(funcion: Callable) -> Callable:
+        nombre_etapa = nombre or funcion.__name__
+        parametros = list(inspect.signature(funcion).parameters)
+        posicion = parametros.index('estadisticas') if 'estadisticas' in parametros else None
+
+        @functools.wraps(funcion)
+        def instrumentada(*args, **kwargs):
+            if not _activas:
+                return funcion(*args, **kwargs)
+            estadisticas = None
+            if posicion is not None:
+                if len(args) > posicion:
+                    if args[posicion] is None:
+                        args = args[:posicion] + ({},) + args[posicion+1:]
+                    estadisticas = args[posicion]
+                else:
+                    if kwargs.get('estadisticas') is None:
+                        kwargs['estadisticas'] = {}
+                    estadisticas = kwargs['estadisticas']
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                anota_etapa(nombre_etapa, time.perf_counter() - inicio)
+                if estadisticas:
+                    suma(estadisticas)
+        return instrumentada
+    return decorador
+
+
+def _resumen(acumulados: Dict[str, list]) -> Dict[str, Dict[str, float]]:
+    """ Llamadas, milisegundos totales, medios y máximos de cada nombre. """
+    return {nombre: {'llamadas': llamadas, 'total_ms': total * 1000, 'media_ms': total / llamadas * 1000,
+                     'max_ms': maximo * 1000}
+            for nombre, (llamadas, total, maximo) in acumulados.items()}
+
+
+def instantanea() -> Dict[str, object]:
+    """ Devuelve los resultados acumulados desde el arranque o desde reinicia().
+
+    Returns:
+        Dict[str,object]: si está activada ('activas'), resumen de cada etapa ('etapas') y de
+            cada tipo de petición ('peticiones') con sus llamadas y milisegundos totales, medios
+            y máximos, y valor de cada contador ('contadores')
+    """
+    with _cerrojo:
+        return {'activas': _activas, 'etapas': _resumen(_etapas), 'peticiones': _resumen(_peticiones),
+                'contadores': dict(_contadores)}
+
+
+def perfil(lineas: int = 30, orden: str = 'cumulative') -> str:
+    """ Devuelve el perfil acumulado de las peticiones perfiladas como texto de pstats.
+
+    Args:
+        lineas (int): funciones que se muestran
+        orden (str): criterio de ordenación de pstats
+    Returns:
+        str: perfil, o una cadena vacía si no se ha perfilado ninguna petición
+    """
+    with _cerrojo:
+        if _perfil is None:
+            return ""
+        salida = io.StringIO()
+        _perfil.stream = salida
+        _perfil.sort_stats(orden).print_stats(lineas)
+    return salida.getvalue()
+
+
+def guarda_perfil(fichero: str) -> None:
+    """ Guarda el perfil acumulado en un fichero de pstats (para snakeviz o pstats.Stats).
+
+    Args:
+        fichero (str): ruta del fichero
+    Returns: None
+    Raises:
+        ValueError: Si no se ha perfilado ninguna petición
+    """
+    with _cerrojo:
+        if _perfil is None:
+            raise ValueError("No se ha perfilado ninguna petición.")
+        _perfil.dump_stats(fichero)
+
+
+if os.environ.get('GPS_METRICAS', '') not in ('', '0'):
+    activa(perfilar=os.environ['GPS_METRICAS'] == 'perfil')
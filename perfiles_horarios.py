@@ -0,0 +1,384 @@
+"""
+perfiles_horarios.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Modo de ruta dependiente de la hora de salida. El tiempo de recorrido de cada arista es su
+tiempo sin tráfico (el de peso_ruta_mas_rapida) multiplicado por un factor que varía a lo largo
+del día, y al llegar a un cruce se espera un tiempo que también depende de la hora (en lugar de
+los 0.8*30 segundos fijos de peso_ruta_mas_rapida_semaforos).
+
+Los factores y los retrasos son funciones lineales a trozos de la hora, muestreadas cada
+PASO_PERFIL segundos. Hay muy pocos perfiles distintos (uno por tipo de vía y otro para los
+cruces con semáforo), que se guardan en una tabla, y cada arista y cada vértice solo guarda el
+número de su perfil en un byte.
+
+Las rutas se calculan con una versión de Dijkstra / A* en la que la "distancia" de cada vértice
+es la hora de llegada a él, y el peso de cada arista se evalúa a la hora a la que se sale por ella.
+El resultado es la ruta más rápida siempre que salir más tarde nunca haga llegar antes (propiedad
+FIFO), lo que se cumple si los perfiles no cambian bruscamente.
+"""
+
+from typing import List, Dict, Tuple, Union, Sequence
+import datetime
+import heapq
+import math
+import numpy as np
+
+from grafo_compilado import GrafoCompilado, RADIO_TIERRA
+from grafo_pesado import INFTY, reconstruye_camino
+
+SEGUNDOS_DIA = 24 * 3600
+PASO_PERFIL = 900  # Segundos entre dos muestras consecutivas de un perfil (15 minutos)
+MODO_BASE = 'peso_ruta_mas_rapida'  # Modo con el tiempo de recorrido de cada arista sin tráfico
+
+# Factor del tiempo de recorrido a lo largo del día de cada tipo de vía, como puntos (hora, factor)
+# que se interpolan linealmente. Los tipos se asignan por la velocidad máxima de la arista
+PERFILES_ARISTAS = {
+    'local': [(0, 0.95), (7, 0.95), (8, 1.25), (9.5, 1.05), (13.5, 1.15), (15, 1.05), (18, 1.3), (20, 1.05), (23, 0.95)],
+    'colectora': [(0, 0.95), (7, 0.95), (8, 1.4), (9.5, 1.1), (13.5, 1.2), (15, 1.1), (18, 1.45), (20.5, 1.1), (23, 0.95)],
+    'arterial': [(0, 0.9), (6.5, 0.9), (8, 1.7), (10, 1.2), (14, 1.3), (16, 1.15), (18.5, 1.6), (21, 1.1), (23, 0.9)],
+    'autovia': [(0, 0.85), (6, 0.85), (8, 2.2), (10, 1.3), (14, 1.2), (17, 1.4), (19, 1.9), (21, 1.1), (23, 0.85)],
+}
+VELOCIDADES_PERFILES = [(70, 'autovia'), (50, 'arterial'), (40, 'colectora'), (0, 'local')]  # Velocidad mínima (km/h) de cada tipo
+
+# Segundos de espera a lo largo del día al llegar a un cruce (vértice con más de dos calles). El
+# primer perfil, sin espera, es el de los vértices que no son cruces
+PERFILES_CRUCES = {
+    'sin_cruce': [(0, 0.0)],
+    'semaforo': [(0, 9.0), (6.5, 9.0), (8, 30.0), (10, 24.0), (14, 27.0), (16, 24.0), (18.5, 30.0), (21, 24.0), (23, 12.0)],
+}
+
+
+def perfil(puntos: Sequence[Tuple[float, float]], paso: int = PASO_PERFIL) -> np.ndarray:
+    """ Muestrea un perfil lineal a trozos a lo largo de un día.
+
+    Los puntos se interpolan linealmente y de forma periódica (después de la última hora del día
+    se vuelve hacia el valor de la primera). Si las horas de los puntos son múltiplos del paso
+    el muestreo es exacto.
+
+    Args:
+        puntos (Sequence[Tuple[float,float]]): pares (hora del día en horas, valor)
+        paso (int): segundos entre dos muestras
+    Returns:
+        np.ndarray: valores en los instantes 0, paso, 2*paso, ..., SEGUNDOS_DIA (float32)
+    Example:
+        perfil([(0, 1.0), (12, 2.0)], 21600) es [1.0, 1.5, 2.0, 1.5, 1.0]
+    """
+    horas = np.array([hora * 3600 for hora, _ in puntos], dtype=np.float64)
+    valores = np.array([valor for _, valor in puntos], dtype=np.float64)
+    instantes = np.arange(0, SEGUNDOS_DIA + paso, paso, dtype=np.float64)
+    return np.interp(instantes, horas, valores, period=SEGUNDOS_DIA).astype(np.float32)
+
+
+def segundos_del_dia(hora: Union[float, str, datetime.time, datetime.datetime]) -> float:
+    """ Convierte una hora de salida en segundos desde las 00:00.
+
+    Args:
+        hora: segundos desde las 00:00, cadena "HH:MM" o "HH:MM:SS", datetime.time o datetime.datetime
+    Returns:
+        float: segundos desde las 00:00
+    Raises:
+        ValueError: Si la hora no es válida
+    """
+    if isinstance(hora, datetime.datetime):
+        hora = hora.time()
+    if isinstance(hora, datetime.time):
+        return hora.hour * 3600 + hora.minute * 60 + hora.second + hora.microsecond / 1e6
+    if isinstance(hora, str):
+        partes = hora.strip().split(':')
+        if not 2 <= len(partes) <= 3:
+            raise ValueError(f"Hora no válida: {hora}.")
+        try:
+            horas, minutos, segundos = int(partes[0]), int(partes[1]), float(partes[2]) if len(partes) == 3 else 0.0
+        except ValueError:
+            raise ValueError(f"Hora no válida: {hora}.")
+        if not (0 <= horas < 24 and 0 <= minutos < 60 and 0 <= segundos < 60):
+            raise ValueError(f"Hora no válida: {hora}.")
+        return horas * 3600 + minutos * 60 + segundos
+    hora = float(hora)
+    if not hora >= 0:
+        raise ValueError(f"Hora no válida: {hora}.")
+    return hora
+
+
+class PerfilesHorarios:
+    """ Perfiles horarios de las aristas y los cruces de un grafo compilado.
+
+    Attributes:
+        aristas (np.ndarray): tabla (perfiles x muestras) con el factor del tiempo de recorrido (float32)
+        cruces (np.ndarray): tabla (perfiles x muestras) con los segundos de espera en el cruce (float32);
+            el perfil 0 tiene que ser siempre nulo
+        perfil_arista (np.ndarray): número de perfil de cada arista (uint8)
+        perfil_cruce (np.ndarray): número de perfil de cada vértice (uint8)
+        nombres_aristas (List[str]): nombre de cada perfil de aristas
+        nombres_cruces (List[str]): nombre de cada perfil de cruces
+        paso (int): segundos entre dos muestras de los perfiles
+        modo (str): modo de ruta del grafo con el tiempo de recorrido sin tráfico
+    """
+
+    def __init__(self, aristas: np.ndarray, cruces: np.ndarray, perfil_arista: np.ndarray, perfil_cruce: np.ndarray,
+                 nombres_aristas: List[str] = None, nombres_cruces: List[str] = None,
+                 paso: int = PASO_PERFIL, modo: str = MODO_BASE):
+        if SEGUNDOS_DIA % paso or aristas.shape[1] != SEGUNDOS_DIA // paso + 1 or cruces.shape[1] != aristas.shape[1]:
+            raise ValueError(f"Los perfiles tienen que tener una muestra cada {paso} segundos de un día.")
+        if not (aristas > 0).all():
+            raise ValueError("Los factores de las aristas tienen que ser positivos.")
+        if not (cruces >= 0).all() or (cruces[0] != 0).any():
+            raise ValueError("Los retrasos de los cruces no pueden ser negativos y el primer perfil tiene que ser nulo.")
+        self.aristas = aristas
+        self.cruces = cruces
+        self.perfil_arista = perfil_arista
+        self.perfil_cruce = perfil_cruce
+        self.nombres_aristas = list(nombres_aristas) if nombres_aristas is not None else [str(i) for i in range(len(aristas))]
+        self.nombres_cruces = list(nombres_cruces) if nombres_cruces is not None else [str(i) for i in range(len(cruces))]
+        self.paso = paso
+        self.modo = modo
+        self._listas = None
+
+    @property
+    def factor_minimo(self) -> float:
+        "Menor factor del tiempo de recorrido de todos los perfiles de aristas"
+        return float(self.aristas.min())
+
+    def listas(self) -> Tuple[List[float], List[int], List[float], List[int]]:
+        """ Devuelve las tablas y los perfiles como listas de Python para los bucles de búsqueda.
+        Los perfiles se dan ya como la posición de su primera muestra en la tabla aplanada.
+
+        Returns:
+            Tuple: tabla de aristas aplanada, posición del perfil de cada arista, tabla de cruces
+                aplanada y posición del perfil de cada vértice (0 si no tiene espera)
+        """
+        if self._listas is None:
+            columnas = self.aristas.shape[1]
+            self._listas = (self.aristas.ravel().tolist(), (self.perfil_arista.astype(np.int64) * columnas).tolist(),
+                            self.cruces.ravel().tolist(), (self.perfil_cruce.astype(np.int64) * columnas).tolist())
+        return self._listas
+
+    def tiempos(self, grafo: GrafoCompilado, hora: Union[float, str, datetime.time, datetime.datetime]) -> np.ndarray:
+        """ Calcula el tiempo de recorrido de todas las aristas, incluida la espera en el cruce al
+        que llegan, saliendo a una hora dada. Con estos pesos fijos se obtiene una aproximación
+        estática del modo dependiente de la hora.
+
+        Args:
+            grafo (GrafoCompilado): grafo compilado con el modo base
+            hora: hora de salida (ver segundos_del_dia)
+        Returns:
+            np.ndarray: tiempo en segundos de cada arista
+        """
+        s = (segundos_del_dia(hora) % SEGUNDOS_DIA) / self.paso
+        i = int(s)
+        fraccion = s - i
+        factores = self.aristas[:, i] + (self.aristas[:, i+1] - self.aristas[:, i]) * fraccion
+        retrasos = self.cruces[:, i] + (self.cruces[:, i+1] - self.cruces[:, i]) * fraccion
+        return (grafo.pesos[grafo.modo(self.modo)] * factores[self.perfil_arista]
+                + retrasos[self.perfil_cruce[grafo.indices]])
+
+
+def perfiles_callejero(grafo: GrafoCompilado, paso: int = PASO_PERFIL) -> PerfilesHorarios:
+    """ Construye los perfiles horarios del callejero compilado con gps.compila_callejero: el
+    perfil de cada arista según su velocidad máxima (datos_aristas['velocidad']) y el de los
+    semáforos en los vértices con más de dos calles (datos_nodos['street_count']).
+
+    Args:
+        grafo (GrafoCompilado): callejero compilado
+        paso (int): segundos entre dos muestras de los perfiles
+    Returns:
+        PerfilesHorarios: perfiles del callejero
+    """
+    nombres_aristas = list(PERFILES_ARISTAS)
+    nombres_cruces = list(PERFILES_CRUCES)
+    velocidades = np.asarray(grafo.datos_aristas['velocidad'], dtype=np.float64)
+    perfil_arista = np.zeros(grafo.m, dtype=np.uint8)
+    # De menor a mayor velocidad mínima, de forma que cada arista se queda con el tipo más rápido que le corresponde
+    for minima, nombre in sorted(VELOCIDADES_PERFILES):
+        perfil_arista[velocidades >= minima] = nombres_aristas.index(nombre)
+    perfil_cruce = np.where(np.asarray(grafo.datos_nodos['street_count']) > 2,
+                            nombres_cruces.index('semaforo'), 0).astype(np.uint8)
+    return PerfilesHorarios(np.stack([perfil(PERFILES_ARISTAS[nombre], paso) for nombre in nombres_aristas]),
+                            np.stack([perfil(PERFILES_CRUCES[nombre], paso) for nombre in nombres_cruces]),
+                            perfil_arista, perfil_cruce, nombres_aristas, nombres_cruces, paso)
+
+
+def guarda_perfiles(perfiles: PerfilesHorarios, fichero: str) -> None:
+    """ Guarda unos perfiles horarios en un fichero .npz.
+
+    Args:
+        perfiles (PerfilesHorarios): perfiles a guardar
+        fichero (str): ruta del fichero
+    Returns: None
+    """
+    np.savez(fichero, aristas=perfiles.aristas, cruces=perfiles.cruces, perfil_arista=perfiles.perfil_arista,
+             perfil_cruce=perfiles.perfil_cruce, nombres_aristas=np.array(perfiles.nombres_aristas),
+             nombres_cruces=np.array(perfiles.nombres_cruces), paso=perfiles.paso, modo=perfiles.modo)
+
+
+def carga_perfiles(fichero: str) -> PerfilesHorarios:
+    """ Carga unos perfiles horarios guardados con guarda_perfiles.
+
+    Args:
+        fichero (str): ruta del fichero
+    Returns:
+        PerfilesHorarios: perfiles guardados en el fichero
+    Raises:
+        FileNotFoundError: Si el fichero no existe
+    """
+    with np.load(fichero) as datos:
+        return PerfilesHorarios(datos['aristas'], datos['cruces'], datos['perfil_arista'], datos['perfil_cruce'],
+                                datos['nombres_aristas'].tolist(), datos['nombres_cruces'].tolist(),
+                                int(datos['paso']), str(datos['modo']))
+
+
+def a_estrella_horaria(grafo: GrafoCompilado, perfiles: PerfilesHorarios, origen: int, destino: int, salida: float,
+                       estadisticas: Dict[str, int] = None) -> Tuple[List[int], float]:
+    """ Calcula la ruta más rápida entre dos vértices de un grafo compilado saliendo a una hora
+    dada, con el algoritmo A* sobre las horas de llegada.
+
+    La heurística es la distancia en línea recta hasta el destino por el menor peso por metro
+    del modo base y por el menor factor de los perfiles, que nunca sobrestima lo que falta.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con coordenadas y el modo base de los perfiles
+        perfiles (PerfilesHorarios): perfiles horarios del grafo
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+        salida (float): hora de salida en segundos desde las 00:00
+        estadisticas (Dict[str,int], opcional): diccionario en el que guardar el número de
+            vértices fijados ('nodos_asentados')
+    Returns:
+        Tuple[List[int],float]: posiciones de los vértices de la ruta y hora de llegada en
+            segundos desde las 00:00 del día de salida (puede pasar de SEGUNDOS_DIA)
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    indptr, indices, pesos = grafo.listas(perfiles.modo)
+    tabla_aristas, perfil_arista, tabla_cruces, perfil_cruce = perfiles.listas()
+    muestras = SEGUNDOS_DIA // perfiles.paso
+    inverso_paso = 1 / perfiles.paso
+    n = grafo.n
+    latitudes, longitudes, cosenos = grafo.listas_coordenadas()
+    lat_t, lon_t, cos_t = latitudes[destino], longitudes[destino], cosenos[destino]
+    escala = 2 * RADIO_TIERRA * grafo.cota_peso_distancia(perfiles.modo) * perfiles.factor_minimo
+    h = [-1.0] * n
+    d = [INFTY] * n
+    padre = [-1] * n
+    visitado = [False] * n
+    d[origen] = salida
+    asentados = 0
+    Q = [(salida, salida, origen)]
+    while Q:
+        _, t_v, v = heapq.heappop(Q)
+        if visitado[v]:
+            continue
+        visitado[v] = True
+        asentados += 1
+        if v == destino:
+            break
+        # Muestra de los perfiles anterior a la hora de salida de v y fracción del paso transcurrida
+        s = t_v * inverso_paso
+        i = int(s)
+        fraccion = s - i
+        i %= muestras
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            j = perfil_arista[k] + i
+            factor = tabla_aristas[j]
+            t_x = t_v + pesos[k] * (factor + (tabla_aristas[j+1] - factor) * fraccion)
+            j = perfil_cruce[x]
+            if j:
+                j += i
+                retraso = tabla_cruces[j]
+                t_x += retraso + (tabla_cruces[j+1] - retraso) * fraccion
+            if t_x < d[x]:
+                d[x] = t_x
+                padre[x] = v
+                h_x = h[x]
+                if h_x < 0:
+                    seno_lat = math.sin((lat_t - latitudes[x]) / 2)
+                    seno_lon = math.sin((lon_t - longitudes[x]) / 2)
+                    a = seno_lat * seno_lat + cosenos[x] * cos_t * seno_lon * seno_lon
+                    h_x = h[x] = escala * math.asin(math.sqrt(min(a, 1.0)))
+                heapq.heappush(Q, (t_x + h_x, t_x, x))
+    if estadisticas is not None:
+        estadisticas['nodos_asentados'] = asentados
+    return reconstruye_camino(padre, origen, destino), d[destino]
+
+
+def dijkstra_horario(grafo: GrafoCompilado, perfiles: PerfilesHorarios, origen: int, salida: float) -> Tuple[np.ndarray, np.ndarray]:
+    """ Calcula la hora de llegada más temprana a todos los vértices saliendo del origen a una
+    hora dada, con el algoritmo de Dijkstra sobre las horas de llegada.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado con el modo base de los perfiles
+        perfiles (PerfilesHorarios): perfiles horarios del grafo
+        origen (int): posición del vértice de origen
+        salida (float): hora de salida en segundos desde las 00:00
+    Returns:
+        Tuple[np.ndarray,np.ndarray]: hora de llegada a cada vértice en segundos desde las 00:00
+            (INFTY si no es alcanzable) y padre de cada vértice en el árbol (-1 si no tiene)
+    """
+    indptr, indices, pesos = grafo.listas(perfiles.modo)
+    tabla_aristas, perfil_arista, tabla_cruces, perfil_cruce = perfiles.listas()
+    muestras = SEGUNDOS_DIA // perfiles.paso
+    inverso_paso = 1 / perfiles.paso
+    n = grafo.n
+    d = [INFTY] * n
+    padre = [-1] * n
+    visitado = [False] * n
+    d[origen] = salida
+    Q = [(salida, origen)]
+    while Q:
+        t_v, v = heapq.heappop(Q)
+        if visitado[v]:
+            continue
+        visitado[v] = True
+        s = t_v * inverso_paso
+        i = int(s)
+        fraccion = s - i
+        i %= muestras
+        for k in range(indptr[v], indptr[v+1]):
+            x = indices[k]
+            j = perfil_arista[k] + i
+            factor = tabla_aristas[j]
+            t_x = t_v + pesos[k] * (factor + (tabla_aristas[j+1] - factor) * fraccion)
+            j = perfil_cruce[x]
+            if j:
+                j += i
+                retraso = tabla_cruces[j]
+                t_x += retraso + (tabla_cruces[j+1] - retraso) * fraccion
+            if t_x < d[x]:
+                d[x] = t_x
+                padre[x] = v
+                heapq.heappush(Q, (t_x, x))
+    return np.array(d, dtype=np.float64), np.array(padre, dtype=np.int64)
+
+
+def camino_minimo_horario(grafo: GrafoCompilado, perfiles: PerfilesHorarios, origen: object, destino: object,
+                          salida: Union[float, str, datetime.time, datetime.datetime]) -> Tuple[List[object], float]:
+    """ Calcula la ruta más rápida entre dos vértices del grafo original saliendo a una hora dada.
+
+    Args:
+        grafo (GrafoCompilado): grafo compilado
+        perfiles (PerfilesHorarios): perfiles horarios del grafo
+        origen (object): vértice del grafo de origen
+        destino (object): vértice del grafo de destino
+        salida: hora de salida (ver segundos_del_dia)
+    Returns:
+        Tuple[List[object],float]: vértices de la ruta y duración del viaje en segundos
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino o la hora no es válida
+    Example:
+        camino, duracion = camino_minimo_horario(grafo, perfiles, origen, destino, "08:15")
+    """
+    if origen not in grafo.indice or destino not in grafo.indice:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    salida = segundos_del_dia(salida)
+    try:
+        camino, llegada = a_estrella_horaria(grafo, perfiles, grafo.indice[origen], grafo.indice[destino], salida)
+    except ValueError:
+        raise ValueError(
+            f"No hay camino posible que vaya de {origen} hasta {destino}.")
+    return grafo.camino_original(camino), llegada - salida
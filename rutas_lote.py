@@ -0,0 +1,297 @@
+"""
+rutas_lote.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Cálculo por lotes de rutas entre pares de direcciones leídos de un fichero CSV o JSONL (uno por
+fila, con las columnas o claves origen, destino y, opcionalmente, modo e id). El fichero se lee
+como un flujo, por bloques de filas: las direcciones de cada bloque se buscan de una vez en el
+callejero (callejero.busca_direcciones), se asignan al vértice más cercano del grafo, se calculan
+las rutas y se escriben sus resultados en JSONL, en el mismo orden que la entrada, antes de leer
+el bloque siguiente. La memoria usada no depende del tamaño del fichero.
+
+Las filas con direcciones que no existen, sin camino posible o mal formadas se escriben con un
+campo "error" en lugar de detener el proceso. Durante el cálculo se muestra el progreso y al
+final un resumen, ambos por la salida de errores. Con GPS_METRICAS=1 se registran además los
+tiempos de las etapas de cada bloque (ver metricas.py).
+
+Uso:
+    python rutas_lote.py pares.csv -o rutas.jsonl --modo rapida --instrucciones
+    cat pares.jsonl | python rutas_lote.py - --formato jsonl > rutas.jsonl
+"""
+
+from typing import List, Dict, Iterable, Iterator, TextIO, Tuple
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import callejero as c
+import gps
+from gps import MODOS
+from grafo_compilado import GrafoCompilado
+from cache_rutas import CacheRutas
+from enrutador_paralelo import EnrutadorParalelo
+import metricas
+
+TAMANO_BLOQUE = 1000  # Filas que se leen, geocodifican y calculan juntas
+MODO_DEFECTO = 'rapida'
+FORMATOS = ('csv', 'jsonl')
+
+
+def lee_pares(entrada: TextIO, formato: str = 'csv', separador: str = ',') -> Iterator[Dict[str, object]]:
+    """ Lee los pares de direcciones de un fichero CSV (con cabecera) o JSONL, fila a fila.
+
+    Args:
+        entrada (TextIO): fichero abierto en modo texto
+        formato (str): 'csv' o 'jsonl'
+        separador (str): separador de los campos del CSV
+    Returns:
+        Iterator[Dict[str,object]]: diccionario de cada fila con su número ('fila', empezando
+            en 1 sin contar la cabecera) y sus campos; las filas que no se pueden leer llevan
+            un campo 'error'
+    Raises:
+        ValueError: Si el formato no es válido o el CSV no tiene las columnas origen y destino
+    """
+    if formato == 'csv':
+        lector = csv.reader(entrada, delimiter=separador)
+        cabecera = [columna.strip().lower() for columna in next(lector, [])]
+        if 'origen' not in cabecera or 'destino' not in cabecera:
+            raise ValueError("El CSV tiene que tener una cabecera con las columnas origen y destino.")
+        for numero, campos in enumerate(lector, 1):
+            if not campos:
+                continue
+            if len(campos) != len(cabecera):
+                yield {'fila': numero, 'error': f"La fila tiene {len(campos)} campos en lugar de {len(cabecera)}."}
+            else:
+                yield {'fila': numero, **dict(zip(cabecera, campos))}
+    elif formato == 'jsonl':
+        for numero, linea in enumerate(entrada, 1):
+            if not linea.strip():
+                continue
+            try:
+                datos = json.loads(linea)
+            except ValueError:
+                yield {'fila': numero, 'error': "La fila no es un JSON válido."}
+                continue
+            if not isinstance(datos, dict):
+                yield {'fila': numero, 'error': "La fila tiene que ser un objeto JSON."}
+            else:
+                yield {**datos, 'fila': numero}
+    else:
+        raise ValueError(f"Formato no soportado: {formato}. Los formatos son {', '.join(FORMATOS)}.")
+
+
+class CalculadorLote:
+    """ Calcula los resultados de bloques de pares de direcciones sobre un grafo y un callejero.
+
+    Attributes:
+        grafo (GrafoCompilado): grafo de calles compilado
+        callejero (pd.DataFrame): callejero con las direcciones
+        modo (str): modo de ruta de las filas que no indican ninguno
+        instrucciones (bool): si es True se añaden los pasos y las instrucciones de cada ruta
+        resumen (Dict[str,object]): filas leídas ('filas'), rutas calculadas ('rutas') y errores
+            de cada tipo ('errores': 'entrada', 'modo', 'direccion' y 'sin_camino')
+    """
+
+    def __init__(self, grafo: GrafoCompilado, callejero: pd.DataFrame, modo: str = MODO_DEFECTO,
+                 instrucciones: bool = False, procesos: int = 0):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de ruta desconocido: {modo}. Los modos son {', '.join(MODOS)}.")
+        self.grafo = grafo
+        self.callejero = callejero
+        self.modo = modo
+        self.instrucciones = instrucciones
+        self.resumen = {'filas': 0, 'rutas': 0, 'errores': {'entrada': 0, 'modo': 0, 'direccion': 0, 'sin_camino': 0}}
+        # Las rutas se calculan en este proceso con una caché (muchas filas suelen compartir
+        # origen) o, si se piden procesos, en un grupo de procesos
+        self._cache = CacheRutas(grafo) if not procesos else None
+        self._enrutador = EnrutadorParalelo(grafo, procesos) if procesos else None
+        self._longitudes = grafo.pesos[grafo.modo(gps.peso_ruta_mas_corta)]
+        self._tiempos = grafo.pesos[grafo.modo(gps.peso_ruta_mas_rapida)]
+
+    def _error(self, fila: Dict[str, object], tipo: str, mensaje: str) -> Dict[str, object]:
+        """ Anota un error y devuelve el resultado de la fila con su descripción. """
+        self.resumen['errores'][tipo] += 1
+        return {**_campos(fila), 'error': mensaje, 'tipo_error': tipo}
+
+    def _rutas(self, modo: object, pares: List[Tuple[int, int]]) -> List[List[int]]:
+        """ Calcula los caminos (posiciones, o None si no hay camino) de unos pares en un modo. """
+        if self._enrutador is not None:
+            return self._enrutador.caminos_minimos_compilado(modo, pares)
+        caminos = []
+        for origen, destino in pares:
+            try:
+                caminos.append(self._cache.camino_minimo_compilado(modo, origen, destino))
+            except ValueError:
+                caminos.append(None)
+        return caminos
+
+    def procesa_bloque(self, filas: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        """ Calcula los resultados de un bloque de filas, en el mismo orden.
+
+        Args:
+            filas (List[Dict[str,object]]): filas leídas con lee_pares
+        Returns:
+            List[Dict[str,object]]: resultado de cada fila: sus campos de entrada y la distancia
+                en metros ('distancia'), el tiempo en segundos a la velocidad máxima ('tiempo'),
+                el peso en el modo de la ruta ('coste'), los vértices del camino ('nodos') y, si
+                se piden, sus pasos ('pasos') e instrucciones ('instrucciones'); o un campo
+                'error' con su tipo ('tipo_error')
+        """
+        self.resumen['filas'] += len(filas)
+        resultados = [None] * len(filas)
+        validas = []
+        for i, fila in enumerate(filas):
+            if 'error' in fila:
+                resultados[i] = self._error(fila, 'entrada', fila['error'])
+            elif not isinstance(fila.get('origen'), str) or not isinstance(fila.get('destino'), str):
+                resultados[i] = self._error(fila, 'entrada', "Faltan las direcciones de origen y destino.")
+            elif not isinstance(fila.get('modo') or self.modo, str) or (fila.get('modo') or self.modo) not in MODOS:
+                resultados[i] = self._error(fila, 'modo', f"Modo de ruta desconocido: {fila['modo']}.")
+            else:
+                validas.append(i)
+
+        # Todas las direcciones del bloque se buscan y se asignan a su vértice de una vez
+        direcciones = [filas[i][clave] for i in validas for clave in ('origen', 'destino')]
+        coordenadas = c.busca_direcciones(direcciones, self.callejero, ignorar_errores=True)
+        encontradas = ~np.isnan(coordenadas).any(axis=1)
+        vertices = np.full(len(direcciones), -1, dtype=np.int64)
+        if encontradas.any():
+            vertices[encontradas] = self.grafo.nodos_mas_cercanos(coordenadas[encontradas, 0], coordenadas[encontradas, 1])
+
+        por_modo = {}
+        for j, i in enumerate(validas):
+            fila = filas[i]
+            no_encontradas = [fila[clave] for clave, k in (('origen', 2*j), ('destino', 2*j+1)) if not encontradas[k]]
+            if no_encontradas:
+                resultados[i] = self._error(fila, 'direccion', f"No se encuentra la dirección {no_encontradas[0]}.")
+            else:
+                funcion = MODOS[fila.get('modo') or self.modo]
+                por_modo.setdefault(funcion, []).append((i, (int(vertices[2*j]), int(vertices[2*j+1]))))
+
+        for funcion, pares in por_modo.items():
+            modo = self.grafo.modo(funcion)
+            pesos = self.grafo.pesos[modo]
+            for (i, _), camino in zip(pares, self._rutas(modo, [par for _, par in pares])):
+                fila = filas[i]
+                if camino is None:
+                    resultados[i] = self._error(
+                        fila, 'sin_camino', f"No hay camino posible que vaya de {fila['origen']} hasta {fila['destino']}.")
+                    continue
+                aristas = self.grafo.aristas_camino(camino)
+                nodos = self.grafo.camino_original(camino)
+                resultado = {**_campos(fila), 'modo': fila.get('modo') or self.modo,
+                             'distancia': float(self._longitudes[aristas].sum()),
+                             'tiempo': float(self._tiempos[aristas].sum()),
+                             'coste': float(pesos[aristas].sum()), 'nodos': nodos}
+                if self.instrucciones:
+                    resultado['pasos'] = gps.pasos_ruta(self.grafo, nodos, funcion)
+                    resultado['instrucciones'] = gps.formatea_pasos(resultado['pasos'])
+                resultados[i] = resultado
+                self.resumen['rutas'] += 1
+        return resultados
+
+    def cierra(self) -> None:
+        """ Termina el grupo de procesos, si lo hay.
+
+        Returns: None
+        """
+        if self._enrutador is not None:
+            self._enrutador.cierra()
+
+
+def _campos(fila: Dict[str, object]) -> Dict[str, object]:
+    """ Campos de una fila de entrada que se repiten en su resultado. """
+    return {clave: fila[clave] for clave in ('fila', 'id', 'origen', 'destino', 'modo') if clave in fila}
+
+
+def _convierte(valor):
+    """ Convierte a tipos de JSON los valores de numpy que pueda haber en un resultado. """
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f"{type(valor).__name__} no se puede convertir a JSON")
+
+
+def procesa_lote(filas: Iterable[Dict[str, object]], calculador: CalculadorLote, salida: TextIO,
+                 tamano_bloque: int = TAMANO_BLOQUE, progreso: TextIO = None) -> Dict[str, object]:
+    """ Calcula las rutas de un flujo de filas por bloques y escribe cada resultado en una línea
+    JSON de la salida, en el orden de la entrada, en cuanto se termina su bloque.
+
+    Args:
+        filas (Iterable[Dict[str,object]]): filas leídas con lee_pares
+        calculador (CalculadorLote): calculador de los resultados
+        salida (TextIO): fichero en el que escribir los resultados
+        tamano_bloque (int): filas de cada bloque
+        progreso (TextIO, opcional): fichero en el que escribir el progreso tras cada bloque
+    Returns:
+        Dict[str,object]: resumen del calculador, con los segundos totales ('segundos') y las
+            filas por segundo ('filas_por_segundo')
+    """
+    inicio = time.perf_counter()
+    filas = iter(filas)
+    while True:
+        bloque = list(itertools.islice(filas, tamano_bloque))
+        if not bloque:
+            break
+        with metricas.peticion('bloque_rutas', filas=len(bloque)):
+            for resultado in calculador.procesa_bloque(bloque):
+                salida.write(json.dumps(resultado, ensure_ascii=False, default=_convierte) + "\n")
+            salida.flush()
+        if progreso is not None:
+            resumen = calculador.resumen
+            segundos = time.perf_counter() - inicio
+            print(f"{resumen['filas']} filas, {resumen['rutas']} rutas, {sum(resumen['errores'].values())} errores "
+                  f"({resumen['filas'] / segundos:.1f} filas/s)", file=progreso, flush=True)
+    segundos = time.perf_counter() - inicio
+    return {**calculador.resumen, 'segundos': segundos,
+            'filas_por_segundo': calculador.resumen['filas'] / segundos if segundos > 0 else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('entrada', help="fichero CSV o JSONL con los pares de direcciones ('-' para la entrada estándar)")
+    parser.add_argument('-o', '--salida', default='-', help="fichero JSONL de resultados ('-' para la salida estándar)")
+    parser.add_argument('--formato', choices=FORMATOS, help='formato de la entrada (por defecto, según su extensión)')
+    parser.add_argument('--separador', default=',', help='separador de los campos del CSV')
+    parser.add_argument('--codificacion', default='utf-8', help='codificación de la entrada')
+    parser.add_argument('--modo', default=MODO_DEFECTO, choices=sorted(MODOS), help='modo de las filas que no lo indican')
+    parser.add_argument('--instrucciones', action='store_true', help='añade los pasos y las instrucciones de cada ruta')
+    parser.add_argument('--bloque', type=int, default=TAMANO_BLOQUE, help='filas de cada bloque')
+    parser.add_argument('--procesos', type=int, default=0, help='procesos para calcular las rutas (0 para usar este proceso)')
+    args = parser.parse_args()
+
+    formato = args.formato or ('jsonl' if args.entrada.lower().endswith(('.jsonl', '.json')) else 'csv')
+    grafo = c.carga_grafo_compilado(gps.compila_callejero)
+    callejero = c.carga_callejero()
+    calculador = CalculadorLote(grafo, callejero, args.modo, args.instrucciones, args.procesos)
+    entrada = (io.TextIOWrapper(sys.stdin.buffer, encoding=args.codificacion, newline='') if args.entrada == '-'
+               else open(args.entrada, encoding=args.codificacion, newline=''))
+    salida = sys.stdout if args.salida == '-' else open(args.salida, 'w', encoding='utf-8')
+    try:
+        resumen = procesa_lote(lee_pares(entrada, formato, args.separador), calculador, salida, args.bloque, sys.stderr)
+    finally:
+        calculador.cierra()
+        entrada.close()
+        if salida is not sys.stdout:
+            salida.close()
+    errores = resumen['errores']
+    print(f"Terminado: {resumen['filas']} filas en {resumen['segundos']:.1f} s ({resumen['filas_por_segundo']:.1f} filas/s), "
+          f"{resumen['rutas']} rutas y {sum(errores.values())} errores", file=sys.stderr)
+    for tipo, numero in errores.items():
+        if numero:
+            print(f"    {tipo}: {numero}", file=sys.stderr)
+    if metricas.activas():
+        print(json.dumps(metricas.instantanea(), ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
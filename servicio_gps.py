@@ -0,0 +1,426 @@
+"""
+servicio_gps.py
+
+Matemática Discreta - IMAT
+ICAI, Universidad Pontificia Comillas
+
+Descripción:
+Servicio HTTP/JSON del GPS, sin interfaz, que sustituye al bucle interactivo de gps.py para
+atender peticiones de forma continuada. El callejero y el grafo compilado se cargan una sola
+vez al arrancar y las búsquedas de caminos, que consumen CPU, se ejecutan fuera del bucle de
+eventos (en hilos o en procesos) para que las peticiones concurrentes no se bloqueen entre sí.
+
+Rutas (los parámetros se pueden pasar en la URL o como un objeto JSON en el cuerpo):
+    GET  /salud                                         estado del servicio
+    GET  /metricas                                      tiempos por etapa y contadores (ver metricas.py)
+    GET  /direccion?direccion=Calle de Alberto Aguilera, 23
+    GET  /autocompleta?texto=c alberto agilera 2&limite=5   direcciones parecidas, con erratas o a medias
+    POST /ruta           {"origen": ..., "destino": ..., "modo": "rapida"}
+    POST /instrucciones  {"origen": ..., "destino": ..., "modo": "corta"}
+    POST /mapa           {"origen": ..., "destino": ..., "modo": "rapida", "formato": "png"}  (imagen PNG o SVG)
+    POST /isocrona       {"origen": ..., "umbrales": [300, 600], "modo": "rapida", "forma": "concava"}  (GeoJSON)
+
+En /isocrona se puede dar "origenes", una lista de direcciones, en lugar de "origen", y la zona
+es entonces la alcanzable desde cualquiera de ellas. Los umbrales están en las unidades del modo
+(metros en "corta" y segundos en los demás).
+
+Los modos de ruta son "corta", "rapida" y "semaforos" (o el nombre de su función de peso).
+
+Con --metricas (o GPS_METRICAS=1) se miden las etapas de cada petición y se escribe una línea
+JSON por petición en la salida de errores; con --perfil se perfilan además con cProfile las
+partes de las peticiones que se ejecutan en el hilo principal.
+
+Uso:
+    python servicio_gps.py --puerto 8080 --procesos 4 --metricas
+"""
+
+from typing import List, Dict, Tuple, Callable
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import urllib.parse
+
+import pandas as pd
+
+import callejero as c
+import gps
+from gps import MODOS
+import grafo_compilado
+from grafo_compilado import GrafoCompilado
+from cache_rutas import CacheRutas
+from enrutador_paralelo import PesosCompartidos, conecta_pesos
+import isocronas
+import metricas
+from autocompletado import indice_autocompletado
+from mapa import MapaBase
+
+TAMANO_MAXIMO_CUERPO = 1 << 20  # Bytes como máximo del cuerpo de una petición
+
+ESTADOS_HTTP = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error"}
+
+# Caché de caminos sobre el grafo del proceso actual (el del servicio si se usan hilos, o el
+# de cada proceso del grupo, que lo proyecta en memoria al arrancar)
+_cache = None
+# En los procesos del grupo, función que pone al día el grafo con los pesos compartidos (ver enrutador_paralelo.conecta_pesos)
+_al_dia = None
+
+
+def _inicia_proceso(directorio: str, directorio_pesos: str, modos: List[str]) -> None:
+    """ Carga el grafo compilado, proyectado en memoria, en un proceso del grupo, con los pesos
+    que comparte el servicio.
+
+    Args:
+        directorio (str): directorio en el que está guardado el grafo
+        directorio_pesos (str): directorio de los pesos compartidos (PesosCompartidos.directorio)
+        modos (List[str]): modos compartidos
+    Returns: None
+    """
+    global _cache, _al_dia
+    grafo = grafo_compilado.carga_grafo_compilado(directorio, mmap=True)
+    _al_dia = conecta_pesos(grafo, directorio_pesos, modos)
+    _cache = CacheRutas(grafo)
+
+
+def _busca_camino(modo: str, origen: int, destino: int) -> List[int]:
+    """ Calcula el camino mínimo entre dos posiciones del grafo del proceso, pasando por su caché.
+
+    Args:
+        modo (str): nombre del modo de ruta
+        origen (int): posición del vértice de origen
+        destino (int): posición del vértice de destino
+    Returns:
+        List[int]: posiciones de los vértices del camino
+    Raises:
+        ValueError: Si no se puede llegar desde el origen hasta el destino
+    """
+    if _al_dia is not None and _al_dia(modo):
+        # Los pesos compartidos han cambiado y la caché no sabe en qué aristas
+        _cache.invalida(modo)
+    return _cache.camino_minimo_compilado(modo, origen, destino)
+
+
+class PeticionIncorrecta(Exception):
+    """ Error en los parámetros de una petición (se responde con el código HTTP dado). """
+
+    def __init__(self, mensaje: str, estado: int = 400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+class ServicioGPS:
+    """ Núcleo del servicio: datos cargados una sola vez y respuesta a cada ruta.
+
+    Attributes:
+        grafo (GrafoCompilado): grafo de calles compilado
+        callejero (pd.DataFrame): callejero con la columna NODO
+    """
+
+    def __init__(self, grafo: GrafoCompilado, callejero: pd.DataFrame, procesos: int = 0):
+        global _cache
+        self.grafo = grafo
+        self.callejero = callejero if 'NODO' in callejero.columns else c.asigna_nodos(callejero, grafo)
+        # Los índices de direcciones se construyen ahora y no en la primera petición
+        c.indice_callejero(self.callejero)
+        self.autocompletado = indice_autocompletado(self.callejero)
+        # Caché de caminos del propio proceso (solo si las búsquedas se hacen en hilos)
+        self.cache = None
+        # Pesos que se comparten con los procesos de las búsquedas, que así ven sus actualizaciones
+        self._pesos = None
+        if procesos and grafo.directorio is not None:
+            self._pesos = PesosCompartidos(grafo)
+            self._busquedas = concurrent.futures.ProcessPoolExecutor(
+                procesos, initializer=_inicia_proceso, initargs=(grafo.directorio, self._pesos.directorio, self._pesos.modos))
+        else:
+            _cache = self.cache = CacheRutas(grafo)
+            self._busquedas = concurrent.futures.ThreadPoolExecutor()
+        # Mapa de calles para dibujar las rutas, que se dibuja la primera vez que se pide una imagen
+        self._mapa = None
+        self._cerrojo_mapa = asyncio.Lock()
+        self.rutas = {'/salud': self.salud, '/metricas': self.metricas, '/direccion': self.direccion, '/autocompleta': self.autocompleta, '/ruta': self.ruta,
+                      '/instrucciones': self.instrucciones, '/mapa': self.mapa, '/isocrona': self.isocrona}
+
+    @classmethod
+    def carga(cls, procesos: int = 0) -> 'ServicioGPS':
+        """ Carga el grafo compilado de Madrid y el callejero desde sus cachés.
+
+        Args:
+            procesos (int): procesos para las búsquedas de caminos (0 para usar hilos)
+        Returns:
+            ServicioGPS: servicio listo para atender peticiones
+        """
+        grafo = c.carga_grafo_compilado(gps.compila_callejero)
+        return cls(grafo, c.asigna_nodos(c.carga_callejero(), grafo), procesos=procesos)
+
+    def cierra(self) -> None:
+        """ Termina los hilos o procesos de las búsquedas.
+
+        Returns: None
+        """
+        self._busquedas.shutdown()
+        if self._pesos is not None:
+            self._pesos.cierra()
+
+    def _localiza(self, direccion: str) -> Dict[str, object]:
+        """ Busca una dirección en el callejero y devuelve sus coordenadas y su vértice.
+
+        Raises:
+            PeticionIncorrecta: Si la dirección no existe
+        """
+        if not isinstance(direccion, str) or not direccion:
+            raise PeticionIncorrecta("Falta la dirección.")
+        try:
+            latitud, longitud = c.busca_direccion(direccion, self.callejero)
+            nodo = c.busca_nodo(direccion, self.callejero)
+        except c.AdressNotFoundError:
+            raise PeticionIncorrecta(f"No se encuentra la dirección {direccion}.", 404)
+        return {'direccion': direccion, 'latitud': latitud, 'longitud': longitud, 'nodo': nodo}
+
+    def _modo(self, parametros: Dict[str, object]) -> Callable:
+        """ Devuelve la función de peso del parámetro modo ("rapida" si no se da).
+
+        Raises:
+            PeticionIncorrecta: Si el modo no existe
+        """
+        modo = parametros.get('modo', 'rapida')
+        if modo not in MODOS:
+            raise PeticionIncorrecta(f"Modo de ruta desconocido: {modo}. Los modos son {', '.join(MODOS)}.")
+        return MODOS[modo]
+
+    async def salud(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Estado del servicio y tamaño del grafo cargado. """
+        respuesta = {'estado': 'ok', 'vertices': self.grafo.n, 'aristas': self.grafo.m}
+        if self.cache is not None:
+            respuesta['cache'] = {**self.cache.estadisticas, **self.cache.memoria()}
+        return respuesta
+
+    async def metricas(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Tiempos por etapa y por petición y contadores acumulados (metricas.instantanea), y perfil si lo hay. """
+        respuesta = metricas.instantanea()
+        perfil = metricas.perfil()
+        if perfil:
+            respuesta['perfil'] = perfil
+        return respuesta
+
+    async def direccion(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Coordenadas y vértice más cercano del parámetro direccion. """
+        return self._localiza(parametros.get('direccion'))
+
+    async def autocompleta(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Direcciones que mejor encajan con el parámetro texto, escrito a medias o con erratas (autocompletado.py). """
+        texto = parametros.get('texto')
+        if not isinstance(texto, str):
+            raise PeticionIncorrecta("Falta el texto.")
+        try:
+            limite = int(parametros.get('limite', 5))
+        except (TypeError, ValueError):
+            raise PeticionIncorrecta("El límite tiene que ser un número entero.")
+        return {'texto': texto, 'sugerencias': self.autocompletado.busca(texto, min(max(limite, 0), 50))}
+
+    async def _camino(self, parametros: Dict[str, object]) -> Tuple[Dict, Dict, Callable, List[object]]:
+        """ Localiza el origen y el destino y calcula el camino mínimo entre ellos en otro hilo o proceso. """
+        origen = self._localiza(parametros.get('origen'))
+        destino = self._localiza(parametros.get('destino'))
+        funcion = self._modo(parametros)
+        i_origen, i_destino = self.grafo.indice[origen['nodo']], self.grafo.indice[destino['nodo']]
+        bucle = asyncio.get_running_loop()
+        # Con hilos la búsqueda se cuenta en la petición; los procesos no la comparten
+        busqueda = metricas.propaga(_busca_camino) if self.cache is not None else _busca_camino
+        try:
+            with metricas.etapa('busqueda_camino'):
+                camino = await bucle.run_in_executor(self._busquedas, busqueda, funcion.__name__, i_origen, i_destino)
+        except ValueError:
+            raise PeticionIncorrecta(
+                f"No hay camino posible que vaya de {origen['direccion']} hasta {destino['direccion']}.", 404)
+        return origen, destino, funcion, camino
+
+    async def ruta(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Camino mínimo entre los parámetros origen y destino en el modo dado, con su coste y coordenadas. """
+        origen, destino, funcion, camino = await self._camino(parametros)
+        pesos = self.grafo.pesos[funcion.__name__]
+        coste = sum(float(pesos[self.grafo.arista(u, v)]) for u, v in zip(camino[:-1], camino[1:]))
+        return {'origen': origen, 'destino': destino, 'modo': funcion.__name__, 'coste': coste,
+                'nodos': self.grafo.camino_original(camino),
+                'coordenadas': [[float(self.grafo.y[i]), float(self.grafo.x[i])] for i in camino]}
+
+    async def instrucciones(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Pasos (gps.pasos_ruta) e instrucciones en texto del camino mínimo entre origen y destino. """
+        origen, destino, funcion, camino = await self._camino(parametros)
+        nodos = self.grafo.camino_original(camino)
+        pasos = await asyncio.get_running_loop().run_in_executor(None, metricas.propaga(gps.pasos_ruta), self.grafo, nodos, funcion)
+        return {'origen': origen, 'destino': destino, 'modo': funcion.__name__, 'pasos': pasos,
+                'instrucciones': gps.formatea_pasos(pasos)}
+
+    async def mapa(self, parametros: Dict[str, object]) -> Tuple[bytes, str]:
+        """ Imagen (PNG o SVG, según el parámetro formato) del camino mínimo entre origen y destino. """
+        formato = parametros.get('formato', 'png')
+        if formato not in ('png', 'svg'):
+            raise PeticionIncorrecta(f"Formato de imagen no soportado: {formato}.")
+        _, _, _, camino = await self._camino(parametros)
+        bucle = asyncio.get_running_loop()
+        async with self._cerrojo_mapa:
+            if self._mapa is None:
+                self._mapa = await bucle.run_in_executor(None, MapaBase, self.grafo)
+        imagen = await bucle.run_in_executor(None, metricas.propaga(self._mapa.dibuja_ruta), camino, formato)
+        return imagen, 'image/png' if formato == 'png' else 'image/svg+xml'
+
+    async def isocrona(self, parametros: Dict[str, object]) -> Dict[str, object]:
+        """ Zonas (GeoJSON) a las que se llega desde origen, o desde cualquiera de origenes, sin superar cada umbral. """
+        direcciones = parametros['origenes'] if 'origenes' in parametros else [parametros.get('origen')]
+        if not isinstance(direcciones, list) or not direcciones:
+            raise PeticionIncorrecta("El parámetro origenes tiene que ser una lista de direcciones.")
+        origenes = [self._localiza(direccion) for direccion in direcciones]
+        funcion = self._modo(parametros)
+        umbrales = parametros.get('umbrales')
+        if isinstance(umbrales, str):
+            # En la URL los umbrales se separan con comas
+            umbrales = umbrales.split(',')
+        try:
+            umbrales = [float(umbral) for umbral in umbrales]
+        except (TypeError, ValueError):
+            raise PeticionIncorrecta("Los umbrales tienen que ser una lista de números.")
+        if not umbrales or min(umbrales) < 0:
+            raise PeticionIncorrecta("Los umbrales tienen que ser una lista de números positivos.")
+        forma = parametros.get('forma', 'concava')
+        if forma not in isocronas.FORMAS:
+            raise PeticionIncorrecta(f"Forma de isocrona no soportada: {forma}. Las formas son {', '.join(isocronas.FORMAS)}.")
+        resultado = await asyncio.get_running_loop().run_in_executor(
+            None, metricas.propaga(isocronas.isocronas), self.grafo, funcion.__name__, [origen['nodo'] for origen in origenes],
+            umbrales, forma, True)
+        return {'origenes': origenes, 'modo': funcion.__name__, **isocronas.a_geojson(resultado[0])}
+
+    async def atiende(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+        """ Atiende las peticiones HTTP/1.1 de una conexión, que se mantiene abierta mientras el
+        cliente no pida cerrarla.
+
+        Args:
+            lector (asyncio.StreamReader): flujo de entrada de la conexión
+            escritor (asyncio.StreamWriter): flujo de salida de la conexión
+        Returns: None
+        """
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, objetivo, version = linea.decode('latin-1').split()
+                except ValueError:
+                    break
+                cabeceras = {}
+                while True:
+                    linea = await lector.readline()
+                    if linea in (b'\r\n', b'\n', b''):
+                        break
+                    clave, _, valor = linea.decode('latin-1').partition(':')
+                    cabeceras[clave.strip().lower()] = valor.strip()
+                try:
+                    longitud = int(cabeceras.get('content-length', 0) or 0)
+                except ValueError:
+                    longitud = -1
+                # Si no se lee el cuerpo la conexión ya no está sincronizada y hay que cerrarla
+                leido = False
+                if longitud < 0:
+                    estado, respuesta = 400, {'error': "La cabecera Content-Length no es válida."}
+                elif longitud > TAMANO_MAXIMO_CUERPO:
+                    estado, respuesta = 413, {'error': "El cuerpo de la petición es demasiado grande."}
+                else:
+                    cuerpo = await lector.readexactly(longitud) if longitud else b''
+                    leido = True
+                    estado, respuesta = await self.responde(metodo, objetivo, cuerpo)
+                mantener = version == 'HTTP/1.1' and cabeceras.get('connection', '').lower() != 'close' and leido
+                if isinstance(respuesta, tuple):
+                    # Respuesta binaria (una imagen) con su tipo
+                    datos, tipo = respuesta
+                else:
+                    datos, tipo = json.dumps(respuesta, ensure_ascii=False).encode('utf-8'), "application/json; charset=utf-8"
+                escritor.write(f"HTTP/1.1 {estado} {ESTADOS_HTTP[estado]}\r\n"
+                               f"Content-Type: {tipo}\r\n"
+                               f"Content-Length: {len(datos)}\r\n"
+                               f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n".encode('latin-1') + datos)
+                await escritor.drain()
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+    async def responde(self, metodo: str, objetivo: str, cuerpo: bytes) -> Tuple[int, object]:
+        """ Calcula la respuesta de una petición y, si las métricas están activadas, escribe su
+        línea de registro con el código de respuesta.
+
+        Args:
+            metodo (str): método HTTP
+            objetivo (str): ruta y parámetros de la URL
+            cuerpo (bytes): cuerpo de la petición (JSON o vacío)
+        Returns:
+            Tuple[int,object]: código HTTP y objeto JSON de la respuesta (o los bytes de una
+                imagen junto con su tipo)
+        """
+        url = urllib.parse.urlsplit(objetivo)
+        with metricas.peticion(url.path, metodo=metodo):
+            estado, respuesta = await self._responde(metodo, url, cuerpo)
+            metricas.anota(estado=estado)
+        return estado, respuesta
+
+    async def _responde(self, metodo: str, url: urllib.parse.SplitResult, cuerpo: bytes) -> Tuple[int, object]:
+        """ Calcula la respuesta de una petición a una URL ya separada en sus partes (ver responde). """
+        if url.path not in self.rutas:
+            return 404, {'error': f"No existe la ruta {url.path}."}
+        if metodo not in ('GET', 'POST'):
+            return 405, {'error': f"Método no permitido: {metodo}."}
+        parametros = {clave: valores[0] for clave, valores in urllib.parse.parse_qs(url.query).items()}
+        try:
+            if cuerpo:
+                try:
+                    datos = json.loads(cuerpo)
+                except ValueError:
+                    raise PeticionIncorrecta("El cuerpo de la petición no es un JSON válido.")
+                if not isinstance(datos, dict):
+                    raise PeticionIncorrecta("El cuerpo de la petición tiene que ser un objeto JSON.")
+                parametros.update(datos)
+            return 200, await self.rutas[url.path](parametros)
+        except PeticionIncorrecta as error:
+            return error.estado, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+
+
+async def sirve(servicio: ServicioGPS, host: str, puerto: int) -> None:
+    """ Atiende peticiones HTTP en host:puerto hasta que se interrumpa.
+
+    Args:
+        servicio (ServicioGPS): servicio con los datos cargados
+        host (str): dirección en la que escuchar
+        puerto (int): puerto en el que escuchar
+    Returns: None
+    """
+    servidor = await asyncio.start_server(servicio.atiende, host, puerto)
+    print(f"Servicio GPS escuchando en http://{host}:{puerto}")
+    async with servidor:
+        await servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='dirección en la que escuchar')
+    parser.add_argument('--puerto', type=int, default=8080, help='puerto en el que escuchar')
+    parser.add_argument('--procesos', type=int, default=0,
+                        help='procesos para las búsquedas de caminos (0 para usar hilos del propio proceso)')
+    parser.add_argument('--metricas', action='store_true', help='mide las etapas de cada petición y las registra')
+    parser.add_argument('--perfil', action='store_true', help='perfila además las peticiones con cProfile')
+    args = parser.parse_args()
+
+    if args.metricas or args.perfil:
+        metricas.activa(perfilar=args.perfil)
+
+    print("Cargando el grafo y el callejero...")
+    servicio = ServicioGPS.carga(args.procesos)
+    try:
+        asyncio.run(sirve(servicio, args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servicio.cierra()